@@ -0,0 +1,185 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Event driven audio capture handing out windows as soon as they fill up."""
+
+import threading
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+try:
+  import sounddevice as sd
+except (ImportError, OSError) as e:
+  sd = None
+  sd_error = e
+
+
+class AudioCapture(object):
+  """Captures audio into a ring buffer and yields overlapping windows.
+
+  The audio device's callback writes every block it records into a ring
+  buffer and wakes up the consumer once the next window is complete, i.e.
+  once `hop` new samples arrived after the previous one. The consumer sleeps
+  in between instead of polling. Windows are timestamped by the index of
+  their first sample, so their timestamps don't drift or jitter with the
+  scheduling of the consumer.
+
+  Attributes:
+    overruns: Number of times the device reported input samples lost before
+      they reached the callback.
+    underruns: Number of times the device reported an input underflow.
+    skipped_windows: Number of windows skipped because the consumer fell
+      more than the ring buffer behind the device.
+  """
+
+  def __init__(self,
+               sample_rate: int,
+               window_size: int,
+               hop: int,
+               num_channels: int = 1,
+               capacity: Optional[int] = None,
+               device: Optional[Any] = None) -> None:
+    """Initializes the capture. The device isn't opened until `start()`.
+
+    Args:
+      sample_rate: Sample rate in Hz.
+      window_size: Number of samples per window.
+      hop: Number of samples between the starts of consecutive windows.
+      num_channels: Number of channels to record. They are averaged into one.
+      capacity: Number of samples the ring buffer holds. Defaults to 4
+        windows.
+      device: The sounddevice input device, or None for the default one.
+    """
+    if hop < 1 or window_size < 1:
+      raise ValueError('window_size and hop must be positive.')
+    self.sample_rate = sample_rate
+    self.window_size = window_size
+    self.hop = hop
+    self._num_channels = num_channels
+    self._device = device
+    self._capacity = max(capacity or 4 * window_size, window_size + hop)
+    self._ring = np.zeros(self._capacity, np.float32)
+    self._window = np.empty(window_size, np.float32)
+    self._condition = threading.Condition()
+    self._stream = None
+    # Number of samples written since the start, and index of the first
+    # sample of the next window.
+    self._written = 0
+    self._next_start = 0
+    self._closed = False
+    self.overruns = 0
+    self.underruns = 0
+    self.skipped_windows = 0
+
+  def start(self) -> None:
+    """Opens the input device and starts recording."""
+    if sd is None:
+      raise sd_error
+    self._stream = sd.InputStream(
+        samplerate=self.sample_rate,
+        channels=self._num_channels,
+        dtype='float32',
+        device=self._device,
+        callback=self._callback)
+    self._stream.start()
+
+  def stop(self) -> None:
+    """Stops recording and ends the iteration of `windows()`."""
+    if self._stream is not None:
+      self._stream.stop()
+      self._stream.close()
+      self._stream = None
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+
+  def __enter__(self) -> 'AudioCapture':
+    self.start()
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.stop()
+
+  def timestamp_ms(self, sample_index: int) -> int:
+    """Returns the time of a sample since the start of the recording."""
+    return sample_index * 1000 // self.sample_rate
+
+  def windows(
+      self,
+      timeout: Optional[float] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yields each window as soon as its last sample has been recorded.
+
+    Args:
+      timeout: Max time in seconds to wait for a window, after which the
+        iteration ends. Waits forever if None.
+
+    Yields:
+      The index of the first sample of the window since the start of the
+      recording, and the window. The array is reused by the next window.
+    """
+    while True:
+      with self._condition:
+        window_end = self._next_start + self.window_size
+        if not self._condition.wait_for(
+            lambda: self._closed or self._written >= window_end, timeout):
+          return
+        if self._closed:
+          return
+        # If the device got ahead by more than the ring buffer, the oldest
+        # windows were overwritten. Skip to the oldest complete window still
+        # there, keeping the windows aligned on the hop.
+        oldest_start = self._written - self._capacity
+        if self._next_start < oldest_start:
+          skipped = -(-(oldest_start - self._next_start) // self.hop)
+          self.skipped_windows += skipped
+          self._next_start += skipped * self.hop
+        start = self._next_start
+        self._copy_window(start)
+        self._next_start += self.hop
+      yield start, self._window
+
+  def stats(self) -> Dict[str, int]:
+    """Returns the overrun, underrun and skipped window counts."""
+    with self._condition:
+      return {
+          'overruns': self.overruns,
+          'underruns': self.underruns,
+          'skipped_windows': self.skipped_windows,
+      }
+
+  def _copy_window(self, start: int) -> None:
+    ring_start = start % self._capacity
+    first_part = min(self.window_size, self._capacity - ring_start)
+    self._window[:first_part] = self._ring[ring_start:ring_start + first_part]
+    self._window[first_part:] = self._ring[:self.window_size - first_part]
+
+  def _callback(self, data: np.ndarray, frames: int, time_info: Any,
+                status: Any) -> None:
+    """Receives each block of samples recorded by the device."""
+    del time_info  # Unused.
+    samples = data[:, 0] if data.shape[1] == 1 else data.mean(axis=1)
+    # Only the end of a block larger than the ring buffer can be kept.
+    kept = samples[-self._capacity:]
+    with self._condition:
+      if status.input_overflow:
+        self.overruns += 1
+      if status.input_underflow:
+        self.underruns += 1
+      ring_start = (self._written + frames - len(kept)) % self._capacity
+      first_part = min(len(kept), self._capacity - ring_start)
+      self._ring[ring_start:ring_start + first_part] = kept[:first_part]
+      self._ring[:len(kept) - first_part] = kept[first_part:]
+      self._written += frames
+      if self._written >= self._next_start + self.window_size:
+        self._condition.notify_all()
@@ -14,12 +14,11 @@
 """Main scripts to run audio classification."""
 
 import argparse
-import time
 
 from mediapipe.tasks import python
-from mediapipe.tasks.python.audio.core import audio_record
 from mediapipe.tasks.python.components import containers
 from mediapipe.tasks.python import audio
+from capture import AudioCapture
 from utils import Plotter
 
 
@@ -56,48 +55,41 @@ def run(model: str, max_results: int, score_threshold: float,
       result_callback=save_result)
   classifier = audio.AudioClassifier.create_from_options(options)
 
-  # Initialize the audio recorder and a tensor to store the audio input.
+  # Initialize the audio capture and a tensor to store the audio input.
   # The sample rate may need to be changed to match your input device.
   # For example, an AT2020 requires sample_rate 44100.
   buffer_size, sample_rate, num_channels = 15600, 16000, 1
   audio_format = containers.AudioDataFormat(num_channels, sample_rate)
-  record = audio_record.AudioRecord(num_channels, sample_rate, buffer_size)
   audio_data = containers.AudioData(buffer_size, audio_format)
 
-  # We'll try to run inference every interval_between_inference seconds.
-  # This is usually half of the model's input length to create an overlapping
+  # Run inference every time `hop` new samples have been recorded. The hop is
+  # usually half of the model's input length to create an overlapping
   # between incoming audio segments to improve classification accuracy.
-  input_length_in_second = float(len(
-      audio_data.buffer)) / audio_data.audio_format.sample_rate
-  interval_between_inference = input_length_in_second * (1 - overlapping_factor)
-  pause_time = interval_between_inference * 0.1
-  last_inference_time = time.time()
-
-  # Start audio recording in the background.
-  record.start_recording()
+  hop = max(round(buffer_size * (1 - overlapping_factor)), 1)
+  capture = AudioCapture(sample_rate, buffer_size, hop, num_channels)
 
   # Loop until the user close the classification results plot.
-  while True:
-    # Wait until at least interval_between_inference seconds has passed since
-    # the last inference.
-    now = time.time()
-    diff = now - last_inference_time
-    if diff < interval_between_inference:
-      time.sleep(pause_time)
-      continue
-    last_inference_time = now
-
-    # Load the input audio from the AudioRecord instance and run classify.
-    data = record.read(buffer_size)
-    # audio_data.load_from_array(data.astype(np.float32))
-    audio_data.load_from_array(data)
-    classifier.classify_async(audio_data, round(last_inference_time * 1000))
-
-    # # Plot the classification results.
-    if classification_result_list:
-      print(classification_result_list)
-      plotter.plot(classification_result_list[0])
-      classification_result_list.clear()
+  try:
+    with capture:
+      for start_sample, window in capture.windows():
+        # Run classify on the window, timestamped by its first sample.
+        audio_data.load_from_array(window)
+        classifier.classify_async(audio_data,
+                                  capture.timestamp_ms(start_sample))
+
+        # Plot the classification results.
+        if classification_result_list:
+          print(classification_result_list)
+          plotter.plot(classification_result_list[0])
+          classification_result_list.clear()
+
+        # Stop when the user closes the plot window.
+        if plotter.closed:
+          break
+  finally:
+    plotter.close()
+    print('Audio capture: {overruns} overruns, {underruns} underruns, '
+          '{skipped_windows} skipped windows'.format(**capture.stats()))
 
 
 def main():
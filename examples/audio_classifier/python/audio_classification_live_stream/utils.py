@@ -12,15 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """A module with util functions."""
-import sys
+import multiprocessing
+import queue
+from typing import Any, List, Tuple
 
 from mediapipe.tasks.python import audio
 from matplotlib import rcParams
 import matplotlib.pyplot as plt
 
 rcParams.update({
-    # Set the plot left margin so that the labels are visible.
-    'figure.subplot.left': 0.3,
+    # The labels are drawn over the bars, so only keep a small left margin.
+    'figure.subplot.left': 0.05,
 
     # Hide the bottom toolbar.
     'toolbar': 'None'
@@ -28,41 +30,140 @@ rcParams.update({
 
 
 class Plotter(object):
-  """An util class to display the classification results."""
+  """An util class to display the classification results.
 
-  _PAUSE_TIME = 0.05
-  """Time for matplotlib to wait for UI event."""
+  The chart is drawn by a separate process, so plotting never blocks the
+  audio loop. `plot()` only queues the labels and scores of a result. The
+  plotting process redraws at most `refresh_rate` times per second, only
+  shows the newest result queued since its last redraw, and drops the
+  others.
+  """
 
-  def __init__(self) -> None:
-    fig, self._axes = plt.subplots()
-    fig.canvas.manager.set_window_title('Audio classification')
-
-    # Stop the program when the ESC key is pressed.
-    def event_callback(event):
-      if event.key == 'escape':
-        sys.exit(0)
+  def __init__(self, refresh_rate: float = 10) -> None:
+    """Opens the plot window in a new process.
 
-    fig.canvas.mpl_connect('key_press_event', event_callback)
+    Args:
+      refresh_rate: Max number of times per second the chart is redrawn.
+    """
+    # Spawn rather than fork, so the GUI toolkit starts from a clean process.
+    context = multiprocessing.get_context('spawn')
+    self._results = context.Queue()
+    self._closed = context.Event()
+    self._process = context.Process(
+        target=_run_plot_window,
+        args=(self._results, self._closed, refresh_rate),
+        daemon=True)
+    self._process.start()
 
-    plt.show(block=False)
+  @property
+  def closed(self) -> bool:
+    """Whether the plot window was closed, e.g. with the ESC key."""
+    return self._closed.is_set() or not self._process.is_alive()
 
   def plot(self, result: audio.AudioClassifierResult) -> None:
     """Plot the audio classification result.
+
+    Returns immediately. The result is drawn with the next redraw of the
+    chart, unless a newer one arrives first.
+
     Args:
       result: Classification results returned by an audio classification
         model.
     """
-    # Clear the axes
-    self._axes.cla()
+    classification = result.classifications[0]
+    self._results.put([(category.category_name, category.score)
+                       for category in classification.categories])
+
+  def close(self) -> None:
+    """Closes the plot window."""
+    self._closed.set()
+    self._process.join(timeout=1)
+
+
+class _BarChart(object):
+  """A horizontal bar chart updated in place with blitting.
+
+  The bars and their labels are created once, and each update only changes
+  their widths and texts, then redraws them over a saved background instead
+  of redrawing the whole figure.
+  """
+
+  def __init__(self) -> None:
+    self._figure, self._axes = plt.subplots()
+    self._figure.canvas.manager.set_window_title('Audio classification')
     self._axes.set_title('Press ESC to exit.')
     self._axes.set_xlim((0, 1))
+    self._axes.set_yticks([])
+    self._bars = []
+    self._labels = []
+    self._background = None
+    # The background has to be saved again whenever the whole figure is
+    # redrawn, e.g. after the window is resized.
+    self._figure.canvas.mpl_connect('draw_event', self._save_background)
 
-    # Plot the results so that the most probable category comes at the top.
-    classification = result.classifications[0]
-    label_list = [category.category_name
-                  for category in classification.categories]
-    score_list = [category.score for category in classification.categories]
-    self._axes.barh(label_list[::-1], score_list[::-1])
+  @property
+  def canvas(self) -> Any:
+    return self._figure.canvas
+
+  def update(self, rows: List[Tuple[str, float]]) -> None:
+    """Shows the label and score of each row, the first one at the top."""
+    if len(rows) != len(self._bars):
+      self._create_bars(len(rows))
+    for bar, label, (name, score) in zip(self._bars, self._labels, rows):
+      bar.set_width(score)
+      label.set_text('{} ({:.2f})'.format(name, score))
+    if self._background is None:
+      return
+    canvas = self._figure.canvas
+    canvas.restore_region(self._background)
+    for artist in self._bars + self._labels:
+      self._axes.draw_artist(artist)
+    canvas.blit(self._axes.bbox)
+
+  def _create_bars(self, num_bars: int) -> None:
+    for artist in self._bars + self._labels:
+      artist.remove()
+    positions = list(range(num_bars - 1, -1, -1))
+    self._bars = list(
+        self._axes.barh(positions, [0] * num_bars, animated=True))
+    self._labels = [
+        self._axes.text(0.01, position, '', va='center', animated=True)
+        for position in positions
+    ]
+    self._axes.set_ylim((-0.5, max(num_bars, 1) - 0.5))
+    # Draw the figure without the bars to save the background.
+    self._figure.canvas.draw()
+
+  def _save_background(self, event: Any) -> None:
+    del event  # Unused.
+    self._background = self._figure.canvas.copy_from_bbox(self._axes.bbox)
+
+
+def _run_plot_window(results: multiprocessing.Queue,
+                     closed: multiprocessing.Event,
+                     refresh_rate: float) -> None:
+  """Shows the results sent through a queue until the window is closed."""
+  chart = _BarChart()
+
+  # Stop the program when the ESC key is pressed.
+  def event_callback(event):
+    if event.key == 'escape':
+      closed.set()
+
+  chart.canvas.mpl_connect('key_press_event', event_callback)
+  chart.canvas.mpl_connect('close_event', lambda event: closed.set())
+  plt.show(block=False)
 
-    # Wait for the UI event.
-    plt.pause(self._PAUSE_TIME)
+  period = 1 / refresh_rate
+  while not closed.is_set():
+    # Handle the UI events until the next redraw.
+    chart.canvas.start_event_loop(period)
+    rows = None
+    while True:
+      try:
+        rows = results.get_nowait()
+      except queue.Empty:
+        break
+    if rows is not None:
+      chart.update(rows)
+  plt.close('all')
@@ -0,0 +1,216 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Classifies recorded audio in overlapping windows, faster than real time."""
+
+import sys
+import wave
+from typing import Any, Iterator, List, Optional, Tuple
+
+import numpy as np
+from mediapipe.tasks.python import audio
+from mediapipe.tasks.python.components import containers
+
+# Sample rate and number of samples of the model input.
+MODEL_SAMPLE_RATE = 16000
+MODEL_INPUT_SIZE = 15600
+
+# Duration of audio decoded at once, in seconds.
+_CHUNK_SECONDS = 30
+
+
+def _decode_pcm(data: bytes, sample_width: int,
+                num_channels: int) -> np.ndarray:
+  """Decodes little endian PCM samples to mono float32 in [-1, 1]."""
+  if sample_width == 1:
+    samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128) / 128
+  elif sample_width == 2:
+    samples = np.frombuffer(data, '<i2').astype(np.float32) / (1 << 15)
+  elif sample_width == 3:
+    # Place the 3 bytes of each sample in the upper bytes of an int32.
+    padded = np.zeros((len(data) // 3, 4), np.uint8)
+    padded[:, 1:] = np.frombuffer(data, np.uint8).reshape(-1, 3)
+    samples = padded.view('<i4')[:, 0].astype(np.float32) / (1 << 31)
+  elif sample_width == 4:
+    samples = np.frombuffer(data, '<i4').astype(np.float32) / (1 << 31)
+  else:
+    raise ValueError('Unsupported sample width: {} bytes.'.format(sample_width))
+  if num_channels > 1:
+    samples = samples.reshape(-1, num_channels).mean(axis=1)
+  return samples
+
+
+class PcmReader(object):
+  """Reads a WAV file, or raw PCM audio, as chunks of mono samples.
+
+  Attributes:
+    sample_rate: Sample rate of the audio in Hz.
+  """
+
+  def __init__(self,
+               path: str,
+               sample_rate: Optional[int] = None,
+               num_channels: int = 1,
+               sample_width: int = 2) -> None:
+    """Opens the audio.
+
+    Files starting with a RIFF header are read as WAV files, whose header
+    gives their format. Anything else is read as raw little endian PCM.
+
+    Args:
+      path: Path of the audio file, or `-` to read raw PCM from stdin.
+      sample_rate: Sample rate of raw PCM audio in Hz.
+      num_channels: Number of interleaved channels of raw PCM audio. They are
+        averaged into one.
+      sample_width: Number of bytes per sample of raw PCM audio.
+    """
+    self._wave = None
+    if path == '-':
+      self._file = sys.stdin.buffer
+    else:
+      self._file = open(path, 'rb')
+      if self._file.peek(4)[:4] == b'RIFF':
+        self._wave = wave.open(self._file)
+        sample_rate = self._wave.getframerate()
+        num_channels = self._wave.getnchannels()
+        sample_width = self._wave.getsampwidth()
+    if not sample_rate:
+      raise ValueError('The sample rate of raw PCM audio must be given.')
+    self.sample_rate = sample_rate
+    self._num_channels = num_channels
+    self._sample_width = sample_width
+
+  def chunks(self, num_samples: int) -> Iterator[np.ndarray]:
+    """Yields the audio as float32 chunks of up to `num_samples` samples."""
+    frame_size = self._num_channels * self._sample_width
+    while True:
+      if self._wave is not None:
+        data = self._wave.readframes(num_samples)
+      else:
+        data = self._file.read(num_samples * frame_size)
+      # Drop an incomplete last frame.
+      data = data[:len(data) - len(data) % frame_size]
+      if not data:
+        return
+      yield _decode_pcm(data, self._sample_width, self._num_channels)
+
+  def close(self) -> None:
+    if self._wave is not None:
+      self._wave.close()
+    if self._file is not sys.stdin.buffer:
+      self._file.close()
+
+  def __enter__(self) -> 'PcmReader':
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+def sliding_windows(chunks: Iterator[np.ndarray], window_size: int,
+                    hop: int) -> Iterator[Tuple[int, np.ndarray, int]]:
+  """Splits a stream of samples into overlapping windows.
+
+  The windows of each chunk are a strided view of the samples, so no sample
+  is copied per window. The samples at the end of the stream that no full
+  window covers get a last, zero padded window.
+
+  Args:
+    chunks: Consecutive chunks of samples.
+    window_size: Number of samples per window.
+    hop: Number of samples between the starts of consecutive windows.
+
+  Yields:
+    The index of the first sample of the first window, an (N, window_size)
+    array of windows, which is only valid until the next one is requested,
+    and the index of the sample after the last one the windows cover, which
+    is before the end of the zero padded window.
+  """
+  if hop < 1:
+    raise ValueError('The hop must be at least one sample.')
+  buffer = np.zeros(0, np.float32)
+  # Index of the first sample of `buffer` in the stream.
+  offset = 0
+  # Index of the sample after the end of the last window.
+  covered = 0
+  for chunk in chunks:
+    buffer = np.concatenate((buffer, chunk)) if len(buffer) else chunk
+    if len(buffer) < window_size:
+      continue
+    windows = np.lib.stride_tricks.sliding_window_view(
+        buffer, window_size)[::hop]
+    covered = offset + (len(windows) - 1) * hop + window_size
+    yield offset, windows, covered
+    consumed = len(windows) * hop
+    buffer = buffer[consumed:]
+    offset += consumed
+
+  if offset + len(buffer) > covered:
+    last_window = np.zeros((1, window_size), np.float32)
+    last_window[0, :len(buffer)] = buffer
+    yield offset, last_window, offset + len(buffer)
+
+
+def _classify_batch(classifier: audio.AudioClassifier, windows: np.ndarray,
+                    sample_rate: int) -> List[Any]:
+  """Returns the classification result of each window."""
+  if sample_rate == MODEL_SAMPLE_RATE and windows.shape[1] == MODEL_INPUT_SIZE:
+    # In AUDIO_CLIPS mode the classifier splits a clip into consecutive model
+    # inputs, so windows laid end to end are classified in a single call.
+    results = classifier.classify(
+        containers.AudioData.create_from_array(windows.reshape(-1),
+                                               sample_rate))
+    if len(results) != len(windows):
+      raise RuntimeError(
+          'Expected one result per window, got {} results for {} windows.'
+          .format(len(results), len(windows)))
+    return results
+  # Otherwise the classifier resamples each window to the model input.
+  return [
+      classifier.classify(
+          containers.AudioData.create_from_array(
+              np.ascontiguousarray(window), sample_rate))[0]
+      for window in windows
+  ]
+
+
+def classify_file(classifier: audio.AudioClassifier, reader: PcmReader,
+                  overlapping_factor: float,
+                  batch_size: int = 32) -> Iterator[Tuple[float, float, Any]]:
+  """Classifies an audio stream in overlapping windows.
+
+  Args:
+    classifier: An audio classifier in AUDIO_CLIPS mode.
+    reader: The audio to classify.
+    overlapping_factor: Overlap between adjacent windows, in [0, 1).
+    batch_size: Max number of windows classified in one call.
+
+  Yields:
+    The start and end time of each window in milliseconds, and its
+    classification result. The last window ends with the audio, even if it
+    was padded to the full window size.
+  """
+  sample_rate = reader.sample_rate
+  window_size = round(MODEL_INPUT_SIZE * sample_rate / MODEL_SAMPLE_RATE)
+  hop = max(round(window_size * (1 - overlapping_factor)), 1)
+  chunk_size = max(sample_rate * _CHUNK_SECONDS, window_size)
+  for offset, windows, end_sample in sliding_windows(
+      reader.chunks(chunk_size), window_size, hop):
+    for start in range(0, len(windows), batch_size):
+      batch = windows[start:start + batch_size]
+      results = _classify_batch(classifier, batch, sample_rate)
+      for index, result in enumerate(results, start):
+        start_sample = offset + index * hop
+        yield (start_sample * 1000 / sample_rate,
+               min(start_sample + window_size, end_sample) * 1000 /
+               sample_rate, result)
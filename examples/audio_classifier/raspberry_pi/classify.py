@@ -14,17 +14,82 @@
 """Main scripts to run audio classification."""
 
 import argparse
+import contextlib
+import sys
 import time
+from typing import Any, Dict, Optional
 
 from mediapipe.tasks import python
-from mediapipe.tasks.python.audio.core import audio_record
 from mediapipe.tasks.python.components import containers
 from mediapipe.tasks.python import audio
-from utils import Plotter
+from audio_file import classify_file
+from audio_file import PcmReader
+from capture import AudioCapture
+from sinks import create_sink
+
+
+def result_to_record(start_ms: float, end_ms: float,
+                     result: audio.AudioClassifierResult) -> Dict[str, Any]:
+  """Returns a classification result as a JSON serializable dict."""
+  return {
+      'start_ms': round(start_ms, 1),
+      'end_ms': round(end_ms, 1),
+      'categories': [{
+          'index': category.index,
+          'category_name': category.category_name,
+          'score': category.score,
+      } for category in result.classifications[0].categories],
+  }
+
+
+def run_file(model: str, max_results: int, score_threshold: float,
+             overlapping_factor: float, input_file: str, sample_rate: int,
+             output_path: str, socket_path: Optional[str],
+             metrics_port: Optional[int]) -> None:
+  """Classifies recorded audio and writes a label track as JSON Lines.
+
+  Args:
+    model: Name of the TFLite audio classification model.
+    max_results: Maximum number of classification results per window.
+    score_threshold: The score threshold of classification results.
+    overlapping_factor: Overlapping between adjacent windows.
+    input_file: Path of a WAV file, or of raw 16-bit mono PCM audio. `-`
+      reads raw PCM from stdin.
+    sample_rate: Sample rate of raw PCM audio.
+    output_path: Path of the JSON Lines file to write, `-` for stdout.
+    socket_path: Path of a Unix socket to also stream the results to, or
+      None.
+    metrics_port: Port to serve Prometheus metrics on, or None.
+  """
+  # Initialize the audio classification model.
+  base_options = python.BaseOptions(model_asset_path=model)
+  options = audio.AudioClassifierOptions(
+      base_options=base_options, running_mode=audio.RunningMode.AUDIO_CLIPS,
+      max_results=max_results, score_threshold=score_threshold)
+
+  start_time = time.time()
+  end_ms = 0
+  with contextlib.ExitStack() as stack:
+    classifier = stack.enter_context(
+        audio.AudioClassifier.create_from_options(options))
+    reader = stack.enter_context(PcmReader(input_file, sample_rate))
+    # Results come much faster than in real time, so don't flush each one.
+    sink = stack.enter_context(
+        create_sink(output_path, socket_path, metrics_port, flush=False))
+    for start_ms, end_ms, result in classify_file(classifier, reader,
+                                                  overlapping_factor):
+      sink.write(result_to_record(start_ms, end_ms, result))
+
+  elapsed_time = time.time() - start_time
+  print('Classified {:.1f} s of audio in {:.1f} s ({:.0f}x real time)'.format(
+      end_ms / 1000, elapsed_time,
+      end_ms / 1000 / elapsed_time if elapsed_time else 0), file=sys.stderr)
 
 
 def run(model: str, max_results: int, score_threshold: float,
-        overlapping_factor: float) -> None:
+        overlapping_factor: float, input_file: Optional[str],
+        sample_rate: int, output_path: Optional[str], headless: bool,
+        socket_path: Optional[str], metrics_port: Optional[int]) -> None:
   """Continuously run inference on audio data acquired from the device.
 
   Args:
@@ -32,6 +97,14 @@ def run(model: str, max_results: int, score_threshold: float,
     max_results: Maximum number of classification results to display.
     score_threshold: The score threshold of classification results.
     overlapping_factor: Target overlapping between adjacent inferences.
+    input_file: Path of recorded audio to classify instead of the
+      microphone, or None.
+    sample_rate: Sample rate of raw PCM `input_file` audio.
+    output_path: Path of the JSON Lines file the results are written to, `-`
+      for stdout. Defaults to stdout when there is no plot.
+    headless: Whether to run without plotting the results.
+    socket_path: Path of a Unix socket to stream the results to, or None.
+    metrics_port: Port to serve Prometheus metrics on, or None.
   """
 
   if (overlapping_factor < 0) or (overlapping_factor >= 1.0):
@@ -40,14 +113,45 @@ def run(model: str, max_results: int, score_threshold: float,
   if (score_threshold < 0) or (score_threshold > 1.0):
     raise ValueError('Score threshold must be between (inclusive) 0 and 1.')
 
-  # Initialize a plotter instance to display the classification results.
-  plotter = Plotter()
+  if input_file:
+    run_file(model, max_results, score_threshold, overlapping_factor,
+             input_file, sample_rate, output_path or '-', socket_path,
+             metrics_port)
+    return
+
+  plotter = None
+  if not headless:
+    # Import the plotter only when it's used, as it loads a GUI toolkit and
+    # matplotlib.
+    from utils import Plotter  # pylint: disable=g-import-not-at-top
+
+    # Initialize a plotter instance to display the classification results.
+    plotter = Plotter()
+  elif not output_path and not socket_path and not metrics_port:
+    output_path = '-'
+
+  # Initialize the audio capture and a tensor to store the audio input.
+  # The sample rate may need to be changed to match your input device.
+  # For example, an AT2020 requires sample_rate 44100.
+  buffer_size, sample_rate, num_channels = 15600, 16000, 1
+  audio_format = containers.AudioDataFormat(num_channels, sample_rate)
+  audio_data = containers.AudioData(buffer_size, audio_format)
+  window_ms = buffer_size * 1000 / sample_rate
+
+  # Run inference every time `hop` new samples have been recorded. The hop is
+  # usually half of the model's input length to create an overlapping
+  # between incoming audio segments to improve classification accuracy.
+  hop = max(round(buffer_size * (1 - overlapping_factor)), 1)
+  capture = AudioCapture(sample_rate, buffer_size, hop, num_channels)
+  sink = create_sink(output_path, socket_path, metrics_port, capture.stats)
 
   classification_result_list = []
 
   def save_result(result: audio.AudioClassifierResult, timestamp_ms: int):
     result.timestamp_ms = timestamp_ms
-    classification_result_list.append(result)
+    sink.write(result_to_record(timestamp_ms, timestamp_ms + window_ms, result))
+    if plotter is not None:
+      classification_result_list.append(result)
 
   # Initialize the audio classification model.
   base_options = python.BaseOptions(model_asset_path=model)
@@ -57,48 +161,37 @@ def run(model: str, max_results: int, score_threshold: float,
       result_callback=save_result)
   classifier = audio.AudioClassifier.create_from_options(options)
 
-  # Initialize the audio recorder and a tensor to store the audio input.
-  # The sample rate may need to be changed to match your input device.
-  # For example, an AT2020 requires sample_rate 44100.
-  buffer_size, sample_rate, num_channels = 15600, 16000, 1
-  audio_format = containers.AudioDataFormat(num_channels, sample_rate)
-  record = audio_record.AudioRecord(num_channels, sample_rate, buffer_size)
-  audio_data = containers.AudioData(buffer_size, audio_format)
+  # Loop until the user close the classification results plot, or until
+  # interrupted when headless.
+  try:
+    with capture:
+      for start_sample, window in capture.windows():
+        # Run classify on the window, timestamped by its first sample.
+        audio_data.load_from_array(window)
+        classifier.classify_async(audio_data,
+                                  capture.timestamp_ms(start_sample))
 
-  # We'll try to run inference every interval_between_inference seconds.
-  # This is usually half of the model's input length to create an overlapping
-  # between incoming audio segments to improve classification accuracy.
-  input_length_in_second = float(len(
-      audio_data.buffer)) / audio_data.audio_format.sample_rate
-  interval_between_inference = input_length_in_second * (1 - overlapping_factor)
-  pause_time = interval_between_inference * 0.1
-  last_inference_time = time.time()
-
-  # Start audio recording in the background.
-  record.start_recording()
-
-  # Loop until the user close the classification results plot.
-  while True:
-    # Wait until at least interval_between_inference seconds has passed since
-    # the last inference.
-    now = time.time()
-    diff = now - last_inference_time
-    if diff < interval_between_inference:
-      time.sleep(pause_time)
-      continue
-    last_inference_time = now
-
-    # Load the input audio from the AudioRecord instance and run classify.
-    data = record.read(buffer_size)
-    # audio_data.load_from_array(data.astype(np.float32))
-    audio_data.load_from_array(data)
-    classifier.classify_async(audio_data, time.time_ns() // 1_000_000)
-
-    # Plot the classification results.
-    if classification_result_list:
-      # print(classification_result_list)
-      plotter.plot(classification_result_list[0])
-      classification_result_list.clear()
+        if plotter is None:
+          continue
+
+        # Plot the classification results.
+        if classification_result_list:
+          plotter.plot(classification_result_list[0])
+          classification_result_list.clear()
+
+        # Stop when the user closes the plot window.
+        if plotter.closed:
+          break
+  except KeyboardInterrupt:
+    pass
+  finally:
+    classifier.close()
+    sink.close()
+    if plotter is not None:
+      plotter.close()
+    print('Audio capture: {overruns} overruns, {underruns} underruns, '
+          '{skipped_windows} skipped windows'.format(**capture.stats()),
+          file=sys.stderr)
 
 
 def main():
@@ -124,10 +217,46 @@ def main():
       help='The score threshold of classification results.',
       required=False,
       default=0.0)
+  parser.add_argument(
+      '--inputFile',
+      help='Path of a WAV file, or of raw 16-bit mono PCM audio, to classify '
+           'instead of the microphone. Use - to read raw PCM from stdin.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--sampleRate',
+      help='Sample rate of raw PCM audio given by --inputFile.',
+      required=False,
+      type=int,
+      default=16000)
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON Lines file to write the results to, or - to '
+           'write to stdout. Defaults to stdout with --inputFile, and with '
+           '--headless when neither --socket nor --metricsPort is set.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--headless',
+      help='Run without plotting the results, e.g. on a device without a '
+           'display.',
+      action='store_true')
+  parser.add_argument(
+      '--socket',
+      help='Path of a Unix socket to stream the results to as JSON Lines.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--metricsPort',
+      help='Port to serve Prometheus metrics of the results on.',
+      required=False,
+      type=int,
+      default=None)
   args = parser.parse_args()
 
   run(args.model, int(args.maxResults), float(args.scoreThreshold),
-      float(args.overlappingFactor))
+      float(args.overlappingFactor), args.inputFile, args.sampleRate,
+      args.output, args.headless, args.socket, args.metricsPort)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,289 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Outputs for classification results that don't need a display."""
+
+import abc
+import http.server
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+
+class ResultSink(abc.ABC):
+  """Receives classification results, one JSON serializable dict each.
+
+  Results are dicts with the `start_ms` and `end_ms` of the classified audio
+  and its `categories`, each with an `index`, `category_name` and `score`.
+  Sinks are thread safe, so results can be written from a task's result
+  callback.
+  """
+
+  @abc.abstractmethod
+  def write(self, record: Dict[str, Any]) -> None:
+    """Outputs one result."""
+
+  def close(self) -> None:
+    """Releases the resources of the sink."""
+
+  def __enter__(self) -> 'ResultSink':
+    return self
+
+  def __exit__(self, *args) -> None:
+    self.close()
+
+
+class JsonLinesSink(ResultSink):
+  """Writes each result as a line of JSON to a file or stdout."""
+
+  def __init__(self, output_path: str, flush: bool = True) -> None:
+    """Opens the output.
+
+    Args:
+      output_path: Path of the file to write, `-` for stdout.
+      flush: Whether to flush every line, so that readers of a pipe see each
+        result as soon as it's written.
+    """
+    self._output = sys.stdout if output_path == '-' else open(output_path, 'w')
+    self._flush = flush
+    self._lock = threading.Lock()
+
+  def write(self, record: Dict[str, Any]) -> None:
+    line = json.dumps(record) + '\n'
+    with self._lock:
+      self._output.write(line)
+      if self._flush:
+        self._output.flush()
+
+  def close(self) -> None:
+    with self._lock:
+      if self._output is sys.stdout:
+        self._output.flush()
+      else:
+        self._output.close()
+
+
+def _remove_socket_file(path: str) -> None:
+  """Removes a socket file, leaving any other kind of file in place."""
+  try:
+    mode = os.lstat(path).st_mode
+  except FileNotFoundError:
+    return
+  if not stat.S_ISSOCK(mode):
+    raise FileExistsError(
+        '{} exists and is not a socket, not replacing it.'.format(path))
+  os.unlink(path)
+
+
+class UnixSocketSink(ResultSink):
+  """Streams results as JSON lines to every client of a Unix socket.
+
+  Clients can connect and disconnect at any time, e.g. with
+  `socat - UNIX-CONNECT:<path>`. A client that doesn't read fast enough to
+  keep up is disconnected rather than slowing down classification.
+  """
+
+  def __init__(self, socket_path: str) -> None:
+    """Starts listening on the socket.
+
+    Args:
+      socket_path: Path of the socket file to create. An existing socket
+        file at that path is replaced.
+
+    Raises:
+      FileExistsError: Something other than a socket exists at the path.
+    """
+    _remove_socket_file(socket_path)
+    self._socket_path = socket_path
+    self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._server.bind(socket_path)
+    self._server.listen()
+    self._clients = []
+    self._lock = threading.Lock()
+    threading.Thread(target=self._accept, daemon=True).start()
+
+  def write(self, record: Dict[str, Any]) -> None:
+    data = (json.dumps(record) + '\n').encode('utf-8')
+    with self._lock:
+      for client in list(self._clients):
+        try:
+          sent = client.send(data)
+        except OSError:
+          sent = 0
+        # Never wait for a client, even if that costs it a partial line.
+        if sent != len(data):
+          self._clients.remove(client)
+          client.close()
+
+  def close(self) -> None:
+    with self._lock:
+      for client in self._clients:
+        client.close()
+      self._clients = []
+    self._server.close()
+    try:
+      _remove_socket_file(self._socket_path)
+    except FileExistsError:
+      # The socket was replaced by another file since, keep it.
+      pass
+
+  def _accept(self) -> None:
+    while True:
+      try:
+        client, _ = self._server.accept()
+      except OSError:
+        # The server socket was closed.
+        return
+      client.setblocking(False)
+      with self._lock:
+        self._clients.append(client)
+
+
+class PrometheusSink(ResultSink):
+  """Serves the latest scores and result counts for Prometheus to scrape.
+
+  The metrics are served over HTTP on `/metrics`. They are the score of each
+  category of the latest result, the number of results, the end time of the
+  latest result and any counters returned by `stats_fn`.
+  """
+
+  def __init__(self,
+               port: int,
+               host: str = '127.0.0.1',
+               stats_fn: Optional[Callable[[], Dict[str, int]]] = None,
+               prefix: str = 'audio_classification') -> None:
+    """Starts serving the metrics.
+
+    Args:
+      port: Port to serve the metrics on.
+      host: Address to listen on. Only accepts local connections by
+        default, use an empty string to listen on all interfaces.
+      stats_fn: Returns extra counters to export, e.g. audio overruns.
+      prefix: Prefix of the metric names.
+    """
+    self._stats_fn = stats_fn
+    self._prefix = prefix
+    self._lock = threading.Lock()
+    self._scores = {}
+    self._result_count = 0
+    self._last_end_ms = 0.0
+
+    sink = self
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+      def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path != '/metrics':
+          self.send_error(404)
+          return
+        content = sink.to_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+      def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        pass
+
+    self._server = http.server.ThreadingHTTPServer((host, port),
+                                                   MetricsHandler)
+    self._server.daemon_threads = True
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+  def write(self, record: Dict[str, Any]) -> None:
+    with self._lock:
+      self._scores = {
+          category['category_name']: category['score']
+          for category in record['categories']
+      }
+      self._result_count += 1
+      self._last_end_ms = record['end_ms']
+
+  def to_prometheus(self) -> str:
+    """Returns the metrics in the Prometheus text exposition format."""
+    prefix = self._prefix
+    with self._lock:
+      lines = [
+          '# HELP {}_score Score of each category in the latest result.'
+          .format(prefix),
+          '# TYPE {}_score gauge'.format(prefix),
+      ]
+      for name, score in self._scores.items():
+        lines.append('{}_score{{category="{}"}} {:g}'.format(
+            prefix, name.replace('\\', '\\\\').replace('"', '\\"'), score))
+      lines += [
+          '# HELP {}_results_total Number of classification results.'.format(
+              prefix),
+          '# TYPE {}_results_total counter'.format(prefix),
+          '{}_results_total {}'.format(prefix, self._result_count),
+          '# HELP {}_last_result_end_seconds End of the audio classified by '
+          'the latest result.'.format(prefix),
+          '# TYPE {}_last_result_end_seconds gauge'.format(prefix),
+          '{}_last_result_end_seconds {:g}'.format(prefix,
+                                                   self._last_end_ms / 1000),
+      ]
+    if self._stats_fn is not None:
+      for name, value in self._stats_fn().items():
+        lines += [
+            '# TYPE {}_{}_total counter'.format(prefix, name),
+            '{}_{}_total {}'.format(prefix, name, value),
+        ]
+    return '\n'.join(lines) + '\n'
+
+  def close(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+
+
+class MultiSink(ResultSink):
+  """Writes each result to several sinks."""
+
+  def __init__(self, sinks: List[ResultSink]) -> None:
+    self._sinks = sinks
+
+  def write(self, record: Dict[str, Any]) -> None:
+    for sink in self._sinks:
+      sink.write(record)
+
+  def close(self) -> None:
+    for sink in self._sinks:
+      sink.close()
+
+
+def create_sink(output_path: Optional[str],
+                socket_path: Optional[str] = None,
+                metrics_port: Optional[int] = None,
+                stats_fn: Optional[Callable[[], Dict[str, int]]] = None,
+                flush: bool = True) -> ResultSink:
+  """Creates a sink writing to each of the given outputs.
+
+  Args:
+    output_path: Path of a JSON Lines file to write, `-` for stdout, or None.
+    socket_path: Path of a Unix socket to stream results to, or None.
+    metrics_port: Port to serve Prometheus metrics on, or None.
+    stats_fn: Returns extra counters to export as metrics.
+    flush: Whether to flush the JSON Lines output after every result.
+  """
+  sinks = []
+  if output_path:
+    sinks.append(JsonLinesSink(output_path, flush))
+  if socket_path:
+    sinks.append(UnixSocketSink(socket_path))
+  if metrics_port:
+    sinks.append(PrometheusSink(metrics_port, stats_fn=stats_fn))
+  return MultiSink(sinks)
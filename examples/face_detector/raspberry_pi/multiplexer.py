@@ -0,0 +1,352 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs one vision task over several video sources with a shared model pool."""
+
+import collections
+import math
+import threading
+import time
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from metrics import LatencyHistogram
+
+
+def open_source(source: str) -> cv2.VideoCapture:
+  """Opens a camera id such as `0`, a video file or a stream URL."""
+  return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+
+def is_file_source(source: str) -> bool:
+  """Returns whether a source is a video file rather than a live stream."""
+  return not source.isdigit() and '://' not in source
+
+
+class Stream(object):
+  """A video source whose frames are captured on their own thread.
+
+  Only the newest captured frame waits for a model. A frame captured while
+  the previous one is still waiting replaces it, so a stream never builds up
+  a backlog, however slow the models are.
+
+  Attributes:
+    name: Name of the stream, shown in the mosaic and the summary.
+    source: The camera id, video file or stream URL.
+    weight: Share of the model time the stream gets when models are busy,
+      relative to the other streams.
+    captured: Number of frames captured.
+    processed: Number of frames that got a result.
+    superseded: Number of frames replaced by a newer one before a model
+      picked them up.
+    latency: Time from capturing a frame to getting its result.
+    inference: Time the model took per frame.
+    image: The newest frame that got a result, or None.
+    result: The result of `image`.
+    finished: Whether the source ended or failed.
+    error: Why the source failed, or why the model last failed on one of its
+      frames, or None.
+  """
+
+  def __init__(self, name: str, source: str, weight: float = 1.0,
+               fps_window: int = 10) -> None:
+    if weight <= 0:
+      raise ValueError('The weight of a stream must be positive.')
+    self.name = name
+    self.source = source
+    self.weight = weight
+    self.captured = 0
+    self.processed = 0
+    self.superseded = 0
+    self.latency = LatencyHistogram()
+    self.inference = LatencyHistogram()
+    self.image = None
+    self.result = None
+    self.finished = False
+    self.error = None
+    self._result_times = collections.deque(maxlen=fps_window + 1)
+    # Guarded by the multiplexer's condition.
+    self._pending = None
+    self._busy = False
+    self._credit = 0.0
+
+  @property
+  def fps(self) -> float:
+    """Rate at which results came back over the last few results."""
+    if len(self._result_times) < 2:
+      return 0.0
+    elapsed_time = self._result_times[-1] - self._result_times[0]
+    return (len(self._result_times) - 1) / elapsed_time if elapsed_time else 0.0
+
+
+class Multiplexer(object):
+  """Schedules the frames of several streams onto a fixed pool of models.
+
+  Each stream is captured on its own thread, and each model instance runs on
+  its own worker thread, so N cameras need a fixed number of models instead
+  of one per camera. Whenever a worker is free, it takes the newest frame of
+  the ready stream picked by smooth weighted round-robin, so every stream
+  gets its share of the model time in proportion to its weight, and a stream
+  never has more than one frame in a model at once, which keeps its results
+  in order.
+
+  The tasks run in IMAGE mode, so a model instance can alternate between
+  streams without mixing up their timestamps.
+  """
+
+  def __init__(self,
+               sources: Sequence[str],
+               create_task: Callable[[], Any],
+               method_name: str,
+               num_workers: int = 2,
+               weights: Optional[Sequence[float]] = None,
+               width: Optional[int] = None,
+               height: Optional[int] = None,
+               result_callback: Optional[Callable[[Stream, Any],
+                                                  None]] = None) -> None:
+    """Initializes the multiplexer. Nothing is opened until `start()`.
+
+    Args:
+      sources: Camera ids, video files or stream URLs.
+      create_task: Creates a task instance in IMAGE mode.
+      method_name: Name of the task method processing an image, e.g.
+        `detect`.
+      num_workers: Number of task instances, each on its own thread.
+      weights: Relative share of the model time of each source. All sources
+        get the same share if None.
+      width: The width of the frames to capture from cameras, if set.
+      height: The height of the frames to capture from cameras, if set.
+      result_callback: Called from a worker thread with the stream and the
+        result of each frame.
+    """
+    if num_workers < 1:
+      raise ValueError('num_workers must be a positive integer.')
+    weights = weights or [1.0] * len(sources)
+    if len(weights) != len(sources):
+      raise ValueError('Expected one weight per source.')
+    self.streams = [
+        Stream('{}: {}'.format(i, source), source, weight)
+        for i, (source, weight) in enumerate(zip(sources, weights))
+    ]
+    self._create_task = create_task
+    self._method_name = method_name
+    self._num_workers = num_workers
+    self._width = width
+    self._height = height
+    self._result_callback = result_callback
+    self._condition = threading.Condition()
+    self._stop_event = threading.Event()
+    self._updated = False
+    self._tasks = []
+    self._threads = []
+
+  def start(self) -> None:
+    """Creates the task instances and starts capturing every stream."""
+    self._tasks = [self._create_task() for _ in range(self._num_workers)]
+    for stream in self.streams:
+      self._start_thread(self._capture, stream)
+    for task in self._tasks:
+      self._start_thread(self._work, task)
+
+  def stop(self) -> None:
+    """Stops all threads and closes the task instances."""
+    self._stop_event.set()
+    with self._condition:
+      self._condition.notify_all()
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+    for task in self._tasks:
+      task.close()
+    self._tasks = []
+
+  @property
+  def done(self) -> bool:
+    """Whether every stream ended and all their frames were processed."""
+    with self._condition:
+      return all(stream.finished and stream._pending is None and
+                 not stream._busy for stream in self.streams)
+
+  def wait_for_results(self, timeout: float) -> bool:
+    """Waits until a new result arrives.
+
+    Args:
+      timeout: Max time to wait in seconds.
+
+    Returns:
+      Whether any stream got a new result since the last call.
+    """
+    with self._condition:
+      self._condition.wait_for(lambda: self._updated, timeout)
+      updated, self._updated = self._updated, False
+      return updated
+
+  def latest_results(self) -> List[Tuple[Stream, Optional[np.ndarray], Any]]:
+    """Returns each stream with its newest processed frame and its result.
+
+    The frames are shared with the multiplexer, so copy them before drawing
+    on them.
+    """
+    with self._condition:
+      return [(stream, stream.image, stream.result) for stream in self.streams]
+
+  def summary(self) -> str:
+    """Returns a human readable table of the statistics of each stream."""
+    with self._condition:
+      return self._summary()
+
+  def _summary(self) -> str:
+    lines = ['{:<24}{:>9}{:>10}{:>11}{:>7}{:>12}{:>12}'.format(
+        'stream', 'captured', 'processed', 'superseded', 'fps', 'p50 ms',
+        'p95 ms')]
+    for stream in self.streams:
+      lines.append('{:<24.24}{:>9}{:>10}{:>11}{:>7.1f}{:>12.1f}{:>12.1f}'
+                   .format(stream.name, stream.captured, stream.processed,
+                           stream.superseded, stream.fps,
+                           stream.latency.percentile(50),
+                           stream.latency.percentile(95)))
+      if stream.error:
+        lines.append('  ' + stream.error)
+    return '\n'.join(lines)
+
+  def _start_thread(self, target: Callable[..., None], *args) -> None:
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    self._threads.append(thread)
+
+  def _capture(self, stream: Stream) -> None:
+    cap = open_source(stream.source)
+    if self._width and self._height and not is_file_source(stream.source):
+      cap.set(cv2.CAP_PROP_FRAME_WIDTH, self._width)
+      cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self._height)
+    # Video files are read at their own frame rate, like a camera would
+    # deliver them, rather than as fast as they can be decoded.
+    frame_interval = 0.0
+    if is_file_source(stream.source):
+      frame_interval = 1 / (cap.get(cv2.CAP_PROP_FPS) or 30)
+    next_frame_time = time.perf_counter()
+    try:
+      while not self._stop_event.is_set():
+        success, image = cap.read()
+        if not success:
+          if not is_file_source(stream.source) or not stream.captured:
+            stream.error = 'Unable to read from {}.'.format(stream.source)
+          return
+        capture_time = time.perf_counter()
+        # Mirror cameras like the single camera view does, so the same scene
+        # gives the same results in both.
+        if stream.source.isdigit():
+          image = cv2.flip(image, 1)
+        with self._condition:
+          if stream._pending is not None:
+            stream.superseded += 1
+          stream._pending = (capture_time, image)
+          stream.captured += 1
+          self._condition.notify_all()
+        if frame_interval:
+          next_frame_time += frame_interval
+          self._stop_event.wait(max(next_frame_time - time.perf_counter(), 0))
+    finally:
+      cap.release()
+      with self._condition:
+        stream.finished = True
+        self._updated = True
+        self._condition.notify_all()
+
+  def _next_frame(self) -> Optional[Tuple[Stream, float, np.ndarray]]:
+    """Waits for the next frame to process, picked by weighted round-robin.
+
+    Returns None once the multiplexer is stopping.
+    """
+    with self._condition:
+      while not self._stop_event.is_set():
+        ready = [
+            stream for stream in self.streams
+            if stream._pending is not None and not stream._busy
+        ]
+        if not ready:
+          self._condition.wait(0.1)
+          continue
+        # Smooth weighted round-robin: every ready stream earns credit in
+        # proportion to its weight, and the one with the most credit pays
+        # the total back, so picks interleave instead of coming in bursts.
+        total_weight = sum(stream.weight for stream in ready)
+        for stream in ready:
+          stream._credit += stream.weight
+        stream = max(ready, key=lambda s: s._credit)
+        stream._credit -= total_weight
+        capture_time, image = stream._pending
+        stream._pending = None
+        stream._busy = True
+        return stream, capture_time, image
+      return None
+
+  def _work(self, task: Any) -> None:
+    process = getattr(task, self._method_name)
+    while True:
+      item = self._next_frame()
+      if item is None:
+        return
+      stream, capture_time, image = item
+      error = None
+      processed = False
+      try:
+        start_time = time.perf_counter()
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        result = process(mp.Image(image_format=mp.ImageFormat.SRGB,
+                                  data=rgb_image))
+        end_time = time.perf_counter()
+        if self._result_callback is not None:
+          self._result_callback(stream, result)
+        processed = True
+      except Exception as e:  # pylint: disable=broad-except
+        # A frame the model can't handle mustn't take the worker down, or
+        # leave its stream marked busy so that no worker picks it up again.
+        error = 'Failed to process a frame of {}: {}'.format(stream.source, e)
+      finally:
+        with self._condition:
+          if processed:
+            stream.inference.record((end_time - start_time) * 1000)
+            stream.latency.record((end_time - capture_time) * 1000)
+            stream._result_times.append(end_time)
+            stream.image, stream.result = image, result
+            stream.processed += 1
+          elif error:
+            stream.error = error
+          stream._busy = False
+          self._updated = True
+          self._condition.notify_all()
+
+
+def mosaic(images: List[Optional[np.ndarray]], tile_width: int,
+           tile_height: int) -> np.ndarray:
+  """Tiles images into a near square grid, leaving missing images black.
+
+  Args:
+    images: BGR images of any size, or None for an empty tile.
+    tile_width: Width each image is resized to.
+    tile_height: Height each image is resized to.
+  """
+  columns = math.ceil(math.sqrt(len(images)))
+  rows = math.ceil(len(images) / columns)
+  canvas = np.zeros((rows * tile_height, columns * tile_width, 3), np.uint8)
+  for i, image in enumerate(images):
+    if image is None:
+      continue
+    top, left = (i // columns) * tile_height, (i % columns) * tile_width
+    canvas[top:top + tile_height, left:left + tile_width] = cv2.resize(
+        image, (tile_width, tile_height))
+  return canvas
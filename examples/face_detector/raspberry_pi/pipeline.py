@@ -0,0 +1,634 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A threaded capture, preprocess, inference and render pipeline."""
+
+import collections
+import dataclasses
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from metrics import PipelineMetrics
+
+CAMERA_ERROR = (
+    'ERROR: Unable to read from webcam. Please verify your webcam settings.')
+
+
+@dataclasses.dataclass
+class Frame:
+  """A camera frame travelling through the pipeline.
+
+  Attributes:
+    index: Sequence number of the frame since the pipeline started.
+    timestamp_ms: Capture time in milliseconds, strictly increasing.
+    image: The BGR image. Mirrored by the preprocess stage, then drawn on by
+      the render stage.
+    rgb_image: The mirrored RGB image the model input is created from, at the
+      model input size if an `InputScaler` shrank it.
+    mp_image: The model input, until it has been submitted to the model.
+    ready_time: `time.perf_counter()` value when preprocessing finished.
+    skip_inference: Whether the frame goes to the render stage without being
+      sent to the model, with the previous result drawn on it.
+  """
+  index: int = 0
+  timestamp_ms: int = 0
+  image: Optional[np.ndarray] = None
+  rgb_image: Optional[np.ndarray] = None
+  mp_image: Optional[mp.Image] = None
+  ready_time: float = 0.0
+  skip_inference: bool = False
+
+
+class FramePool(object):
+  """A fixed set of frames whose image buffers are reused.
+
+  A frame allocates its buffers the first time it is filled, at the size of
+  the camera image, and keeps reusing them once it is released back to the
+  pool. At 1280x720 this saves several MB of allocations per camera frame.
+  """
+
+  def __init__(self, size: int) -> None:
+    """Initializes the pool.
+
+    Args:
+      size: Number of frames in the pool. It must cover every frame that can
+        be held by the pipeline stages and queues at once.
+    """
+    self._free_frames = queue.Queue()
+    for _ in range(size):
+      self._free_frames.put(Frame())
+
+  def acquire(self, timeout: float) -> Optional[Frame]:
+    """Returns a free frame, or None if none was released before the timeout.
+    """
+    try:
+      return self._free_frames.get(timeout=timeout)
+    except queue.Empty:
+      return None
+
+  def release(self, frame: Frame) -> None:
+    """Returns a frame to the pool once no stage uses it anymore."""
+    frame.mp_image = None
+    self._free_frames.put(frame)
+
+
+def _put_latest(frame_queue: queue.Queue, item: Frame) -> List[Frame]:
+  """Puts an item into a bounded queue, discarding the oldest ones if full.
+
+  Args:
+    frame_queue: The queue to put the item into.
+    item: The item to put.
+
+  Returns:
+    The items discarded to make room.
+  """
+  discarded = []
+  while True:
+    try:
+      frame_queue.put_nowait(item)
+      return discarded
+    except queue.Full:
+      try:
+        discarded.append(frame_queue.get_nowait())
+      except queue.Empty:
+        pass
+
+
+class AdmissionController(object):
+  """Limits the number of frames being processed by a LIVE_STREAM task.
+
+  At most `max_in_flight` frames are submitted to the task without their
+  result having come back. Frames offered while the task is busy wait in a
+  single slot, where a newer frame always replaces an older one, so the
+  latency between capture and result stays bounded under load.
+
+  Frames marked with `skip_inference` pass through the same slot, so that
+  all frames leave it in capture order, but they don't wait for the task,
+  and never replace a waiting frame that needs the task.
+
+  Attributes:
+    completed: Number of frames whose result came back.
+    superseded: Number of frames replaced by a newer frame before they were
+      submitted to the task.
+    dropped: Number of frames submitted to the task whose result never came
+      back.
+  """
+
+  def __init__(self, max_in_flight: int = 1,
+               result_timeout_ms: int = 1000) -> None:
+    """Initializes the controller.
+
+    Args:
+      max_in_flight: Max number of frames submitted to the task at once.
+      result_timeout_ms: Time after which a submitted frame without a result
+        is counted as dropped and its slot is released.
+    """
+    if max_in_flight < 1:
+      raise ValueError('max_in_flight must be a positive integer.')
+    self._max_in_flight = max_in_flight
+    self._result_timeout = result_timeout_ms / 1000
+    self._condition = threading.Condition()
+    self._pending = None
+    # Maps the timestamp of each frame in flight to its submission time.
+    self._in_flight = collections.OrderedDict()
+    self.completed = 0
+    self.superseded = 0
+    self.dropped = 0
+
+  def offer(self, frame: Frame) -> Optional[Frame]:
+    """Queues a frame for submission, replacing any frame still waiting.
+
+    Returns:
+      The frame that was replaced, or the offered frame itself if it skips
+      inference and a frame that doesn't is waiting.
+    """
+    with self._condition:
+      if (frame.skip_inference and self._pending is not None and
+          not self._pending.skip_inference):
+        # The waiting frame is the one the motion gate compares against, so
+        # the skipped frame barely differs from it.
+        return frame
+      superseded_frame, self._pending = self._pending, frame
+      if (superseded_frame is not None and
+          not superseded_frame.skip_inference):
+        self.superseded += 1
+      self._condition.notify_all()
+      return superseded_frame
+
+  def take(self, timeout: float) -> Optional[Frame]:
+    """Waits until a frame can be submitted to the task and returns it.
+
+    Args:
+      timeout: Max time to wait in seconds.
+
+    Returns:
+      The newest waiting frame, or None if the timeout expired first. A
+      frame that skips inference is returned right away and doesn't count
+      as in flight.
+    """
+    deadline = time.monotonic() + timeout
+    with self._condition:
+      while True:
+        self._expire_in_flight()
+        if self._pending is not None and self._pending.skip_inference:
+          frame, self._pending = self._pending, None
+          return frame
+        if (self._pending is not None and
+            len(self._in_flight) < self._max_in_flight):
+          frame, self._pending = self._pending, None
+          self._in_flight[frame.timestamp_ms] = time.monotonic()
+          return frame
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return None
+        self._condition.wait(min(remaining, self._result_timeout))
+
+  def complete(self, timestamp_ms: int) -> None:
+    """Marks the frame with the given timestamp as done.
+
+    Call this from the task's result callback.
+    """
+    with self._condition:
+      # Results come back in timestamp order, so any frame submitted before
+      # this one that is still in flight was dropped by the task.
+      while self._in_flight:
+        in_flight_timestamp_ms = next(iter(self._in_flight))
+        if in_flight_timestamp_ms > timestamp_ms:
+          break
+        del self._in_flight[in_flight_timestamp_ms]
+        if in_flight_timestamp_ms == timestamp_ms:
+          self.completed += 1
+        else:
+          self.dropped += 1
+      self._condition.notify_all()
+
+  def record_superseded(self, count: int) -> None:
+    """Counts frames discarded before they were offered to the controller."""
+    with self._condition:
+      self.superseded += count
+
+  @property
+  def in_flight(self) -> int:
+    """Number of frames submitted to the task without a result yet."""
+    with self._condition:
+      return len(self._in_flight)
+
+  def _expire_in_flight(self) -> None:
+    expiry_time = time.monotonic() - self._result_timeout
+    while self._in_flight:
+      timestamp_ms, submit_time = next(iter(self._in_flight.items()))
+      if submit_time > expiry_time:
+        break
+      del self._in_flight[timestamp_ms]
+      self.dropped += 1
+
+
+class MotionGate(object):
+  """Skips the model on frames that barely differ from the last one it saw.
+
+  Frames are compared on a small grayscale copy, so the check costs a tiny
+  fraction of a color conversion at full size. A frame passes when enough of
+  its pixels changed since the last frame that passed, or when `heartbeat_s`
+  elapsed since then, so results still refresh in a static scene. Comparing
+  against the last frame that passed rather than the previous one lets slow
+  changes add up until they count.
+
+  Attributes:
+    frames: Number of frames checked.
+    skipped: Number of frames that didn't pass.
+  """
+
+  def __init__(self,
+               threshold: float,
+               heartbeat_s: float = 1.0,
+               pixel_threshold: int = 16,
+               size: Tuple[int, int] = (64, 48)) -> None:
+    """Initializes the gate.
+
+    Args:
+      threshold: Min fraction of changed pixels for a frame to pass.
+      heartbeat_s: Max time in seconds between two frames that pass.
+      pixel_threshold: Min change of the brightness of a pixel, out of 255,
+        for it to count as changed.
+      size: Width and height of the copy the frames are compared on.
+    """
+    self._threshold = threshold
+    self._heartbeat_s = heartbeat_s
+    self._pixel_threshold = pixel_threshold
+    self._size = size
+    self._reference = None
+    self._pass_time = 0.0
+    self.frames = 0
+    self.skipped = 0
+
+  def should_process(self, image: np.ndarray) -> bool:
+    """Returns whether a BGR frame changed enough to be sent to the model."""
+    gray = cv2.cvtColor(
+        cv2.resize(image, self._size, interpolation=cv2.INTER_AREA),
+        cv2.COLOR_BGR2GRAY)
+    now = time.monotonic()
+    self.frames += 1
+    if (self._reference is not None and
+        now - self._pass_time < self._heartbeat_s):
+      changed_pixels = np.count_nonzero(
+          cv2.absdiff(gray, self._reference) > self._pixel_threshold)
+      if changed_pixels < self._threshold * gray.size:
+        self.skipped += 1
+        return False
+    self._reference = gray
+    self._pass_time = now
+    return True
+
+  @property
+  def skip_ratio(self) -> float:
+    """Fraction of the frames that didn't pass."""
+    return self.skipped / self.frames if self.frames else 0.0
+
+  def summary(self) -> str:
+    """Returns a human readable count of the skipped frames."""
+    return 'Frames skipped by the motion gate: {} of {} ({:.0%})'.format(
+        self.skipped, self.frames, self.skip_ratio)
+
+
+def model_input_size(model_path: str) -> Optional[Tuple[int, int]]:
+  """Returns the width and height of the image input of a TFLite model.
+
+  Returns None if the model can't be read, e.g. for a task bundle rather
+  than a plain TFLite model.
+  """
+  try:
+    # pylint: disable=g-import-not-at-top
+    from mediapipe.tasks.metadata import schema_py_generated as schema_fb
+    with open(model_path, 'rb') as f:
+      model = schema_fb.Model.GetRootAs(f.read(), 0)
+    subgraph = model.Subgraphs(0)
+    shape = subgraph.Tensors(subgraph.Inputs(0)).ShapeAsNumpy()
+  except Exception:  # pylint: disable=broad-except
+    return None
+  # Image inputs are laid out as [batch, height, width, channels].
+  if len(shape) != 4 or shape[1] < 1 or shape[2] < 1:
+    return None
+  return int(shape[2]), int(shape[1])
+
+
+@dataclasses.dataclass
+class LetterboxTransform:
+  """Maps model input coordinates back to the frame a model input came from.
+
+  Attributes:
+    scale: Ratio of the size of the resized frame to the original frame.
+    pad_x: Width of the padding left of the resized frame.
+    pad_y: Height of the padding above the resized frame.
+    width: Width of the model input.
+    height: Height of the model input.
+    frame_width: Width of the frame.
+    frame_height: Height of the frame.
+  """
+  scale: float
+  pad_x: int
+  pad_y: int
+  width: int
+  height: int
+  frame_width: int
+  frame_height: int
+
+  def to_frame(self, x: float, y: float) -> Tuple[float, float]:
+    """Maps a point in model input pixels to frame pixels."""
+    return (x - self.pad_x) / self.scale, (y - self.pad_y) / self.scale
+
+  def to_frame_image(self, image: np.ndarray) -> np.ndarray:
+    """Maps an image of the model input size, e.g. a mask, to the frame."""
+    new_width = max(round(self.frame_width * self.scale), 1)
+    new_height = max(round(self.frame_height * self.scale), 1)
+    cropped = image[self.pad_y:self.pad_y + new_height,
+                    self.pad_x:self.pad_x + new_width]
+    return cv2.resize(cropped, (self.frame_width, self.frame_height),
+                      interpolation=cv2.INTER_LINEAR)
+
+
+class InputScaler(object):
+  """Shrinks frames to the model input size before they are converted.
+
+  Each frame is resized once, keeping its aspect ratio, and centered on a
+  black canvas of the model input size, so the color conversion and the copy
+  made by `mp.Image` work on a few hundred KB instead of several MB, and the
+  task doesn't resize it again. The task's result callback gets the
+  transform of each frame from `pop_transform()` to map its results back to
+  the frame.
+
+  Attributes:
+    size: The width and height frames are scaled to.
+  """
+
+  def __init__(self, input_size: Tuple[int, int]) -> None:
+    """Initializes the scaler.
+
+    Args:
+      input_size: Width and height of the model input.
+    """
+    self._lock = threading.Lock()
+    # Maps the timestamp of each scaled frame to its transform.
+    self._transforms = collections.OrderedDict()
+    self.size = input_size
+
+  def scale(self, image: np.ndarray, timestamp_ms: int,
+            dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Returns a BGR frame letterboxed to the input size and made RGB.
+
+    Args:
+      image: The BGR frame.
+      timestamp_ms: Timestamp the frame will be sent to the model with.
+      dst: A buffer to reuse for the result if it has the right size.
+    """
+    width, height = self.size
+    frame_height, frame_width = image.shape[:2]
+    scale = min(width / frame_width, height / frame_height)
+    new_width = max(round(frame_width * scale), 1)
+    new_height = max(round(frame_height * scale), 1)
+    pad_x, pad_y = (width - new_width) // 2, (height - new_height) // 2
+    # Bilinear resizing is several times faster than area averaging, and is
+    # what the task would otherwise do to the full frame.
+    resized = cv2.resize(image, (new_width, new_height),
+                         interpolation=cv2.INTER_LINEAR)
+    cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=resized)
+    if dst is None or dst.shape != (height, width, 3):
+      dst = np.zeros((height, width, 3), np.uint8)
+    else:
+      dst.fill(0)
+    dst[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+    with self._lock:
+      self._transforms[timestamp_ms] = LetterboxTransform(
+          scale, pad_x, pad_y, width, height, frame_width, frame_height)
+    return dst
+
+  def pop_transform(self, timestamp_ms: int) -> Optional[LetterboxTransform]:
+    """Returns the transform of the frame with the given timestamp.
+
+    Call this from the task's result callback. Returns None if the frame
+    wasn't scaled.
+    """
+    with self._lock:
+      # Results come back in timestamp order, so older frames were dropped.
+      while self._transforms and next(iter(self._transforms)) < timestamp_ms:
+        self._transforms.popitem(last=False)
+      return self._transforms.pop(timestamp_ms, None)
+
+
+def remap_landmarks(landmark_lists, transform: LetterboxTransform) -> None:
+  """Maps normalized landmarks back to the frame a model input came from.
+
+  Args:
+    landmark_lists: The landmarks of each face, hand or pose found in a model
+      input letterboxed by `InputScaler`, e.g. `result.hand_landmarks`. They
+      are modified in place.
+    transform: The transform of the model input.
+  """
+  # z is on roughly the same scale as x, so it shrinks with the padding.
+  z_scale = transform.width / (transform.scale * transform.frame_width)
+  for landmarks in landmark_lists:
+    for landmark in landmarks:
+      x, y = transform.to_frame(landmark.x * transform.width,
+                                landmark.y * transform.height)
+      landmark.x = x / transform.frame_width
+      landmark.y = y / transform.frame_height
+      if landmark.z is not None:
+        landmark.z *= z_scale
+
+
+class VisionPipeline(object):
+  """Runs the capture, preprocess and inference stages on their own threads.
+
+  The stages are connected by bounded queues. When a downstream stage falls
+  behind, the oldest queued frame is discarded instead of blocking the
+  upstream stage, so a slow camera read, model or display never stalls the
+  other stages. Frames enter the model through an `AdmissionController`, so
+  the task's result callback must call its `complete()` method. The render
+  stage runs on the caller's thread through `frames()`, since OpenCV windows
+  must be driven from the main thread.
+
+  Frames come from a `FramePool`: the camera image is read into a reused
+  buffer, mirrored in place and converted to RGB into a second reused
+  buffer, so the only per-frame copy left is the one made by `mp.Image`.
+
+  The time each frame spends in every stage is recorded into `metrics`. The
+  task's result callback must call its `mark_result()` method for the
+  inference time to be recorded.
+
+  With a `MotionGate`, frames that didn't change enough skip the color
+  conversion and the model, and are drawn with the previous result. They
+  still go through the admission controller and the submit thread, so all
+  frames reach the render stage from one thread, in capture order.
+
+  With an `InputScaler`, frames are shrunk to the model input size before
+  the color conversion, and the task gets the small frame.
+  """
+
+  def __init__(self, cap: cv2.VideoCapture,
+               inference_fn: Callable[[mp.Image, int], None],
+               admission: AdmissionController,
+               metrics: Optional[PipelineMetrics] = None,
+               queue_size: int = 1,
+               motion_gate: Optional[MotionGate] = None,
+               input_scaler: Optional[InputScaler] = None) -> None:
+    """Initializes the pipeline.
+
+    Args:
+      cap: An opened video capture to read frames from.
+      inference_fn: Called with the model input and its timestamp in
+        milliseconds, e.g. a task's `detect_async` method.
+      admission: Controls how many frames are submitted to the model at once.
+      metrics: Records the time spent in each stage. A new instance is
+        created if None.
+      queue_size: Capacity of each queue between two stages.
+      motion_gate: Decides which frames are sent to the model. All of them
+        are if None.
+      input_scaler: Shrinks the frames sent to the model. They are sent at
+        full size if None.
+    """
+    self._cap = cap
+    self._inference_fn = inference_fn
+    self._admission = admission
+    self.metrics = metrics or PipelineMetrics()
+    self._motion_gate = motion_gate
+    self._input_scaler = input_scaler
+    self._preprocess_queue = queue.Queue(maxsize=queue_size)
+    self._render_queue = queue.Queue(maxsize=queue_size)
+    # Besides the two queues, a frame can be held by each of the four stages
+    # and by the admission controller.
+    self._frame_pool = FramePool(2 * queue_size + 5)
+    self._stop_event = threading.Event()
+    self._threads = []
+    self.error = None
+
+  def start(self) -> None:
+    """Starts the capture, preprocess and inference threads."""
+    for target in (self._capture, self._preprocess, self._submit):
+      thread = threading.Thread(target=target, daemon=True)
+      thread.start()
+      self._threads.append(thread)
+
+  def stop(self) -> None:
+    """Stops all stages and waits for their threads to finish."""
+    self._stop_event.set()
+    for thread in self._threads:
+      thread.join()
+    self._threads = []
+
+  def frames(self) -> Iterator[Frame]:
+    """Yields the frames that are ready to be rendered.
+
+    A frame's buffers are reused once the next frame is requested, so the
+    caller must not keep a reference to them. The iteration ends when the
+    pipeline is stopped or the capture stage fails, in which case `error`
+    holds the reason.
+    """
+    while not self._stop_event.is_set():
+      frame = self._get(self._render_queue)
+      if frame is None:
+        if self.error:
+          return
+        continue
+      render_start_time = time.perf_counter()
+      try:
+        yield frame
+      finally:
+        self.metrics.record(
+            'render', (time.perf_counter() - render_start_time) * 1000)
+        self._frame_pool.release(frame)
+
+  def _release(self, frames: List[Frame]) -> None:
+    for frame in frames:
+      self._frame_pool.release(frame)
+
+  def _get(self, frame_queue: queue.Queue) -> Optional[Frame]:
+    try:
+      return frame_queue.get(timeout=0.1)
+    except queue.Empty:
+      return None
+
+  def _capture(self) -> None:
+    index, last_timestamp_ms = 0, 0
+    while not self._stop_event.is_set() and self._cap.isOpened():
+      frame = self._frame_pool.acquire(timeout=0.1)
+      if frame is None:
+        continue
+      # OpenCV reads into the frame's buffer when its size matches, and
+      # allocates a new one otherwise.
+      with self.metrics.measure('capture'):
+        success, frame.image = self._cap.read(frame.image)
+      if not success:
+        self._frame_pool.release(frame)
+        self.error = CAMERA_ERROR
+        return
+
+      # The tasks reject timestamps that do not increase monotonically.
+      timestamp_ms = max(time.time_ns() // 1_000_000, last_timestamp_ms + 1)
+      last_timestamp_ms = timestamp_ms
+      frame.index, frame.timestamp_ms = index, timestamp_ms
+      discarded_frames = _put_latest(self._preprocess_queue, frame)
+      self._admission.record_superseded(len(discarded_frames))
+      self._release(discarded_frames)
+      index += 1
+
+  def _preprocess(self) -> None:
+    while not self._stop_event.is_set():
+      frame = self._get(self._preprocess_queue)
+      if frame is None:
+        continue
+      with self.metrics.measure('preprocess'):
+        # Mirror the image in place, which is cheaper than a copy to a new
+        # buffer.
+        cv2.flip(frame.image, 1, dst=frame.image)
+
+        skipped = (self._motion_gate is not None and
+                   not self._motion_gate.should_process(frame.image))
+        frame.skip_inference = skipped
+        if not skipped and self._input_scaler is not None:
+          frame.rgb_image = self._input_scaler.scale(
+              frame.image, frame.timestamp_ms, dst=frame.rgb_image)
+          frame.mp_image = mp.Image(image_format=mp.ImageFormat.SRGB,
+                                    data=frame.rgb_image)
+        elif not skipped:
+          # Convert the image from BGR to RGB as required by the TFLite
+          # model.
+          if (frame.rgb_image is None or
+              frame.rgb_image.shape != frame.image.shape):
+            frame.rgb_image = np.empty_like(frame.image)
+          cv2.cvtColor(frame.image, cv2.COLOR_BGR2RGB, dst=frame.rgb_image)
+          frame.mp_image = mp.Image(image_format=mp.ImageFormat.SRGB,
+                                    data=frame.rgb_image)
+      frame.ready_time = time.perf_counter()
+      superseded_frame = self._admission.offer(frame)
+      if superseded_frame is not None:
+        self._frame_pool.release(superseded_frame)
+
+  def _submit(self) -> None:
+    while not self._stop_event.is_set():
+      frame = self._admission.take(timeout=0.1)
+      if frame is None:
+        continue
+      if frame.skip_inference:
+        self._release(_put_latest(self._render_queue, frame))
+        continue
+      self.metrics.record('queue_wait',
+                          (time.perf_counter() - frame.ready_time) * 1000)
+      self.metrics.mark_submitted(frame.timestamp_ms)
+      self._inference_fn(frame.mp_image, frame.timestamp_ms)
+      frame.mp_image = None
+      self._release(_put_latest(self._render_queue, frame))
@@ -54,3 +54,31 @@ def visualize(
                 FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
 
   return image
+
+
+def remap_detections(detection_result, transform):
+  """Maps the boxes and keypoints of a result back to the camera frame.
+
+  Args:
+    detection_result: A result of a model input letterboxed by
+      `pipeline.InputScaler`. It is modified in place.
+    transform: The `pipeline.LetterboxTransform` of the model input.
+  Returns:
+    The result, in camera frame coordinates.
+  """
+  for detection in detection_result.detections:
+    bbox = detection.bounding_box
+    x0, y0 = transform.to_frame(bbox.origin_x, bbox.origin_y)
+    x1, y1 = transform.to_frame(bbox.origin_x + bbox.width,
+                                bbox.origin_y + bbox.height)
+    bbox.origin_x, bbox.origin_y = round(x0), round(y0)
+    bbox.width, bbox.height = round(x1 - x0), round(y1 - y0)
+
+    # Keypoints are normalized to the size of the image.
+    for keypoint in detection.keypoints or []:
+      x, y = transform.to_frame(keypoint.x * transform.width,
+                                keypoint.y * transform.height)
+      keypoint.x = x / transform.frame_width
+      keypoint.y = y / transform.frame_height
+
+  return detection_result
@@ -14,30 +14,72 @@
 """Main scripts to run face landmarker."""
 
 import argparse
+import functools
 import sys
-import time
 
 import cv2
 import mediapipe as mp
 
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+
+from metrics import PipelineMetrics
+from offline import run_offline
+from pipeline import AdmissionController
+from pipeline import InputScaler
+from pipeline import MotionGate
+from pipeline import VisionPipeline
+from pipeline import remap_landmarks
+from renderer import LandmarkRenderer
+from renderer import PanelRenderer
+from renderer import landmarks_to_array
 
 mp_face_mesh = mp.solutions.face_mesh
-mp_drawing = mp.solutions.drawing_utils
 mp_drawing_styles = mp.solutions.drawing_styles
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
 DETECTION_RESULT = None
 
 
+def create_landmarker(model: str, num_faces: int,
+                      min_face_detection_confidence: float,
+                      min_face_presence_confidence: float,
+                      min_tracking_confidence: float,
+                      running_mode: vision.RunningMode,
+                      result_callback=None) -> vision.FaceLandmarker:
+    """Creates a face landmarker.
+
+    Args:
+        model: Name of the face landmarker model bundle.
+        num_faces: Max number of faces that can be detected by the landmarker.
+        min_face_detection_confidence: The minimum confidence score for face
+          detection to be considered successful.
+        min_face_presence_confidence: The minimum confidence score of face
+          presence score in the face landmark detection.
+        min_tracking_confidence: The minimum confidence score for the face
+          tracking to be considered successful.
+        running_mode: The running mode of the landmarker.
+        result_callback: The callback receiving results in LIVE_STREAM mode.
+    """
+    base_options = python.BaseOptions(model_asset_path=model)
+    options = vision.FaceLandmarkerOptions(
+        base_options=base_options,
+        running_mode=running_mode,
+        num_faces=num_faces,
+        min_face_detection_confidence=min_face_detection_confidence,
+        min_face_presence_confidence=min_face_presence_confidence,
+        min_tracking_confidence=min_tracking_confidence,
+        output_face_blendshapes=True,
+        result_callback=result_callback)
+    return vision.FaceLandmarker.create_from_options(options)
+
+
 def run(model: str, num_faces: int,
         min_face_detection_confidence: float,
         min_face_presence_confidence: float, min_tracking_confidence: float,
-        camera_id: int, width: int, height: int) -> None:
+        camera_id: int, width: int, height: int, input_path: str,
+        output_path: str, num_workers: int, metrics_output: str,
+        panel_refresh_rate: float, motion_threshold: float,
+        heartbeat: float, input_size: int) -> None:
     """Continuously run inference on images acquired from the camera.
 
   Args:
@@ -52,8 +94,33 @@ def run(model: str, num_faces: int,
       camera_id: The camera id to be passed to OpenCV.
       width: The width of the frame captured from the camera.
       height: The height of the frame captured from the camera.
+      input_path: Path of a video file or image folder to process without a
+        display instead of the camera.
+      output_path: Path of the file the results of `input_path` are written
+        to.
+      num_workers: Number of processes splitting `input_path` between
+        them.
+      metrics_output: Path of the file the per-stage latencies are written
+        to on exit, or None.
+      panel_refresh_rate: Max number of times per second the side panel is
+        updated, or 0 to update it with every frame.
+      motion_threshold: Min fraction of the pixels of a frame that must
+        change for it to be sent to the model, or 0 to send every frame.
+      heartbeat: Max time in seconds between two frames sent to the model
+        when `motion_threshold` is set.
+      input_size: Side of the square the frames are letterboxed to before
+        being sent to the model, or 0 to send full frames.
   """
 
+    if input_path:
+        run_offline(input_path, output_path,
+                    functools.partial(create_landmarker, model, num_faces,
+                                      min_face_detection_confidence,
+                                      min_face_presence_confidence,
+                                      min_tracking_confidence), 'detect',
+                    num_workers)
+        return
+
     # Start capturing video input from the camera
     cap = cv2.VideoCapture(camera_id)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -65,58 +132,74 @@ def run(model: str, num_faces: int,
     text_color = (0, 0, 0)  # black
     font_size = 1
     font_thickness = 1
-    fps_avg_frame_count = 10
 
     # Label box parameters
     label_background_color = (255, 255, 255)  # White
     label_padding_width = 1500  # pixels
 
+    # The blendshape names are drawn once and only the rows whose score
+    # changed are redrawn, instead of rasterizing all of them every frame.
+    blendshape_panel = PanelRenderer(label_padding_width,
+                                     background_color=label_background_color,
+                                     bar_x=200,
+                                     refresh_rate=panel_refresh_rate)
+
+    # The face mesh has thousands of connections, so group them by style
+    # once instead of walking them in Python on every frame.
+    face_mesh_renderers = [
+        LandmarkRenderer(
+            mp_face_mesh.FACEMESH_TESSELATION,
+            mp_drawing_styles.get_default_face_mesh_tesselation_style()),
+        LandmarkRenderer(
+            mp_face_mesh.FACEMESH_CONTOURS,
+            mp_drawing_styles.get_default_face_mesh_contours_style()),
+        LandmarkRenderer(
+            mp_face_mesh.FACEMESH_IRISES,
+            mp_drawing_styles.get_default_face_mesh_iris_connections_style()),
+    ]
+
+    admission = AdmissionController()
+    metrics = PipelineMetrics()
+
+    # Send the model frames at the given size rather than at the camera's.
+    input_scaler = (InputScaler((input_size, input_size))
+                    if input_size > 0 else None)
+
     def save_result(result: vision.FaceLandmarkerResult,
                     unused_output_image: mp.Image, timestamp_ms: int):
-        global FPS, COUNTER, START_TIME, DETECTION_RESULT
-
-        # Calculate the FPS
-        if COUNTER % fps_avg_frame_count == 0:
-            FPS = fps_avg_frame_count / (time.time() - START_TIME)
-            START_TIME = time.time()
+        global DETECTION_RESULT
 
+        transform = (input_scaler.pop_transform(timestamp_ms)
+                     if input_scaler is not None else None)
+        if transform is not None:
+            remap_landmarks(result.face_landmarks, transform)
         DETECTION_RESULT = result
-        COUNTER += 1
+        admission.complete(timestamp_ms)
+        metrics.mark_result(timestamp_ms)
 
     # Initialize the face landmarker model
-    base_options = python.BaseOptions(model_asset_path=model)
-    options = vision.FaceLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.LIVE_STREAM,
-        num_faces=num_faces,
-        min_face_detection_confidence=min_face_detection_confidence,
-        min_face_presence_confidence=min_face_presence_confidence,
-        min_tracking_confidence=min_tracking_confidence,
-        output_face_blendshapes=True,
-        result_callback=save_result)
-    detector = vision.FaceLandmarker.create_from_options(options)
-
-    # Continuously capture images from the camera and run inference
-    while cap.isOpened():
-        success, image = cap.read()
-        if not success:
-            sys.exit(
-                'ERROR: Unable to read from webcam. Please verify your webcam settings.'
-            )
-
-        image = cv2.flip(image, 1)
-
-        # Convert the image from BGR to RGB as required by the TFLite model.
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
-
-        # Run face landmarker using the model.
-        detector.detect_async(mp_image, time.time_ns() // 1_000_000)
-
+    detector = create_landmarker(model, num_faces,
+                                 min_face_detection_confidence,
+                                 min_face_presence_confidence,
+                                 min_tracking_confidence,
+                                 vision.RunningMode.LIVE_STREAM, save_result)
+
+    # Only send the frames that changed to the model, plus one per heartbeat.
+    motion_gate = (MotionGate(motion_threshold, heartbeat)
+                   if motion_threshold > 0 else None)
+
+    # Capture, preprocess and run inference on their own threads so that slow
+    # camera reads or rendering don't hold back the model.
+    pipeline = VisionPipeline(cap, detector.detect_async, admission, metrics,
+                              motion_gate=motion_gate,
+                              input_scaler=input_scaler)
+    pipeline.start()
+
+    for frame in pipeline.frames():
         # Show the FPS
-        fps_text = 'FPS = {:.1f}'.format(FPS)
+        fps_text = 'FPS = {:.1f}'.format(metrics.fps)
         text_location = (left_margin, row_size)
-        current_frame = image
+        current_frame = frame.image
         cv2.putText(current_frame, fps_text, text_location,
                     cv2.FONT_HERSHEY_DUPLEX,
                     font_size, text_color, font_thickness, cv2.LINE_AA)
@@ -124,88 +207,18 @@ def run(model: str, num_faces: int,
         if DETECTION_RESULT:
             # Draw landmarks.
             for face_landmarks in DETECTION_RESULT.face_landmarks:
-                face_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-                face_landmarks_proto.landmark.extend([
-                    landmark_pb2.NormalizedLandmark(x=landmark.x,
-                                                    y=landmark.y,
-                                                    z=landmark.z) for
-                    landmark in
-                    face_landmarks
-                ])
-                mp_drawing.draw_landmarks(
-                    image=current_frame,
-                    landmark_list=face_landmarks_proto,
-                    connections=mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp.solutions.drawing_styles
-                    .get_default_face_mesh_tesselation_style())
-                mp_drawing.draw_landmarks(
-                    image=current_frame,
-                    landmark_list=face_landmarks_proto,
-                    connections=mp_face_mesh.FACEMESH_CONTOURS,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp.solutions.drawing_styles
-                    .get_default_face_mesh_contours_style())
-                mp_drawing.draw_landmarks(
-                    image=current_frame,
-                    landmark_list=face_landmarks_proto,
-                    connections=mp_face_mesh.FACEMESH_IRISES,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp.solutions.drawing_styles
-                    .get_default_face_mesh_iris_connections_style())
-
-        # Expand the right side frame to show the blendshapes.
-        current_frame = cv2.copyMakeBorder(current_frame, 0, 0, 0,
-                                           label_padding_width,
-                                           cv2.BORDER_CONSTANT, None,
-                                           label_background_color)
-
-        if DETECTION_RESULT:
-          # Define parameters for the bars and text
-          legend_x = current_frame.shape[
-                         1] - label_padding_width + 20  # Starting X-coordinate (20 as a margin)
-          legend_y = 30  # Starting Y-coordinate
-          bar_max_width = label_padding_width - 40  # Max width of the bar with some margin
-          bar_height = 8  # Height of the bar
-          gap_between_bars = 5  # Gap between two bars
-          text_gap = 5  # Gap between the end of the text and the start of the bar
-
-          face_blendshapes = DETECTION_RESULT.face_blendshapes
-
-          if face_blendshapes:
-              for idx, category in enumerate(face_blendshapes[0]):
-                  category_name = category.category_name
-                  score = round(category.score, 2)
-
-                  # Prepare text and get its width
-                  text = "{} ({:.2f})".format(category_name, score)
-                  (text_width, _), _ = cv2.getTextSize(text,
-                                                       cv2.FONT_HERSHEY_SIMPLEX,
-                                                       0.4, 1)
-
-                  # Display the blendshape name and score
-                  cv2.putText(current_frame, text,
-                              (legend_x, legend_y + (bar_height // 2) + 5),
-                              # Position adjusted for vertical centering
-                              cv2.FONT_HERSHEY_SIMPLEX,
-                              0.4,  # Font size
-                              (0, 0, 0),  # Black color
-                              1,
-                              cv2.LINE_AA)  # Thickness
-
-                  # Calculate bar width based on score
-                  bar_width = int(bar_max_width * score)
-
-                  # Draw the bar to the right of the text
-                  cv2.rectangle(current_frame,
-                                (legend_x + text_width + text_gap, legend_y),
-                                (legend_x + text_width + text_gap + bar_width,
-                                 legend_y + bar_height),
-                                (0, 255, 0),  # Green color
-                                -1)  # Filled bar
-
-                  # Update the Y-coordinate for the next bar
-                  legend_y += (bar_height + gap_between_bars)
+                points = landmarks_to_array(face_landmarks)
+                for face_mesh_renderer in face_mesh_renderers:
+                    face_mesh_renderer.draw(current_frame, points)
+
+        # Show the blendshapes on the right side of the frame.
+        blendshapes = []
+        if DETECTION_RESULT and DETECTION_RESULT.face_blendshapes:
+            blendshapes = [
+                (category.category_name, category.score)
+                for category in DETECTION_RESULT.face_blendshapes[0]
+            ]
+        current_frame = blendshape_panel.render(current_frame, blendshapes)
 
         cv2.imshow('face_landmarker', current_frame)
 
@@ -213,9 +226,16 @@ def run(model: str, num_faces: int,
         if cv2.waitKey(1) == 27:
             break
 
+    pipeline.stop()
     detector.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(metrics.summary())
+    metrics.write(metrics_output)
+    if motion_gate is not None:
+        print(motion_gate.summary())
+    if pipeline.error:
+        sys.exit(pipeline.error)
 
 
 def main():
@@ -265,11 +285,68 @@ def main():
         help='Height of frame to capture from camera.',
         required=False,
         default=960)
+    parser.add_argument(
+        '--input',
+        help='Path of a video file or image folder to process without a display '
+             'instead of the camera.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--output',
+        help='Path of the JSON Lines file to write the results of --input to.',
+        required=False,
+        default='results.jsonl')
+    parser.add_argument(
+        '--numWorkers',
+        help='Number of processes splitting --input between them, each with '
+             'its own model instance.',
+        required=False,
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--metricsOutput',
+        help='Path of the file to write the per-stage latencies to on exit, '
+             'as Prometheus text if it ends in .prom or .txt, as JSON '
+             'otherwise.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--panelRefreshRate',
+        help='Max number of times per second the side panel is updated, or '
+             '0 to update it with every frame.',
+        required=False,
+        type=float,
+        default=0)
+    parser.add_argument(
+        '--motionThreshold',
+        help='Min fraction of the pixels of a frame that must change for '
+             'it to be sent to the model. Unchanged frames are shown with '
+             'the previous result. 0 sends every frame to the model.',
+        required=False,
+        type=float,
+        default=0)
+    parser.add_argument(
+        '--heartbeat',
+        help='Max time in seconds between two frames sent to the model '
+             'when --motionThreshold is set, so results refresh in a static '
+             'scene.',
+        required=False,
+        type=float,
+        default=1.0)
+    parser.add_argument(
+        '--inputSize',
+        help='Side of the square the frames are letterboxed to before being '
+             'sent to the model, e.g. 480. 0 sends full frames.',
+        required=False,
+        type=int,
+        default=0)
     args = parser.parse_args()
 
     run(args.model, int(args.numFaces), args.minFaceDetectionConfidence,
         args.minFacePresenceConfidence, args.minTrackingConfidence,
-        int(args.cameraId), args.frameWidth, args.frameHeight)
+        int(args.cameraId), args.frameWidth, args.frameHeight, args.input,
+        args.output, args.numWorkers, args.metricsOutput, args.panelRefreshRate,
+        args.motionThreshold, args.heartbeat, args.inputSize)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,292 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Renderers drawing task results with few OpenCV calls per frame."""
+
+import collections
+import time
+from typing import Any, Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+import cv2
+import numpy as np
+
+_WHITE_COLOR = (224, 224, 224)
+
+
+def landmarks_to_array(landmarks: Sequence[Any]) -> np.ndarray:
+  """Converts a list of normalized landmarks to an (N, 3) array of x, y, z."""
+  return np.array([(landmark.x, landmark.y, landmark.z)
+                   for landmark in landmarks], dtype=np.float32)
+
+
+def visibility_to_array(landmarks: Sequence[Any]) -> np.ndarray:
+  """Returns the (N,) visibility of a list of landmarks, 1 where it's unset."""
+  return np.array([1.0 if landmark.visibility is None else landmark.visibility
+                   for landmark in landmarks], dtype=np.float32)
+
+
+def _connection_indices(connection: Any) -> tuple:
+  # Connections are (start, end) tuples in the legacy solutions API and
+  # objects with `start` and `end` attributes in the tasks API.
+  if hasattr(connection, 'start'):
+    return connection.start, connection.end
+  return tuple(connection)
+
+
+class LandmarkRenderer(object):
+  """Draws the landmarks and connections of one topology, e.g. a hand.
+
+  The connections are turned into index arrays once, grouped by drawing
+  style, so that each frame only takes one `cv2.polylines` call per style
+  instead of one `cv2.line` call per connection. It accepts the same
+  connections and drawing specs as `mp.solutions.drawing_utils`.
+  """
+
+  def __init__(
+      self,
+      connections: Iterable[Any],
+      connection_style: Union[Any, Mapping[Any, Any]],
+      landmark_style: Optional[Union[Any, Mapping[int, Any]]] = None,
+      visibility_threshold: Optional[float] = None) -> None:
+    """Initializes the renderer.
+
+    Args:
+      connections: Pairs of landmark indices to connect with a line.
+      connection_style: A drawing spec for all connections, or a mapping from
+        each connection to its drawing spec.
+      landmark_style: A drawing spec for all landmarks, a mapping from each
+        landmark index to its drawing spec, or None to not draw landmarks.
+      visibility_threshold: Landmarks with a lower visibility are not drawn,
+        nor are their connections. Only used if `draw()` gets a visibility.
+    """
+    self._visibility_threshold = visibility_threshold
+    connections = sorted(_connection_indices(c) for c in connections)
+    self._num_landmarks = 1 + max(
+        (max(connection) for connection in connections), default=-1)
+
+    groups = collections.defaultdict(list)
+    for connection in connections:
+      spec = (connection_style[connection]
+              if isinstance(connection_style, Mapping) else connection_style)
+      groups[(tuple(spec.color), spec.thickness)].append(connection)
+    self._connection_groups = [
+        (color, thickness, np.array(group, dtype=np.intp))
+        for (color, thickness), group in groups.items()
+    ]
+
+    self._landmark_groups = []
+    if landmark_style is not None:
+      if isinstance(landmark_style, Mapping):
+        specs = {int(index): spec for index, spec in landmark_style.items()}
+      else:
+        specs = {index: landmark_style for index in range(self._num_landmarks)}
+      self._num_landmarks = max(self._num_landmarks, 1 + max(specs, default=-1))
+      groups = collections.defaultdict(list)
+      for index, spec in sorted(specs.items()):
+        groups[(tuple(spec.color), spec.thickness,
+                spec.circle_radius)].append(index)
+      self._landmark_groups = [
+          (color, thickness, radius, np.array(group, dtype=np.intp))
+          for (color, thickness, radius), group in groups.items()
+      ]
+
+  def draw(self, image: np.ndarray, points: np.ndarray,
+           visibility: Optional[np.ndarray] = None) -> None:
+    """Draws landmarks on a BGR image in place.
+
+    Landmarks outside the image are skipped along with their connections.
+
+    Args:
+      image: The BGR image to draw on.
+      points: The (N, 3) normalized landmark coordinates, as returned by
+        `landmarks_to_array()`.
+      visibility: The (N,) visibility of each landmark, or None.
+    """
+    height, width = image.shape[:2]
+    xy = points[:, :2]
+    valid = np.all((xy >= 0) & (xy <= 1), axis=1)
+    if visibility is not None and self._visibility_threshold is not None:
+      valid &= visibility >= self._visibility_threshold
+    pixels = np.minimum(np.floor(xy * (width, height)),
+                        (width - 1, height - 1)).astype(np.int32)
+    if len(points) < self._num_landmarks:
+      # The model returned fewer landmarks than the topology has, e.g. a
+      # face mesh without irises, so treat the missing ones as invalid.
+      missing = self._num_landmarks - len(points)
+      valid = np.concatenate([valid, np.zeros(missing, dtype=bool)])
+      pixels = np.concatenate([pixels, np.zeros((missing, 2), np.int32)])
+
+    for color, thickness, indices in self._connection_groups:
+      indices = indices[valid[indices].all(axis=1)]
+      if len(indices):
+        cv2.polylines(image, pixels[indices], False, color, thickness)
+
+    # Landmarks are drawn after the connections so they end up on top. There
+    # are few of them, so drawing them one by one is cheap.
+    for color, thickness, radius, indices in self._landmark_groups:
+      border_radius = max(radius + 1, int(radius * 1.2))
+      for x, y in pixels[indices[valid[indices]]].tolist():
+        cv2.circle(image, (x, y), border_radius, _WHITE_COLOR, thickness)
+        cv2.circle(image, (x, y), radius, color, thickness)
+
+
+class PanelRenderer(object):
+  """Draws a side panel of labelled scores, and optionally bars, by a frame.
+
+  The output canvas is allocated once and the panel part of it is kept
+  between frames. Text is rasterized once per distinct string and copied in
+  afterwards, and only the rows whose text or bar changed are redrawn, so a
+  frame whose scores didn't change only costs the copy of the video frame.
+  """
+
+  # Max number of rasterized strings kept before the cache is emptied.
+  _MAX_CACHED_SPRITES = 4096
+
+  def __init__(self,
+               width: int,
+               background_color: Tuple[int, int, int] = (255, 255, 255),
+               text_color: Tuple[int, int, int] = (0, 0, 0),
+               font: int = cv2.FONT_HERSHEY_SIMPLEX,
+               font_scale: float = 0.4,
+               font_thickness: int = 1,
+               row_height: int = 13,
+               margin: int = 20,
+               bar_x: Optional[int] = None,
+               bar_height: int = 8,
+               bar_color: Tuple[int, int, int] = (0, 255, 0),
+               refresh_rate: float = 0) -> None:
+    """Initializes the renderer.
+
+    Args:
+      width: Width of the panel in pixels.
+      background_color: BGR color of the panel.
+      text_color: BGR color of the text.
+      font: OpenCV font of the text.
+      font_scale: Scale of the font.
+      font_thickness: Thickness of the text strokes.
+      row_height: Height of each row in pixels.
+      margin: Space around the rows in pixels.
+      bar_x: Horizontal position of the bars from the left of the panel, or
+        None to not draw bars.
+      bar_height: Height of the bars in pixels.
+      bar_color: BGR color of the bars.
+      refresh_rate: Max number of times per second the panel is updated, or
+        0 to update it with every frame.
+    """
+    self._width = width
+    self._background_color = background_color
+    self._text_color = text_color
+    self._font = font
+    self._font_scale = font_scale
+    self._font_thickness = font_thickness
+    self._row_height = row_height
+    self._margin = margin
+    self._bar_x = bar_x
+    self._bar_height = bar_height
+    self._refresh_interval = 1 / refresh_rate if refresh_rate else 0
+    # Blank rows and bars are copied from prefilled arrays, which is much
+    # faster than broadcasting a color into a strided view of the canvas.
+    self._blank_row = np.empty((row_height, width, 3), np.uint8)
+    self._blank_row[:] = background_color
+    self._full_bar = np.empty((bar_height, width, 3), np.uint8)
+    self._full_bar[:] = bar_color
+    self._last_refresh_time = None
+    self._canvas = None
+    self._rows = []
+    self._sprites = {}
+
+  def render(self, frame: np.ndarray,
+             rows: Sequence[Tuple[str, float]]) -> np.ndarray:
+    """Returns the frame with the panel on its right.
+
+    The returned image is reused by the next call.
+
+    Args:
+      frame: The BGR video frame.
+      rows: The label and score, between 0 and 1, of each row.
+    """
+    height, width = frame.shape[:2]
+    if (self._canvas is None or
+        self._canvas.shape[:2] != (height, width + self._width)):
+      self._canvas = np.empty((height, width + self._width, 3), np.uint8)
+      self._canvas[:, width:] = self._background_color
+      self._rows = []
+      self._last_refresh_time = None
+    self._canvas[:, :width] = frame
+
+    now = time.monotonic()
+    if (self._last_refresh_time is None or
+        now - self._last_refresh_time >= self._refresh_interval):
+      self._last_refresh_time = now
+      self._update_panel(self._canvas[:, width:], rows)
+    return self._canvas
+
+  def _update_panel(self, panel: np.ndarray,
+                    rows: Sequence[Tuple[str, float]]) -> None:
+    max_rows = max((panel.shape[0] - 2 * self._margin) // self._row_height, 0)
+    bar_max_width = (self._width - self._bar_x - self._margin
+                     if self._bar_x is not None else 0)
+    new_rows = [
+        (name, '({:.2f})'.format(score),
+         int(bar_max_width * min(max(score, 0), 1)))
+        for name, score in rows[:max_rows]
+    ]
+    for index in range(max(len(new_rows), len(self._rows))):
+      new_row = new_rows[index] if index < len(new_rows) else None
+      old_row = self._rows[index] if index < len(self._rows) else None
+      if new_row != old_row:
+        self._draw_row(panel, index, new_row)
+    self._rows = new_rows
+
+  def _draw_row(self, panel: np.ndarray, index: int,
+                row: Optional[Tuple[str, str, int]]) -> None:
+    top = self._margin + index * self._row_height
+    panel[top:top + self._row_height] = self._blank_row
+    if row is None:
+      return
+    name, score_text, bar_width = row
+    x = self._margin
+    for text in (name, ' ' + score_text):
+      x += self._blit(panel, self._sprite(text), x, top)
+    if bar_width:
+      bar_top = top + (self._row_height - self._bar_height) // 2
+      panel[bar_top:bar_top + self._bar_height,
+            self._bar_x:self._bar_x + bar_width] = self._full_bar[:, :bar_width]
+
+  def _blit(self, panel: np.ndarray, sprite: np.ndarray, x: int,
+            top: int) -> int:
+    """Copies a sprite, vertically centered in a row, and returns its width."""
+    y = top + max((self._row_height - sprite.shape[0]) // 2, 0)
+    # Clip the sprite to its row, so redrawing a row never leaves traces in
+    # the next one.
+    height = min(sprite.shape[0], top + self._row_height - y,
+                 panel.shape[0] - y)
+    width = min(sprite.shape[1], panel.shape[1] - x)
+    if height > 0 and width > 0:
+      panel[y:y + height, x:x + width] = sprite[:height, :width]
+    return sprite.shape[1]
+
+  def _sprite(self, text: str) -> np.ndarray:
+    """Returns the text rasterized on the panel background."""
+    sprite = self._sprites.get(text)
+    if sprite is None:
+      if len(self._sprites) >= self._MAX_CACHED_SPRITES:
+        self._sprites.clear()
+      (text_width, text_height), baseline = cv2.getTextSize(
+          text, self._font, self._font_scale, self._font_thickness)
+      sprite = np.empty((text_height + baseline, text_width, 3), np.uint8)
+      sprite[:] = self._background_color
+      cv2.putText(sprite, text, (0, text_height), self._font, self._font_scale,
+                  self._text_color, self._font_thickness, cv2.LINE_AA)
+      self._sprites[text] = sprite
+    return sprite
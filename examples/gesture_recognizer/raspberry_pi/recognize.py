@@ -14,6 +14,7 @@
 """Main scripts to run gesture recognition."""
 
 import argparse
+import functools
 import sys
 import time
 
@@ -22,21 +23,52 @@ import mediapipe as mp
 
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+
+from metrics import PipelineMetrics
+from offline import run_offline
+from renderer import LandmarkRenderer
+from renderer import landmarks_to_array
+
 mp_hands = mp.solutions.hands
-mp_drawing = mp.solutions.drawing_utils
 mp_drawing_styles = mp.solutions.drawing_styles
 
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
+def create_recognizer(model: str, num_hands: int,
+                      min_hand_detection_confidence: float,
+                      min_hand_presence_confidence: float,
+                      min_tracking_confidence: float,
+                      running_mode: vision.RunningMode,
+                      result_callback=None) -> vision.GestureRecognizer:
+  """Creates a gesture recognizer.
+
+  Args:
+      model: Name of the gesture recognition model bundle.
+      num_hands: Max number of hands can be detected by the recognizer.
+      min_hand_detection_confidence: The minimum confidence score for hand
+        detection to be considered successful.
+      min_hand_presence_confidence: The minimum confidence score of hand
+        presence score in the hand landmark detection.
+      min_tracking_confidence: The minimum confidence score for the hand
+        tracking to be considered successful.
+      running_mode: The running mode of the recognizer.
+      result_callback: The callback receiving results in LIVE_STREAM mode.
+  """
+  base_options = python.BaseOptions(model_asset_path=model)
+  options = vision.GestureRecognizerOptions(base_options=base_options,
+                                          running_mode=running_mode,
+                                          num_hands=num_hands,
+                                          min_hand_detection_confidence=min_hand_detection_confidence,
+                                          min_hand_presence_confidence=min_hand_presence_confidence,
+                                          min_tracking_confidence=min_tracking_confidence,
+                                          result_callback=result_callback)
+  return vision.GestureRecognizer.create_from_options(options)
 
 
 def run(model: str, num_hands: int,
         min_hand_detection_confidence: float,
         min_hand_presence_confidence: float, min_tracking_confidence: float,
-        camera_id: int, width: int, height: int) -> None:
+        camera_id: int, width: int, height: int, input_path: str,
+        output_path: str, num_workers: int, metrics_output: str) -> None:
   """Continuously run inference on images acquired from the camera.
 
   Args:
@@ -51,8 +83,25 @@ def run(model: str, num_hands: int,
       camera_id: The camera id to be passed to OpenCV.
       width: The width of the frame captured from the camera.
       height: The height of the frame captured from the camera.
+      input_path: Path of a video file or image folder to process without a
+        display instead of the camera.
+      output_path: Path of the file the results of `input_path` are written
+        to.
+      num_workers: Number of processes splitting `input_path` between
+        them.
+      metrics_output: Path of the file the per-stage latencies are written
+        to on exit, or None.
   """
 
+  if input_path:
+    run_offline(input_path, output_path,
+                functools.partial(create_recognizer, model, num_hands,
+                                  min_hand_detection_confidence,
+                                  min_hand_presence_confidence,
+                                  min_tracking_confidence), 'recognize',
+                num_workers)
+    return
+
   # Start capturing video input from the camera
   cap = cv2.VideoCapture(camera_id)
   cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -64,58 +113,59 @@ def run(model: str, num_hands: int,
   text_color = (0, 0, 0)  # black
   font_size = 1
   font_thickness = 1
-  fps_avg_frame_count = 10
 
   # Label box parameters
   label_text_color = (255, 255, 255)  # white
   label_font_size = 1
   label_thickness = 2
 
+  # Group the hand connections and landmarks by style once, so that each
+  # frame only takes a few OpenCV calls to draw.
+  hand_renderer = LandmarkRenderer(
+      mp_hands.HAND_CONNECTIONS,
+      mp_drawing_styles.get_default_hand_connections_style(),
+      mp_drawing_styles.get_default_hand_landmarks_style())
+
   recognition_frame = None
   recognition_result_list = []
+  metrics = PipelineMetrics()
 
   def save_result(result: vision.GestureRecognizerResult,
                   unused_output_image: mp.Image, timestamp_ms: int):
-      global FPS, COUNTER, START_TIME
-
-      # Calculate the FPS
-      if COUNTER % fps_avg_frame_count == 0:
-          FPS = fps_avg_frame_count / (time.time() - START_TIME)
-          START_TIME = time.time()
-
       recognition_result_list.append(result)
-      COUNTER += 1
+      metrics.mark_result(timestamp_ms)
 
   # Initialize the gesture recognizer model
-  base_options = python.BaseOptions(model_asset_path=model)
-  options = vision.GestureRecognizerOptions(base_options=base_options,
-                                          running_mode=vision.RunningMode.LIVE_STREAM,
-                                          num_hands=num_hands,
-                                          min_hand_detection_confidence=min_hand_detection_confidence,
-                                          min_hand_presence_confidence=min_hand_presence_confidence,
-                                          min_tracking_confidence=min_tracking_confidence,
-                                          result_callback=save_result)
-  recognizer = vision.GestureRecognizer.create_from_options(options)
+  recognizer = create_recognizer(model, num_hands,
+                                 min_hand_detection_confidence,
+                                 min_hand_presence_confidence,
+                                 min_tracking_confidence,
+                                 vision.RunningMode.LIVE_STREAM, save_result)
 
   # Continuously capture images from the camera and run inference
   while cap.isOpened():
-    success, image = cap.read()
+    with metrics.measure('capture'):
+      success, image = cap.read()
     if not success:
       sys.exit(
           'ERROR: Unable to read from webcam. Please verify your webcam settings.'
       )
 
-    image = cv2.flip(image, 1)
+    with metrics.measure('preprocess'):
+      image = cv2.flip(image, 1)
 
-    # Convert the image from BGR to RGB as required by the TFLite model.
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
+      # Convert the image from BGR to RGB as required by the TFLite model.
+      rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+      mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
 
     # Run gesture recognizer using the model.
-    recognizer.recognize_async(mp_image, time.time_ns() // 1_000_000)
+    timestamp_ms = time.time_ns() // 1_000_000
+    metrics.mark_submitted(timestamp_ms)
+    recognizer.recognize_async(mp_image, timestamp_ms)
+    render_start_time = time.perf_counter()
 
     # Show the FPS
-    fps_text = 'FPS = {:.1f}'.format(FPS)
+    fps_text = 'FPS = {:.1f}'.format(metrics.fps)
     text_location = (left_margin, row_size)
     current_frame = image
     cv2.putText(current_frame, fps_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
@@ -125,10 +175,12 @@ def run(model: str, num_hands: int,
       # Draw landmarks and write the text for each hand.
       for hand_index, hand_landmarks in enumerate(
           recognition_result_list[0].hand_landmarks):
+        points = landmarks_to_array(hand_landmarks)
+
         # Calculate the bounding box of the hand
-        x_min = min([landmark.x for landmark in hand_landmarks])
-        y_min = min([landmark.y for landmark in hand_landmarks])
-        y_max = max([landmark.y for landmark in hand_landmarks])
+        x_min = points[:, 0].min()
+        y_min = points[:, 1].min()
+        y_max = points[:, 1].max()
 
         # Convert normalized coordinates to pixel values
         frame_height, frame_width = current_frame.shape[:2]
@@ -163,18 +215,7 @@ def run(model: str, num_hands: int,
                       label_text_color, label_thickness, cv2.LINE_AA)
 
         # Draw hand landmarks on the frame
-        hand_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-        hand_landmarks_proto.landmark.extend([
-          landmark_pb2.NormalizedLandmark(x=landmark.x, y=landmark.y,
-                                          z=landmark.z) for landmark in
-          hand_landmarks
-        ])
-        mp_drawing.draw_landmarks(
-          current_frame,
-          hand_landmarks_proto,
-          mp_hands.HAND_CONNECTIONS,
-          mp_drawing_styles.get_default_hand_landmarks_style(),
-          mp_drawing_styles.get_default_hand_connections_style())
+        hand_renderer.draw(current_frame, points)
 
       recognition_frame = current_frame
       recognition_result_list.clear()
@@ -183,12 +224,16 @@ def run(model: str, num_hands: int,
         cv2.imshow('gesture_recognition', recognition_frame)
 
     # Stop the program if the ESC key is pressed.
-    if cv2.waitKey(1) == 27:
+    key = cv2.waitKey(1)
+    metrics.record('render', (time.perf_counter() - render_start_time) * 1000)
+    if key == 27:
         break
 
   recognizer.close()
   cap.release()
   cv2.destroyAllWindows()
+  print(metrics.summary())
+  metrics.write(metrics_output)
 
 
 def main():
@@ -238,11 +283,37 @@ def main():
       help='Height of frame to capture from camera.',
       required=False,
       default=480)
+  parser.add_argument(
+      '--input',
+      help='Path of a video file or image folder to process without a display '
+           'instead of the camera.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON Lines file to write the results of --input to.',
+      required=False,
+      default='results.jsonl')
+  parser.add_argument(
+      '--numWorkers',
+      help='Number of processes splitting --input between them, each with '
+           'its own model instance.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--metricsOutput',
+      help='Path of the file to write the per-stage latencies to on exit, '
+           'as Prometheus text if it ends in .prom or .txt, as JSON '
+           'otherwise.',
+      required=False,
+      default=None)
   args = parser.parse_args()
 
   run(args.model, int(args.numHands), args.minHandDetectionConfidence,
       args.minHandPresenceConfidence, args.minTrackingConfidence,
-      int(args.cameraId), args.frameWidth, args.frameHeight)
+      int(args.cameraId), args.frameWidth, args.frameHeight, args.input,
+      args.output, args.numWorkers, args.metricsOutput)
 
 
 if __name__ == '__main__':
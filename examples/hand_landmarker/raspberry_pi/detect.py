@@ -14,30 +14,70 @@
 """Main scripts to run hand landmarker."""
 
 import argparse
+import functools
 import sys
-import time
 
 import cv2
 import mediapipe as mp
 
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+
+from metrics import PipelineMetrics
+from offline import run_offline
+from pipeline import AdmissionController
+from pipeline import InputScaler
+from pipeline import MotionGate
+from pipeline import VisionPipeline
+from pipeline import remap_landmarks
+from renderer import LandmarkRenderer
+from renderer import landmarks_to_array
 
 mp_hands = mp.solutions.hands
-mp_drawing = mp.solutions.drawing_utils
 mp_drawing_styles = mp.solutions.drawing_styles
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
 DETECTION_RESULT = None
 
 
+def create_landmarker(model: str, num_hands: int,
+                      min_hand_detection_confidence: float,
+                      min_hand_presence_confidence: float,
+                      min_tracking_confidence: float,
+                      running_mode: vision.RunningMode,
+                      result_callback=None) -> vision.HandLandmarker:
+    """Creates a hand landmarker.
+
+    Args:
+        model: Name of the hand landmarker model bundle.
+        num_hands: Max number of hands that can be detected by the landmarker.
+        min_hand_detection_confidence: The minimum confidence score for hand
+          detection to be considered successful.
+        min_hand_presence_confidence: The minimum confidence score of hand
+          presence score in the hand landmark detection.
+        min_tracking_confidence: The minimum confidence score for the hand
+          tracking to be considered successful.
+        running_mode: The running mode of the landmarker.
+        result_callback: The callback receiving results in LIVE_STREAM mode.
+    """
+    base_options = python.BaseOptions(model_asset_path=model)
+    options = vision.HandLandmarkerOptions(
+        base_options=base_options,
+        running_mode=running_mode,
+        num_hands=num_hands,
+        min_hand_detection_confidence=min_hand_detection_confidence,
+        min_hand_presence_confidence=min_hand_presence_confidence,
+        min_tracking_confidence=min_tracking_confidence,
+        result_callback=result_callback)
+    return vision.HandLandmarker.create_from_options(options)
+
+
 def run(model: str, num_hands: int,
         min_hand_detection_confidence: float,
         min_hand_presence_confidence: float, min_tracking_confidence: float,
-        camera_id: int, width: int, height: int) -> None:
+        camera_id: int, width: int, height: int, input_path: str,
+        output_path: str, num_workers: int, metrics_output: str,
+        motion_threshold: float, heartbeat: float,
+        input_size: int) -> None:
     """Continuously run inference on images acquired from the camera.
 
   Args:
@@ -52,8 +92,32 @@ def run(model: str, num_hands: int,
       camera_id: The camera id to be passed to OpenCV.
       width: The width of the frame captured from the camera.
       height: The height of the frame captured from the camera.
+      input_path: Path of a video file or image folder to process without a
+        display instead of the camera.
+      output_path: Path of the file the results of `input_path` are written
+        to.
+      num_workers: Number of processes splitting `input_path` between
+        them.
+      metrics_output: Path of the file the per-stage latencies are written
+        to on exit, or None.
+      motion_threshold: Min fraction of the pixels of a frame that must
+        change for it to be sent to the model, or 0 to send every frame.
+      heartbeat: Max time in seconds between two frames sent to the model
+        when `motion_threshold` is set.
+      input_size: Side of the square the frames are letterboxed to before
+        being sent to the model, or 0 to send full frames.
   """
 
+    if input_path:
+        run_offline(input_path, output_path,
+                    functools.partial(create_landmarker, model, num_hands,
+                                      min_hand_detection_confidence,
+                                      min_hand_presence_confidence,
+                                      min_tracking_confidence),
+                    'detect',
+                    num_workers)
+        return
+
     # Start capturing video input from the camera
     cap = cv2.VideoCapture(camera_id)
     cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -65,53 +129,56 @@ def run(model: str, num_hands: int,
     text_color = (0, 0, 0)  # black
     font_size = 1
     font_thickness = 1
-    fps_avg_frame_count = 10
+
+    # Group the hand connections and landmarks by style once, so that each
+    # frame only takes a few OpenCV calls to draw.
+    hand_renderer = LandmarkRenderer(
+        mp_hands.HAND_CONNECTIONS,
+        mp_drawing_styles.get_default_hand_connections_style(),
+        mp_drawing_styles.get_default_hand_landmarks_style())
+
+    admission = AdmissionController()
+    metrics = PipelineMetrics()
+
+    # Send the model frames at the given size rather than at the camera's.
+    input_scaler = (InputScaler((input_size, input_size))
+                    if input_size > 0 else None)
 
     def save_result(result: vision.HandLandmarkerResult,
                     unused_output_image: mp.Image, timestamp_ms: int):
-        global FPS, COUNTER, START_TIME, DETECTION_RESULT
-
-        # Calculate the FPS
-        if COUNTER % fps_avg_frame_count == 0:
-            FPS = fps_avg_frame_count / (time.time() - START_TIME)
-            START_TIME = time.time()
+        global DETECTION_RESULT
 
+        transform = (input_scaler.pop_transform(timestamp_ms)
+                     if input_scaler is not None else None)
+        if transform is not None:
+            remap_landmarks(result.hand_landmarks, transform)
         DETECTION_RESULT = result
-        COUNTER += 1
+        admission.complete(timestamp_ms)
+        metrics.mark_result(timestamp_ms)
 
     # Initialize the hand landmarker model
-    base_options = python.BaseOptions(model_asset_path=model)
-    options = vision.HandLandmarkerOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.LIVE_STREAM,
-        num_hands=num_hands,
-        min_hand_detection_confidence=min_hand_detection_confidence,
-        min_hand_presence_confidence=min_hand_presence_confidence,
-        min_tracking_confidence=min_tracking_confidence,
-        result_callback=save_result)
-    detector = vision.HandLandmarker.create_from_options(options)
-
-    # Continuously capture images from the camera and run inference
-    while cap.isOpened():
-        success, image = cap.read()
-        if not success:
-            sys.exit(
-                'ERROR: Unable to read from webcam. Please verify your webcam settings.'
-            )
-
-        image = cv2.flip(image, 1)
-
-        # Convert the image from BGR to RGB as required by the TFLite model.
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
-
-        # Run hand landmarker using the model.
-        detector.detect_async(mp_image, time.time_ns() // 1_000_000)
-
+    detector = create_landmarker(model, num_hands,
+                                 min_hand_detection_confidence,
+                                 min_hand_presence_confidence,
+                                 min_tracking_confidence,
+                                 vision.RunningMode.LIVE_STREAM, save_result)
+
+    # Only send the frames that changed to the model, plus one per heartbeat.
+    motion_gate = (MotionGate(motion_threshold, heartbeat)
+                   if motion_threshold > 0 else None)
+
+    # Capture, preprocess and run inference on their own threads so that slow
+    # camera reads or rendering don't hold back the model.
+    pipeline = VisionPipeline(cap, detector.detect_async, admission, metrics,
+                              motion_gate=motion_gate,
+                              input_scaler=input_scaler)
+    pipeline.start()
+
+    for frame in pipeline.frames():
         # Show the FPS
-        fps_text = 'FPS = {:.1f}'.format(FPS)
+        fps_text = 'FPS = {:.1f}'.format(metrics.fps)
         text_location = (left_margin, row_size)
-        current_frame = image
+        current_frame = frame.image
         cv2.putText(current_frame, fps_text, text_location,
                     cv2.FONT_HERSHEY_DUPLEX,
                     font_size, text_color, font_thickness, cv2.LINE_AA)
@@ -129,25 +196,13 @@ def run(model: str, num_hands: int,
                 handedness = DETECTION_RESULT.handedness[idx]
 
                 # Draw the hand landmarks.
-                hand_landmarks_proto = landmark_pb2.NormalizedLandmarkList()
-                hand_landmarks_proto.landmark.extend([
-                    landmark_pb2.NormalizedLandmark(x=landmark.x, y=landmark.y,
-                                                    z=landmark.z) for landmark
-                    in hand_landmarks
-                ])
-                mp_drawing.draw_landmarks(
-                    current_frame,
-                    hand_landmarks_proto,
-                    mp_hands.HAND_CONNECTIONS,
-                    mp_drawing_styles.get_default_hand_landmarks_style(),
-                    mp_drawing_styles.get_default_hand_connections_style())
+                points = landmarks_to_array(hand_landmarks)
+                hand_renderer.draw(current_frame, points)
 
                 # Get the top left corner of the detected hand's bounding box.
                 height, width, _ = current_frame.shape
-                x_coordinates = [landmark.x for landmark in hand_landmarks]
-                y_coordinates = [landmark.y for landmark in hand_landmarks]
-                text_x = int(min(x_coordinates) * width)
-                text_y = int(min(y_coordinates) * height) - MARGIN
+                text_x = int(points[:, 0].min() * width)
+                text_y = int(points[:, 1].min() * height) - MARGIN
 
                 # Draw handedness (left or right hand) on the image.
                 cv2.putText(current_frame, f"{handedness[0].category_name}",
@@ -161,9 +216,16 @@ def run(model: str, num_hands: int,
         if cv2.waitKey(1) == 27:
             break
 
+    pipeline.stop()
     detector.close()
     cap.release()
     cv2.destroyAllWindows()
+    print(metrics.summary())
+    metrics.write(metrics_output)
+    if motion_gate is not None:
+        print(motion_gate.summary())
+    if pipeline.error:
+        sys.exit(pipeline.error)
 
 
 def main():
@@ -224,11 +286,61 @@ def main():
         required=False,
         type=int,
         default=960)
+    parser.add_argument(
+        '--input',
+        help='Path of a video file or image folder to process without a display '
+             'instead of the camera.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--output',
+        help='Path of the JSON Lines file to write the results of --input to.',
+        required=False,
+        default='results.jsonl')
+    parser.add_argument(
+        '--numWorkers',
+        help='Number of processes splitting --input between them, each with '
+             'its own model instance.',
+        required=False,
+        type=int,
+        default=1)
+    parser.add_argument(
+        '--metricsOutput',
+        help='Path of the file to write the per-stage latencies to on exit, '
+             'as Prometheus text if it ends in .prom or .txt, as JSON '
+             'otherwise.',
+        required=False,
+        default=None)
+    parser.add_argument(
+        '--motionThreshold',
+        help='Min fraction of the pixels of a frame that must change for '
+             'it to be sent to the model. Unchanged frames are shown with '
+             'the previous result. 0 sends every frame to the model.',
+        required=False,
+        type=float,
+        default=0)
+    parser.add_argument(
+        '--heartbeat',
+        help='Max time in seconds between two frames sent to the model '
+             'when --motionThreshold is set, so results refresh in a static '
+             'scene.',
+        required=False,
+        type=float,
+        default=1.0)
+    parser.add_argument(
+        '--inputSize',
+        help='Side of the square the frames are letterboxed to before being '
+             'sent to the model, e.g. 480. 0 sends full frames.',
+        required=False,
+        type=int,
+        default=0)
     args = parser.parse_args()
 
     run(args.model, args.numHands, args.minHandDetectionConfidence,
         args.minHandPresenceConfidence, args.minTrackingConfidence,
-        args.cameraId, args.frameWidth, args.frameHeight)
+        args.cameraId, args.frameWidth, args.frameHeight, args.input,
+        args.output, args.numWorkers, args.metricsOutput,
+        args.motionThreshold, args.heartbeat, args.inputSize)
 
 
 if __name__ == '__main__':
@@ -14,6 +14,7 @@
 """Main scripts to run image classification."""
 
 import argparse
+import functools
 import sys
 import time
 
@@ -23,13 +24,36 @@ import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
+from metrics import PipelineMetrics
+from offline import run_offline
+from renderer import PanelRenderer
+
+
+def create_classifier(model: str, max_results: int, score_threshold: float,
+                      running_mode: vision.RunningMode,
+                      result_callback=None) -> vision.ImageClassifier:
+  """Creates an image classifier.
+
+  Args:
+      model: Name of the TFLite image classification model.
+      max_results: Max of classification results.
+      score_threshold: The score threshold of classification results.
+      running_mode: The running mode of the classifier.
+      result_callback: The callback receiving results in LIVE_STREAM mode.
+  """
+  base_options = python.BaseOptions(model_asset_path=model)
+  options = vision.ImageClassifierOptions(base_options=base_options,
+                                          running_mode=running_mode,
+                                          max_results=max_results,
+                                          score_threshold=score_threshold,
+                                          result_callback=result_callback)
+  return vision.ImageClassifier.create_from_options(options)
 
 
 def run(model: str, max_results: int, score_threshold: float, camera_id: int,
-        width: int, height: int) -> None:
+        width: int, height: int, input_path: str, output_path: str,
+        num_workers: int, metrics_output: str,
+        panel_refresh_rate: float) -> None:
   """Continuously run inference on images acquired from the camera.
 
   Args:
@@ -39,8 +63,25 @@ def run(model: str, max_results: int, score_threshold: float, camera_id: int,
       camera_id: The camera id to be passed to OpenCV.
       width: The width of the frame captured from the camera.
       height: The height of the frame captured from the camera.
+      input_path: Path of a video file or image folder to process without a
+        display instead of the camera.
+      output_path: Path of the file the results of `input_path` are written
+        to.
+      num_workers: Number of processes splitting `input_path` between
+        them.
+      metrics_output: Path of the file the per-stage latencies are written
+        to on exit, or None.
+      panel_refresh_rate: Max number of times per second the side panel is
+        updated, or 0 to update it with every frame.
   """
 
+  if input_path:
+    run_offline(input_path, output_path,
+                functools.partial(create_classifier, model, max_results,
+                                  score_threshold), 'classify',
+                num_workers)
+    return
+
   # Start capturing video input from the camera
   cap = cv2.VideoCapture(camera_id)
   cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -52,101 +93,88 @@ def run(model: str, max_results: int, score_threshold: float, camera_id: int,
   text_color = (0, 0, 0)  # black
   font_size = 1
   font_thickness = 1
-  fps_avg_frame_count = 10
 
   # Label box parameters
   label_text_color = (0, 0, 0)  # red
   label_background_color = (255, 255, 255)  # white
   label_font_size = 1
   label_thickness = 2
-  label_width = 50  # pixels
   label_rect_size = 16  # pixels
   label_margin = 40
   label_padding_width = 600  # pixels
 
-  classification_frame = None
+  # The labels are only rasterized when they first show up and the panel is
+  # only redrawn when the results change, instead of on every frame.
+  classification_panel = PanelRenderer(
+      label_padding_width, background_color=label_background_color,
+      text_color=label_text_color, font=cv2.FONT_HERSHEY_DUPLEX,
+      font_scale=label_font_size, font_thickness=label_thickness,
+      row_height=label_rect_size + label_margin, margin=label_margin,
+      refresh_rate=panel_refresh_rate)
+
+  classification_rows = []
   classification_result_list = []
+  metrics = PipelineMetrics()
 
   def save_result(result: vision.ImageClassifierResult, unused_output_image: mp.Image, timestamp_ms: int):
-      global FPS, COUNTER, START_TIME
-
-      # Calculate the FPS
-      if COUNTER % fps_avg_frame_count == 0:
-          FPS = fps_avg_frame_count / (time.time() - START_TIME)
-          START_TIME = time.time()
-
       classification_result_list.append(result)
-      COUNTER += 1
+      metrics.mark_result(timestamp_ms)
 
   # Initialize the image classification model
-  base_options = python.BaseOptions(model_asset_path=model)
-  options = vision.ImageClassifierOptions(base_options=base_options,
-                                          running_mode=vision.RunningMode.LIVE_STREAM,
-                                          max_results=max_results,
-                                          score_threshold=score_threshold,
-                                          result_callback=save_result)
-  classifier = vision.ImageClassifier.create_from_options(options)
+  classifier = create_classifier(model, max_results, score_threshold,
+                                 vision.RunningMode.LIVE_STREAM, save_result)
 
   # Continuously capture images from the camera and run inference
   while cap.isOpened():
-    success, image = cap.read()
+    with metrics.measure('capture'):
+      success, image = cap.read()
     if not success:
       sys.exit(
           'ERROR: Unable to read from webcam. Please verify your webcam settings.'
       )
 
-    image = cv2.flip(image, 1)
+    with metrics.measure('preprocess'):
+      image = cv2.flip(image, 1)
 
-    # Convert the image from BGR to RGB as required by the TFLite model.
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
+      # Convert the image from BGR to RGB as required by the TFLite model.
+      rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+      mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
 
     # Run image classifier using the model.
-    classifier.classify_async(mp_image, time.time_ns() // 1_000_000)
+    timestamp_ms = time.time_ns() // 1_000_000
+    metrics.mark_submitted(timestamp_ms)
+    classifier.classify_async(mp_image, timestamp_ms)
+    render_start_time = time.perf_counter()
 
     # Show the FPS
-    fps_text = 'FPS = {:.1f}'.format(FPS)
+    fps_text = 'FPS = {:.1f}'.format(metrics.fps)
     text_location = (left_margin, row_size)
     current_frame = image
     cv2.putText(current_frame, fps_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
                 font_size, text_color, font_thickness, cv2.LINE_AA)
 
-    # Initialize the origin coordinates of the label.
-    legend_x = current_frame.shape[1] + label_margin
-    legend_y = current_frame.shape[0] // label_width + label_margin
-
-    # Expand the frame to show the labels.
-    current_frame = cv2.copyMakeBorder(current_frame, 0, 0, 0, label_padding_width,
-                                       cv2.BORDER_CONSTANT, None,
-                                       label_background_color)
-
-    # Show the labels on right-side frame.
+    # Show the latest classification results on the right side of the
+    # frame.
     if classification_result_list:
-      # Show classification results.
-      for idx, category in enumerate(classification_result_list[0].classifications[0].categories):
-        category_name = category.category_name
-        score = round(category.score, 2)
-        result_text = category_name + ' (' + str(score) + ')'
-
-        label_location = legend_x + label_rect_size + label_margin, legend_y + label_margin
-        cv2.putText(current_frame, result_text, label_location,
-                    cv2.FONT_HERSHEY_DUPLEX, label_font_size, label_text_color,
-                    label_thickness, cv2.LINE_AA)
-        legend_y += (label_rect_size + label_margin)
-
-      classification_frame = current_frame
+      categories = classification_result_list[0].classifications[0].categories
+      classification_rows = [(category.category_name, category.score)
+                             for category in categories]
       classification_result_list.clear()
-
-    if classification_frame is not None:
-        cv2.imshow('image_classification', classification_frame)
+    current_frame = classification_panel.render(current_frame,
+                                                classification_rows)
+    cv2.imshow('image_classification', current_frame)
 
     # Stop the program if the ESC key is pressed.
-    if cv2.waitKey(1) == 27:
+    key = cv2.waitKey(1)
+    metrics.record('render', (time.perf_counter() - render_start_time) * 1000)
+    if key == 27:
         break
 
   classifier.close()
   cap.release()
   cv2.destroyAllWindows()
+  print(metrics.summary())
+  metrics.write(metrics_output)
 
 
 def main():
@@ -184,10 +212,44 @@ def main():
       help='Height of frame to capture from camera.',
       required=False,
       default=480)
+  parser.add_argument(
+      '--input',
+      help='Path of a video file or image folder to process without a display '
+           'instead of the camera.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON Lines file to write the results of --input to.',
+      required=False,
+      default='results.jsonl')
+  parser.add_argument(
+      '--numWorkers',
+      help='Number of processes splitting --input between them, each with '
+           'its own model instance.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--metricsOutput',
+      help='Path of the file to write the per-stage latencies to on exit, '
+           'as Prometheus text if it ends in .prom or .txt, as JSON '
+           'otherwise.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--panelRefreshRate',
+      help='Max number of times per second the side panel is updated, or '
+           '0 to update it with every frame.',
+      required=False,
+      type=float,
+      default=0)
   args = parser.parse_args()
 
   run(args.model, int(args.maxResults),
-      args.scoreThreshold, int(args.cameraId), args.frameWidth, args.frameHeight)
+      args.scoreThreshold, int(args.cameraId), args.frameWidth, args.frameHeight,
+      args.input, args.output, args.numWorkers, args.metricsOutput,
+      args.panelRefreshRate)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,250 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs a vision task over video files and image folders without a display."""
+
+import concurrent.futures
+import dataclasses
+import enum
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from mediapipe.tasks.python import vision
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+
+def running_mode_for(input_path: str) -> vision.RunningMode:
+  """Returns the running mode to process the given input with.
+
+  Args:
+    input_path: Path of a video file or of a folder of images.
+  """
+  if os.path.isdir(input_path):
+    return vision.RunningMode.IMAGE
+  return vision.RunningMode.VIDEO
+
+
+def _list_images(input_path: str) -> List[str]:
+  return [
+      name for name in sorted(os.listdir(input_path))
+      if name.lower().endswith(IMAGE_EXTENSIONS)
+  ]
+
+
+def count_frames(input_path: str) -> int:
+  """Returns the number of frames of a video file or images of a folder.
+
+  The frame count of a video comes from its container and may be approximate,
+  or 0 if the container doesn't record it.
+  """
+  if os.path.isdir(input_path):
+    return len(_list_images(input_path))
+  cap = cv2.VideoCapture(input_path)
+  try:
+    return max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+  finally:
+    cap.release()
+
+
+def read_frames(
+    input_path: str,
+    start: int = 0,
+    stop: Optional[int] = None) -> Iterator[Tuple[str, int, int, np.ndarray]]:
+  """Reads the frames of a video file or the images of a folder.
+
+  Args:
+    input_path: Path of a video file or of a folder of images. The images of
+      a folder are read in file name order.
+    start: Index of the first frame to read.
+    stop: Index of the frame to stop before, or None to read until the end.
+
+  Yields:
+    The source of each frame, its index, its timestamp in milliseconds and the
+    RGB image. Images of a folder all have a timestamp of 0.
+  """
+  if os.path.isdir(input_path):
+    names = _list_images(input_path)
+    for index in range(start, len(names) if stop is None else stop):
+      image = cv2.imread(os.path.join(input_path, names[index]))
+      if image is None:
+        print('WARNING: Unable to read image {}, skipping it.'.format(
+            names[index]))
+        continue
+      yield names[index], index, 0, cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return
+
+  cap = cv2.VideoCapture(input_path)
+  if not cap.isOpened():
+    raise ValueError('Unable to open video file {}.'.format(input_path))
+  fps = cap.get(cv2.CAP_PROP_FPS) or 30
+  if start:
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+  index = start
+  try:
+    while stop is None or index < stop:
+      success, image = cap.read()
+      if not success:
+        break
+      # Derive timestamps from the frame rate rather than the wall clock, so
+      # they are reproducible and increase monotonically as VIDEO mode
+      # requires.
+      yield input_path, index, round(index * 1000 / fps), cv2.cvtColor(
+          image, cv2.COLOR_BGR2RGB)
+      index += 1
+  finally:
+    cap.release()
+
+
+def result_to_dict(value: Any) -> Any:
+  """Converts a task result into values that can be serialized to JSON.
+
+  Images, such as segmentation masks, are left out.
+  """
+  if isinstance(value, mp.Image):
+    return None
+  if dataclasses.is_dataclass(value):
+    return {
+        field.name: result_to_dict(getattr(value, field.name))
+        for field in dataclasses.fields(value)
+        if not isinstance(getattr(value, field.name), mp.Image)
+    }
+  if isinstance(value, (list, tuple)):
+    return [result_to_dict(item) for item in value]
+  if isinstance(value, np.ndarray):
+    return value.tolist()
+  if isinstance(value, enum.Enum):
+    return value.name
+  if isinstance(value, np.generic):
+    return value.item()
+  return value
+
+
+def _process_frames(input_path: str, output_path: str,
+                    create_task: Callable[[vision.RunningMode], Any],
+                    method_name: str, start: int = 0,
+                    stop: Optional[int] = None) -> int:
+  """Runs a task over a range of frames and writes the results.
+
+  Returns:
+    The number of frames processed.
+  """
+  running_mode = running_mode_for(input_path)
+  frame_count = 0
+  with create_task(running_mode) as task, open(output_path, 'w') as output:
+    is_video = running_mode == vision.RunningMode.VIDEO
+    process = getattr(task,
+                      method_name + '_for_video' if is_video else method_name)
+
+    for source, index, timestamp_ms, rgb_image in read_frames(
+        input_path, start, stop):
+      mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
+      if is_video:
+        result = process(mp_image, timestamp_ms)
+      else:
+        result = process(mp_image)
+      output.write(json.dumps({
+          'source': source,
+          'frame_index': index,
+          'timestamp_ms': timestamp_ms,
+          'result': result_to_dict(result),
+      }) + '\n')
+      frame_count += 1
+  return frame_count
+
+
+def _process_sharded(input_path: str, output_path: str,
+                     create_task: Callable[[vision.RunningMode], Any],
+                     method_name: str, num_workers: int,
+                     total_frames: int) -> int:
+  """Splits the input into segments processed by a pool of processes.
+
+  Each worker process creates its own task instance for every segment, so
+  tracking across frames, as done by the landmarkers in VIDEO mode, restarts
+  at each segment boundary.
+
+  Returns:
+    The number of frames processed.
+  """
+  # Use a few segments per worker so that a slow segment doesn't leave the
+  # other workers idle at the end of the run.
+  num_segments = min(total_frames, num_workers * 4)
+  bounds = [total_frames * i // num_segments for i in range(num_segments + 1)]
+  # The frame count of a video may be approximate, so the last segment reads
+  # until the end of the input.
+  bounds[-1] = None
+
+  output_dir = os.path.dirname(os.path.abspath(output_path))
+  with tempfile.TemporaryDirectory(dir=output_dir) as shard_dir:
+    shard_paths = [
+        os.path.join(shard_dir, '{}.jsonl'.format(i))
+        for i in range(num_segments)
+    ]
+    with concurrent.futures.ProcessPoolExecutor(num_workers) as executor:
+      futures = [
+          executor.submit(_process_frames, input_path, shard_path, create_task,
+                          method_name, bounds[i], bounds[i + 1])
+          for i, shard_path in enumerate(shard_paths)
+      ]
+      frame_count = sum(future.result() for future in futures)
+
+    # Segments cover consecutive frame ranges, so concatenating them in
+    # segment order keeps the results in timestamp order.
+    with open(output_path, 'w') as output:
+      for shard_path in shard_paths:
+        with open(shard_path) as shard:
+          shutil.copyfileobj(shard, output)
+  return frame_count
+
+
+def run_offline(input_path: str, output_path: str,
+                create_task: Callable[[vision.RunningMode], Any],
+                method_name: str, num_workers: int = 1) -> None:
+  """Runs a vision task over every frame of the input as fast as possible.
+
+  Nothing is drawn or displayed. The result of each frame is written to the
+  output file as one line of JSON.
+
+  Args:
+    input_path: Path of a video file, processed in VIDEO mode, or of a folder
+      of images, processed in IMAGE mode.
+    output_path: Path of the JSON Lines file to write the results to.
+    create_task: Creates the task for the given running mode. It must be
+      picklable, e.g. a module level function, when `num_workers` is above 1.
+    method_name: Name of the task method processing a single image, e.g.
+      `detect`. Videos use its `_for_video` counterpart.
+    num_workers: Number of processes splitting the input between them, each
+      with its own task instance.
+  """
+  start_time = time.time()
+  total_frames = count_frames(input_path) if num_workers > 1 else 0
+  if total_frames > 1:
+    frame_count = _process_sharded(input_path, output_path, create_task,
+                                   method_name, num_workers, total_frames)
+  else:
+    frame_count = _process_frames(input_path, output_path, create_task,
+                                  method_name)
+
+  elapsed_time = time.time() - start_time
+  print('Processed {} frames in {:.1f} s ({:.1f} FPS), results written to {}'
+        .format(frame_count, elapsed_time,
+                frame_count / elapsed_time if elapsed_time else 0,
+                output_path))
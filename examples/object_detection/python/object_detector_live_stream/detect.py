@@ -4,6 +4,7 @@ import time
 
 import cv2
 import mediapipe as mp
+import numpy as np
 
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
@@ -55,25 +56,32 @@ def run(model: str, camera_id: int, width: int, height: int) -> None:
   detector = vision.ObjectDetector.create_from_options(options)
 
 
+  # Buffers reused across frames, so that no image is allocated per frame.
+  image, rgb_image = None, None
+
   # Continuously capture images from the camera and run inference
   while cap.isOpened():
-    success, image = cap.read()
+    success, image = cap.read(image)
     if not success:
       sys.exit(
           'ERROR: Unable to read from webcam. Please verify your webcam settings.'
       )
 
     counter += 1
-    image = cv2.flip(image, 1)
+    cv2.flip(image, 1, dst=image)
 
     # Convert the image from BGR to RGB as required by the TFLite model.
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    if rgb_image is None or rgb_image.shape != image.shape:
+      rgb_image = np.empty_like(image)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb_image)
     mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
 
     # Run object detection using the model.
     detector.detect_async(mp_image, counter)
-    current_frame = mp_image.numpy_view()
-    current_frame = cv2.cvtColor(current_frame, cv2.COLOR_RGB2BGR)
+
+    # Draw on the mirrored BGR image directly instead of converting the model
+    # input back from RGB.
+    current_frame = image
 
     # Calculate the FPS
     if counter % fps_avg_frame_count == 0:
@@ -14,8 +14,9 @@
 """Main scripts to run object detection."""
 
 import argparse
+import functools
 import sys
-import time
+from typing import Any, Callable, List, Optional
 
 import cv2
 import mediapipe as mp
@@ -23,15 +24,97 @@ import mediapipe as mp
 from mediapipe.tasks import python
 from mediapipe.tasks.python import vision
 
+from metrics import PipelineMetrics
+from multiplexer import Multiplexer
+from multiplexer import mosaic
+from offline import run_offline
+from pipeline import AdmissionController
+from pipeline import Frame
+from pipeline import InputScaler
+from pipeline import MotionGate
+from pipeline import VisionPipeline
+from pipeline import model_input_size
+from tiling import MERGE_METHODS
+from tiling import TiledDetector
+from tracker import BoxTracker
+from tracker import DetectionSchedule
+from tracker import detections_to_arrays
+from utils import remap_detections
 from utils import visualize
+from utils import visualize_tracks
 
-# Global variables to calculate FPS
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
+DETECTION_RESULT = None
+TRACKS = []
 
 
-def run(model: str, max_results: int, score_threshold: float, 
-        camera_id: int, width: int, height: int) -> None:
+def create_detector(model: str, max_results: int, score_threshold: float,
+                    running_mode: vision.RunningMode,
+                    result_callback=None) -> vision.ObjectDetector:
+  """Creates an object detector.
+
+  Args:
+    model: Name of the TFLite object detection model.
+    max_results: Max number of detection results.
+    score_threshold: The score threshold of detection results.
+    running_mode: The running mode of the detector.
+    result_callback: The callback receiving results in LIVE_STREAM mode.
+  """
+  base_options = python.BaseOptions(model_asset_path=model)
+  options = vision.ObjectDetectorOptions(base_options=base_options,
+                                         running_mode=running_mode,
+                                         max_results=max_results, score_threshold=score_threshold,
+                                         result_callback=result_callback)
+  return vision.ObjectDetector.create_from_options(options)
+
+
+def run_multiplexed(create_task: Callable[[], Any], sources: List[str],
+                    num_detectors: int, source_weights: Optional[List[float]],
+                    width: int, height: int) -> None:
+  """Runs a shared pool of detectors over several sources, shown in a grid.
+
+  Args:
+    create_task: Creates a detector in IMAGE mode.
+    sources: Camera ids, video files or stream URLs.
+    num_detectors: Number of detector instances shared by the sources.
+    source_weights: Relative share of the detectors of each source, or None
+      for an equal share.
+    width: The width of the frames captured from cameras.
+    height: The height of the frames captured from cameras.
+  """
+  multiplexer = Multiplexer(sources, create_task, 'detect', num_detectors,
+                            source_weights, width, height)
+  multiplexer.start()
+  try:
+    while not multiplexer.done:
+      if multiplexer.wait_for_results(timeout=0.1):
+        tiles = []
+        for stream, image, result in multiplexer.latest_results():
+          if image is not None:
+            image = visualize(image.copy(), result)
+            cv2.putText(image, '{} FPS = {:.1f}'.format(stream.name,
+                                                        stream.fps),
+                        (24, 50), cv2.FONT_HERSHEY_DUPLEX, 1, (0, 0, 0), 1,
+                        cv2.LINE_AA)
+          tiles.append(image)
+        cv2.imshow('object_detection', mosaic(tiles, 640, 360))
+
+      # Stop the program if the ESC key is pressed.
+      if cv2.waitKey(1) == 27:
+        break
+  finally:
+    multiplexer.stop()
+    cv2.destroyAllWindows()
+  print(multiplexer.summary())
+
+
+def run(model: str, max_results: int, score_threshold: float,
+        camera_id: int, width: int, height: int, max_in_flight: int,
+        input_path: str, output_path: str, num_workers: int,
+        metrics_output: str, sources: List[str], num_detectors: int,
+        source_weights: Optional[List[float]],
+        detection_interval: int, motion_threshold: float,
+        heartbeat: float, input_size: int, tile_rows: int,
+        tile_columns: int, tile_overlap: float, tile_merge: str) -> None:
   """Continuously run inference on images acquired from the camera.
 
   Args:
@@ -41,8 +124,52 @@ def run(model: str, max_results: int, score_threshold: float,
     camera_id: The camera id to be passed to OpenCV.
     width: The width of the frame captured from the camera.
     height: The height of the frame captured from the camera.
+    max_in_flight: Max number of frames waiting for a detection result.
+    input_path: Path of a video file or image folder to process without a
+      display instead of the camera.
+    output_path: Path of the file the results of `input_path` are written to.
+    num_workers: Number of processes splitting `input_path` between
+      them.
+    metrics_output: Path of the file the per-stage latencies are written
+      to on exit, or None.
+    sources: Camera ids, video files or stream URLs to run on at once
+      instead of the camera, or None.
+    num_detectors: Number of detector instances shared by `sources`, or by
+      the tiles of each frame.
+    source_weights: Relative share of the detectors of each of `sources`,
+      or None for an equal share.
+    detection_interval: Max number of frames between two detections. Boxes
+      are tracked on the frames in between. The detector runs on every frame
+      if 1.
+    motion_threshold: Min fraction of the pixels of a frame that must
+      change for it to be sent to the model, or 0 to send every frame.
+    heartbeat: Max time in seconds between two frames sent to the model
+      when `motion_threshold` is set.
+    input_size: Side of the square the frames are letterboxed to before
+      being sent to the model, -1 to use the model input size, or 0 to send
+      full frames.
+    tile_rows: Number of rows of tiles each frame is split into.
+    tile_columns: Number of columns of tiles each frame is split into. The
+      whole frame is sent to the model if there is a single tile.
+    tile_overlap: Fraction of a tile shared with its neighbours.
+    tile_merge: How the duplicate boxes of neighbouring tiles are merged,
+      `nms` or `wbf`.
   """
 
+  if input_path:
+    run_offline(input_path, output_path,
+                functools.partial(create_detector, model, max_results,
+                                  score_threshold), 'detect',
+                num_workers)
+    return
+
+  if sources:
+    run_multiplexed(
+        functools.partial(create_detector, model, max_results,
+                          score_threshold, vision.RunningMode.IMAGE),
+        sources, num_detectors, source_weights, width, height)
+    return
+
   # Start capturing video input from the camera
   cap = cv2.VideoCapture(camera_id)
   cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
@@ -54,71 +181,127 @@ def run(model: str, max_results: int, score_threshold: float,
   text_color = (0, 0, 0)  # black
   font_size = 1
   font_thickness = 1
-  fps_avg_frame_count = 10
 
-  detection_frame = None
-  detection_result_list = []
+  # Only admit a new frame to the detector once a previous one is done, so
+  # that frames can't pile up in front of the model.
+  admission = AdmissionController(max_in_flight)
+  metrics = PipelineMetrics()
+
+  # Run each tile of a large frame on a pool of detectors in IMAGE mode, so
+  # that small objects aren't lost when the frame is shrunk for the model.
+  tiled_detector = None
+  if tile_rows * tile_columns > 1:
+    tiled_detector = TiledDetector(
+        functools.partial(create_detector, model, max_results,
+                          score_threshold, vision.RunningMode.IMAGE),
+        tile_rows, tile_columns, tile_overlap, num_detectors, tile_merge)
+
+  # Send the model frames at its input size rather than at the camera's.
+  # Tiles need the full frame.
+  input_scaler = None
+  scaled_size = ((input_size, input_size) if input_size > 0 else
+                 model_input_size(model) if input_size < 0 else None)
+  if scaled_size and tiled_detector is None:
+    input_scaler = InputScaler(scaled_size)
+
+  # With tracking, the detector only runs on some frames, asynchronously,
+  # and boxes are predicted by the tracker on every frame.
+  tracker = BoxTracker() if detection_interval > 1 else None
+  schedule = DetectionSchedule(detection_interval)
+  # Lets one detection run at a time, and gives up on one whose result is
+  # more than a second late so that tracking doesn't stop for good.
+  detector_admission = AdmissionController(1)
 
   def save_result(result: vision.ObjectDetectorResult, unused_output_image: mp.Image, timestamp_ms: int):
-      global FPS, COUNTER, START_TIME
+      global DETECTION_RESULT
 
-      # Calculate the FPS
-      if COUNTER % fps_avg_frame_count == 0:
-          FPS = fps_avg_frame_count / (time.time() - START_TIME)
-          START_TIME = time.time()
+      transform = (input_scaler.pop_transform(timestamp_ms)
+                   if input_scaler is not None else None)
+      if transform is not None:
+        result = remap_detections(result, transform)
+      if tracker is not None:
+        schedule.record_quality(
+            tracker.update(timestamp_ms, *detections_to_arrays(result)))
+        detector_admission.complete(timestamp_ms)
+        return
 
-      detection_result_list.append(result)
-      COUNTER += 1
+      DETECTION_RESULT = result
+      admission.complete(timestamp_ms)
+      metrics.mark_result(timestamp_ms)
 
-  # Initialize the object detection model
-  base_options = python.BaseOptions(model_asset_path=model)
-  options = vision.ObjectDetectorOptions(base_options=base_options,
-                                         running_mode=vision.RunningMode.LIVE_STREAM,
-                                         max_results=max_results, score_threshold=score_threshold,
-                                         result_callback=save_result)
-  detector = vision.ObjectDetector.create_from_options(options)
+  def detect_tiles(mp_image: mp.Image, timestamp_ms: int) -> None:
+    save_result(tiled_detector.detect(mp_image), mp_image, timestamp_ms)
 
+  # Initialize the object detection model
+  if tiled_detector is None:
+    detector = create_detector(model, max_results, score_threshold,
+                               vision.RunningMode.LIVE_STREAM, save_result)
+    detect = detector.detect_async
+  else:
+    detector = tiled_detector
+    detect = detect_tiles
 
-  # Continuously capture images from the camera and run inference
-  while cap.isOpened():
-    success, image = cap.read()
-    if not success:
-      sys.exit(
-          'ERROR: Unable to read from webcam. Please verify your webcam settings.'
-      )
+  def track(mp_image: mp.Image, timestamp_ms: int) -> None:
+    global TRACKS
 
-    image = cv2.flip(image, 1)
+    if schedule.is_due():
+      detector_admission.offer(Frame(timestamp_ms=timestamp_ms))
+      if detector_admission.take(0) is not None:
+        schedule.detected()
+        detect(mp_image, timestamp_ms)
+    TRACKS = tracker.predict(timestamp_ms)
+    admission.complete(timestamp_ms)
+    metrics.mark_result(timestamp_ms)
 
-    # Convert the image from BGR to RGB as required by the TFLite model.
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_image)
+  # Only send the frames that changed to the model, plus one per heartbeat.
+  motion_gate = (MotionGate(motion_threshold, heartbeat)
+                 if motion_threshold > 0 else None)
 
-    # Run object detection using the model.
-    detector.detect_async(mp_image, time.time_ns() // 1_000_000)
+  # Capture, preprocess and run inference on their own threads so that slow
+  # camera reads or rendering don't hold back the model.
+  pipeline = VisionPipeline(cap,
+                            detect if tracker is None else track,
+                            admission, metrics, motion_gate=motion_gate,
+                            input_scaler=input_scaler)
+  pipeline.start()
 
+  for frame in pipeline.frames():
     # Show the FPS
-    fps_text = 'FPS = {:.1f}'.format(FPS)
+    fps_text = 'FPS = {:.1f}'.format(metrics.fps)
     text_location = (left_margin, row_size)
-    current_frame = image
+    current_frame = frame.image
     cv2.putText(current_frame, fps_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
                 font_size, text_color, font_thickness, cv2.LINE_AA)
 
-    if detection_result_list:
-        # print(detection_result_list)
-        current_frame = visualize(current_frame, detection_result_list[0])
-        detection_frame = current_frame
-        detection_result_list.clear()
+    if tracker is not None:
+      current_frame = visualize_tracks(current_frame, TRACKS)
+    elif DETECTION_RESULT:
+        # print(DETECTION_RESULT)
+        current_frame = visualize(current_frame, DETECTION_RESULT)
 
-    if detection_frame is not None:
-        cv2.imshow('object_detection', detection_frame)
+    cv2.imshow('object_detection', current_frame)
 
     # Stop the program if the ESC key is pressed.
     if cv2.waitKey(1) == 27:
       break
 
+  pipeline.stop()
   detector.close()
   cap.release()
   cv2.destroyAllWindows()
+  print(metrics.summary())
+  metrics.write(metrics_output)
+  if motion_gate is not None:
+    print(motion_gate.summary())
+  print('Frames completed: {}, superseded: {}, dropped: {}'.format(
+      admission.completed, admission.superseded, admission.dropped))
+  if tracker is not None:
+    print('Detector ran on {} of {} frames'.format(schedule.detections,
+                                                  schedule.frames))
+  if tiled_detector is not None:
+    print(tiled_detector.summary())
+  if pipeline.error:
+    sys.exit(pipeline.error)
 
 
 def main():
@@ -158,10 +341,129 @@ def main():
       required=False,
       type=int,
       default=720)
+  parser.add_argument(
+      '--maxInFlight',
+      help='Max number of frames waiting for a detection result. Newer frames '
+           'replace older ones while the detector is busy.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--input',
+      help='Path of a video file or image folder to process without a display '
+           'instead of the camera.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON Lines file to write the results of --input to.',
+      required=False,
+      default='results.jsonl')
+  parser.add_argument(
+      '--numWorkers',
+      help='Number of processes splitting --input between them, each with '
+           'its own model instance.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--metricsOutput',
+      help='Path of the file to write the per-stage latencies to on exit, '
+           'as Prometheus text if it ends in .prom or .txt, as JSON '
+           'otherwise.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--sources',
+      help='Camera ids, video files or stream URLs to run on at once instead '
+           'of --cameraId, sharing a pool of detectors.',
+      required=False,
+      nargs='+',
+      default=None)
+  parser.add_argument(
+      '--numDetectors',
+      help='Number of detector instances shared by --sources, or by the '
+           'tiles of each frame.',
+      required=False,
+      type=int,
+      default=2)
+  parser.add_argument(
+      '--sourceWeights',
+      help='Relative share of the detectors of each of --sources, e.g. 2 1 1 '
+           'to give the first source twice the frame rate of the others '
+           'when the detectors are busy.',
+      required=False,
+      nargs='+',
+      type=float,
+      default=None)
+  parser.add_argument(
+      '--detectionInterval',
+      help='Max number of frames between two detections, with boxes tracked '
+           'in between. The detector runs more often while objects appear, '
+           'disappear or change direction. 1 runs it on every frame.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--motionThreshold',
+      help='Min fraction of the pixels of a frame that must change for '
+           'it to be sent to the model. Unchanged frames are shown with '
+           'the previous result. 0 sends every frame to the model.',
+      required=False,
+      type=float,
+      default=0)
+  parser.add_argument(
+      '--heartbeat',
+      help='Max time in seconds between two frames sent to the model '
+           'when --motionThreshold is set, so results refresh in a static '
+           'scene.',
+      required=False,
+      type=float,
+      default=1.0)
+  parser.add_argument(
+      '--inputSize',
+      help='Side of the square the frames are letterboxed to before being '
+           'sent to the model. -1 reads the input size of the model, 0 sends '
+           'full frames.',
+      required=False,
+      type=int,
+      default=0)
+  parser.add_argument(
+      '--tileRows',
+      help='Number of rows of tiles each frame is split into, to find small '
+           'objects in large frames.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--tileColumns',
+      help='Number of columns of tiles each frame is split into.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--tileOverlap',
+      help='Fraction of the width and height of a tile shared with its '
+           'neighbours.',
+      required=False,
+      type=float,
+      default=0.2)
+  parser.add_argument(
+      '--tileMerge',
+      help='How the duplicate boxes of neighbouring tiles are merged: nms '
+           'keeps the best one, wbf fuses them.',
+      required=False,
+      choices=MERGE_METHODS,
+      default='nms')
   args = parser.parse_args()
 
   run(args.model, int(args.maxResults),
-      args.scoreThreshold, int(args.cameraId), args.frameWidth, args.frameHeight)
+      args.scoreThreshold, int(args.cameraId), args.frameWidth, args.frameHeight,
+      args.maxInFlight, args.input, args.output, args.numWorkers,
+      args.metricsOutput, args.sources,
+      args.numDetectors, args.sourceWeights, args.detectionInterval,
+      args.motionThreshold, args.heartbeat, args.inputSize, args.tileRows,
+      args.tileColumns, args.tileOverlap, args.tileMerge)
 
 
 if __name__ == '__main__':
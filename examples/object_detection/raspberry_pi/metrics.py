@@ -0,0 +1,254 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-stage latency histograms exportable as JSON or Prometheus text."""
+
+import bisect
+import collections
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+# Upper bounds of the histogram buckets in milliseconds. Samples above the
+# last bound fall into an overflow bucket.
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20, 25,
+                    30, 40, 50, 65, 80, 100, 125, 150, 200, 250, 300, 400, 500,
+                    750, 1000, 2000, 5000)
+
+STAGES = ('capture', 'preprocess', 'queue_wait', 'inference', 'render')
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram(object):
+  """Counts latency samples into fixed buckets.
+
+  Memory use doesn't grow with the number of samples, so a histogram can be
+  fed for the whole lifetime of a pipeline. Percentiles are estimated by
+  interpolating within the bucket they fall into. This class is not thread
+  safe on its own.
+  """
+
+  def __init__(self, bounds_ms: Sequence[float] = BUCKET_BOUNDS_MS) -> None:
+    """Initializes the histogram.
+
+    Args:
+      bounds_ms: Increasing upper bounds of the buckets in milliseconds.
+    """
+    self.bounds_ms = tuple(bounds_ms)
+    self.counts = [0] * (len(self.bounds_ms) + 1)
+    self.count = 0
+    self.sum_ms = 0.0
+    self.max_ms = 0.0
+
+  def record(self, value_ms: float) -> None:
+    """Adds a sample in milliseconds."""
+    self.counts[bisect.bisect_left(self.bounds_ms, value_ms)] += 1
+    self.count += 1
+    self.sum_ms += value_ms
+    self.max_ms = max(self.max_ms, value_ms)
+
+  def percentile(self, percent: float) -> float:
+    """Returns the estimated value below which `percent` % of samples fall.
+
+    Returns 0 if there are no samples.
+    """
+    if not self.count:
+      return 0.0
+    rank = self.count * percent / 100
+    seen = 0
+    for index, bucket_count in enumerate(self.counts):
+      if bucket_count and seen + bucket_count >= rank:
+        lower = self.bounds_ms[index - 1] if index else 0.0
+        upper = (self.bounds_ms[index] if index < len(self.bounds_ms)
+                 else self.max_ms)
+        # Never report more than the largest sample seen.
+        upper = min(upper, self.max_ms)
+        return lower + (upper - lower) * (rank - seen) / bucket_count
+      seen += bucket_count
+    return self.max_ms
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Returns the sample count, mean, max and percentiles in milliseconds."""
+    summary = {
+        'count': self.count,
+        'mean_ms': self.sum_ms / self.count if self.count else 0.0,
+        'max_ms': self.max_ms,
+    }
+    for percent in PERCENTILES:
+      summary['p{}_ms'.format(percent)] = self.percentile(percent)
+    return summary
+
+
+class PipelineMetrics(object):
+  """Records how long each stage of a vision pipeline takes per frame.
+
+  The stages are:
+    capture: Reading a frame from the camera, including the wait for it.
+    preprocess: Mirroring, color conversion and creation of the model input.
+    queue_wait: Time a preprocessed frame waits until it is submitted.
+    inference: From submitting a frame to the task until its result callback
+      runs, matched by the frame's timestamp.
+    render: Drawing and displaying a frame.
+
+  All methods are thread safe.
+
+  Attributes:
+    fps_window: Number of most recent results the result rate is averaged
+      over.
+  """
+
+  def __init__(self, fps_window: int = 10) -> None:
+    """Initializes the metrics.
+
+    Args:
+      fps_window: Number of most recent results the result rate is averaged
+        over.
+    """
+    self.fps_window = fps_window
+    self._lock = threading.Lock()
+    self._histograms = {stage: LatencyHistogram() for stage in STAGES}
+    # Maps the timestamp of each frame submitted to the task to the time it
+    # was submitted at.
+    self._submitted = collections.OrderedDict()
+    self._result_times = collections.deque(maxlen=fps_window + 1)
+
+  def record(self, stage: str, elapsed_ms: float) -> None:
+    """Adds the time a stage took for one frame."""
+    with self._lock:
+      self._histograms[stage].record(elapsed_ms)
+
+  @contextlib.contextmanager
+  def measure(self, stage: str) -> Iterator[None]:
+    """Records the time spent in the `with` block under the given stage."""
+    start_time = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.record(stage, (time.perf_counter() - start_time) * 1000)
+
+  def mark_submitted(self, timestamp_ms: int) -> None:
+    """Marks the frame with the given timestamp as submitted to the task."""
+    with self._lock:
+      self._submitted[timestamp_ms] = time.perf_counter()
+
+  def mark_result(self, timestamp_ms: int) -> None:
+    """Records the inference time of the frame with the given timestamp.
+
+    Call this from the task's result callback.
+    """
+    now = time.perf_counter()
+    with self._lock:
+      # Results come back in timestamp order, so frames submitted earlier
+      # that are still waiting were dropped by the task.
+      while self._submitted:
+        submitted_timestamp_ms = next(iter(self._submitted))
+        if submitted_timestamp_ms > timestamp_ms:
+          break
+        submit_time = self._submitted.pop(submitted_timestamp_ms)
+        if submitted_timestamp_ms == timestamp_ms:
+          self._histograms['inference'].record((now - submit_time) * 1000)
+      self._result_times.append(now)
+
+  @property
+  def fps(self) -> float:
+    """Rate at which results came back over the last `fps_window` results."""
+    with self._lock:
+      if len(self._result_times) < 2:
+        return 0.0
+      elapsed_time = self._result_times[-1] - self._result_times[0]
+      if not elapsed_time:
+        return 0.0
+      return (len(self._result_times) - 1) / elapsed_time
+
+  def to_dict(self) -> Dict[str, Any]:
+    """Returns a summary of every stage, keyed by stage name."""
+    with self._lock:
+      return {
+          stage: histogram.to_dict()
+          for stage, histogram in self._histograms.items()
+      }
+
+  def to_json(self) -> str:
+    """Returns the summary of every stage as JSON."""
+    return json.dumps(self.to_dict(), indent=2)
+
+  def to_prometheus(self, prefix: str = 'mediapipe_pipeline') -> str:
+    """Returns the histograms in the Prometheus text exposition format.
+
+    Latencies are exported in seconds, as Prometheus conventions expect, along
+    with the estimated percentiles as a gauge.
+
+    Args:
+      prefix: Prefix of the metric names.
+    """
+    name = prefix + '_stage_latency_seconds'
+    lines = [
+        '# HELP {} Time spent in each stage of the pipeline per frame.'.format(
+            name),
+        '# TYPE {} histogram'.format(name),
+    ]
+    quantile_lines = [
+        '# HELP {}_quantile Estimated latency percentiles per stage.'.format(
+            name),
+        '# TYPE {}_quantile gauge'.format(name),
+    ]
+    with self._lock:
+      for stage, histogram in self._histograms.items():
+        cumulative_count = 0
+        for bound_ms, bucket_count in zip(histogram.bounds_ms,
+                                          histogram.counts):
+          cumulative_count += bucket_count
+          lines.append('{}_bucket{{stage="{}",le="{:g}"}} {}'.format(
+              name, stage, bound_ms / 1000, cumulative_count))
+        lines.append('{}_bucket{{stage="{}",le="+Inf"}} {}'.format(
+            name, stage, histogram.count))
+        lines.append('{}_sum{{stage="{}"}} {:g}'.format(
+            name, stage, histogram.sum_ms / 1000))
+        lines.append('{}_count{{stage="{}"}} {}'.format(
+            name, stage, histogram.count))
+        for percent in PERCENTILES:
+          quantile_lines.append('{}_quantile{{stage="{}",quantile="{:g}"}} {:g}'
+                                .format(name, stage, percent / 100,
+                                        histogram.percentile(percent) / 1000))
+    return '\n'.join(lines + quantile_lines) + '\n'
+
+  def summary(self) -> str:
+    """Returns a human readable table of the stage percentiles."""
+    lines = ['{:<11}{:>8}{:>10}{:>10}{:>10}'.format('stage', 'frames',
+                                                   'p50 ms', 'p95 ms',
+                                                   'p99 ms')]
+    for stage, stats in self.to_dict().items():
+      lines.append('{:<11}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+          stage, stats['count'], stats['p50_ms'], stats['p95_ms'],
+          stats['p99_ms']))
+    return '\n'.join(lines)
+
+  def write(self, output_path: Optional[str]) -> None:
+    """Writes the metrics to a file.
+
+    Args:
+      output_path: Path of the file to write. Paths ending in `.prom` or
+        `.txt` get the Prometheus text format, any other path gets JSON.
+        Nothing is written if None.
+    """
+    if not output_path:
+      return
+    if output_path.endswith(('.prom', '.txt')):
+      content = self.to_prometheus()
+    else:
+      content = self.to_json() + '\n'
+    with open(output_path, 'w') as output:
+      output.write(content)
@@ -0,0 +1,352 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Detects small objects in large frames by running a detector on tiles."""
+
+import concurrent.futures
+import math
+import queue
+import threading
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+import mediapipe as mp
+import numpy as np
+
+from mediapipe.tasks.python import vision
+
+from metrics import LatencyHistogram
+from tracker import detections_to_arrays
+
+MERGE_METHODS = ('nms', 'wbf')
+# Max distance in pixels from a tile edge for a box side to count as cut.
+_EDGE_MARGIN = 2
+
+
+def tile_grid(frame_width: int, frame_height: int, rows: int, columns: int,
+              overlap: float) -> List[Tuple[int, int, int, int]]:
+  """Splits a frame into a grid of overlapping tiles of the same size.
+
+  Args:
+    frame_width: Width of the frame in pixels.
+    frame_height: Height of the frame in pixels.
+    rows: Number of rows of tiles.
+    columns: Number of columns of tiles.
+    overlap: Fraction of the width and height of a tile shared with the next
+      tile, from 0 to 1.
+
+  Returns:
+    The `(x0, y0, x1, y1)` region of each tile, row by row.
+  """
+  if rows < 1 or columns < 1:
+    raise ValueError('A tile grid needs at least one row and one column.')
+  if not 0 <= overlap < 1:
+    raise ValueError('The tile overlap must be between 0 and 1.')
+
+  def spans(length, count):
+    # The first tile starts at 0 and the last one ends at the frame edge.
+    size = min(math.ceil(length / (count - (count - 1) * overlap)), length)
+    starts = [round(i * (length - size) / max(count - 1, 1))
+              for i in range(count)]
+    return [(start, start + size) for start in starts]
+
+  return [(x0, y0, x1, y1)
+          for y0, y1 in spans(frame_height, rows)
+          for x0, x1 in spans(frame_width, columns)]
+
+
+def overlap_matrix(boxes: np.ndarray, metric: str = 'ios') -> np.ndarray:
+  """Returns how much every pair of boxes overlaps.
+
+  Args:
+    boxes: An (N, 4) array of `(x0, y0, x1, y1)` boxes.
+    metric: `iou` for the intersection over the union, or `ios` for the
+      intersection over the area of the smaller box, which also matches the
+      part of an object cut by a tile edge with the whole object.
+
+  Returns:
+    An (N, N) array.
+  """
+  if metric not in ('iou', 'ios'):
+    raise ValueError('Unknown overlap metric: {}'.format(metric))
+  # Each coordinate on its own, which is several times faster than
+  # reducing over a trailing axis of 2.
+  x0, y0, x1, y1 = boxes.T
+  widths = (np.minimum(x1[:, None], x1[None, :]) -
+            np.maximum(x0[:, None], x0[None, :]))
+  heights = (np.minimum(y1[:, None], y1[None, :]) -
+             np.maximum(y0[:, None], y0[None, :]))
+  intersection = np.clip(widths, 0, None) * np.clip(heights, 0, None)
+  area = (x1 - x0) * (y1 - y0)
+  if metric == 'iou':
+    denominator = area[:, None] + area[None, :] - intersection
+  else:
+    denominator = np.minimum(area[:, None], area[None, :])
+  return intersection / np.maximum(denominator, 1e-9)
+
+
+def cluster_boxes(boxes: np.ndarray, scores: np.ndarray, labels: np.ndarray,
+                  threshold: float, metric: str = 'ios') -> np.ndarray:
+  """Groups the overlapping boxes of each category, as greedy NMS would.
+
+  The overlaps of all pairs are computed at once. Then, from the highest
+  score down, each box not yet grouped takes every lower scored box of its
+  category that overlaps it by more than `threshold`, one vectorized row at
+  a time.
+
+  Args:
+    boxes: An (N, 4) array of `(x0, y0, x1, y1)` boxes.
+    scores: The score of each box.
+    labels: The category of each box.
+    threshold: Min overlap for two boxes to be grouped.
+    metric: The overlap metric, see `overlap_matrix()`.
+
+  Returns:
+    The index of the box leading the group of each box. NMS keeps the
+    leaders, the boxes that lead their own group.
+  """
+  order = np.argsort(-scores, kind='stable')
+  overlaps = overlap_matrix(boxes[order], metric) > threshold
+  labels = np.asarray(labels)[order]
+  overlaps &= labels[:, None] == labels[None, :]
+  # A box can only be taken by a box with a higher score.
+  overlaps = np.triu(overlaps, k=1)
+
+  leaders = np.arange(len(order))
+  ungrouped = np.ones(len(order), bool)
+  # Boxes overlapping no lower scored box lead their group alone, and most
+  # boxes are found by a single tile, so only loop over the others.
+  for i in np.flatnonzero(overlaps.any(axis=1)):
+    if ungrouped[i]:
+      members = overlaps[i] & ungrouped
+      leaders[members] = i
+      ungrouped[members] = False
+  grouped = np.empty_like(order)
+  grouped[order] = order[leaders]
+  return grouped
+
+
+def non_max_suppression(boxes: np.ndarray, scores: np.ndarray,
+                        labels: np.ndarray, threshold: float,
+                        metric: str = 'ios') -> np.ndarray:
+  """Returns the indices of the boxes kept by NMS, by decreasing score."""
+  leaders = cluster_boxes(boxes, scores, labels, threshold, metric)
+  kept = np.flatnonzero(leaders == np.arange(len(leaders)))
+  return kept[np.argsort(-scores[kept], kind='stable')]
+
+
+def weighted_box_fusion(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    labels: np.ndarray,
+    threshold: float,
+    metric: str = 'ios',
+    truncated: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+  """Fuses each group of overlapping boxes into their score weighted mean.
+
+  Unlike NMS, which keeps the best box of a group, fusion averages the
+  views of an object seen by several tiles. Each coordinate is averaged on
+  its own, so the side of a box cut by a tile edge barely counts when
+  another tile saw that side of the object.
+
+  Args:
+    boxes: An (N, 4) array of `(x0, y0, x1, y1)` boxes.
+    scores: The score of each box.
+    labels: The category of each box.
+    threshold: Min overlap for two boxes to be fused.
+    metric: The overlap metric, see `overlap_matrix()`.
+    truncated: An (N, 4) boolean array of the coordinates lying on a tile
+      edge inside the frame, which only bound the part of the object in the
+      tile.
+
+  Returns:
+    The indices of the best box of each group, by decreasing score, and the
+    (M, 4) fused box of each group, in the same order.
+  """
+  leaders = cluster_boxes(boxes, scores, labels, threshold, metric)
+  coordinate_weights = np.repeat(scores[:, None], 4, axis=1)
+  if truncated is not None:
+    # Still a small weight, for objects that no tile saw whole.
+    coordinate_weights[truncated] *= 1e-3
+  weighted_sums = np.zeros((len(boxes), 4), np.float64)
+  weights = np.zeros((len(boxes), 4), np.float64)
+  np.add.at(weighted_sums, leaders, boxes * coordinate_weights)
+  np.add.at(weights, leaders, coordinate_weights)
+  kept = np.flatnonzero(leaders == np.arange(len(leaders)))
+  kept = kept[np.argsort(-scores[kept], kind='stable')]
+  fused = weighted_sums[kept] / np.maximum(weights[kept], 1e-9)
+  return kept, fused
+
+
+class TiledDetector(object):
+  """Runs a pool of detectors on overlapping tiles of each frame.
+
+  A detector shrinks a whole frame to its small input, so objects of a few
+  dozen pixels in a 4K frame vanish. Each tile is sent to the detector
+  instead, at a much higher resolution, on as many detectors as there are
+  workers at once. The boxes are moved back to frame coordinates, and the
+  duplicates found by neighbouring tiles are merged with NMS or weighted
+  box fusion.
+
+  The time each tile took, the merge and the whole frame are recorded, so
+  the grid can be sized against a latency budget.
+  """
+
+  def __init__(self,
+               create_task: Callable[[], Any],
+               rows: int,
+               columns: int,
+               overlap: float = 0.2,
+               num_workers: int = 2,
+               merge: str = 'nms',
+               threshold: float = 0.5,
+               metric: str = 'ios') -> None:
+    """Creates the detectors.
+
+    Args:
+      create_task: Creates an object detector in IMAGE mode.
+      rows: Number of rows of tiles.
+      columns: Number of columns of tiles.
+      overlap: Fraction of a tile shared with its neighbours, so objects on
+        a tile edge are whole in at least one tile.
+      num_workers: Number of detectors, each running one tile at a time.
+      merge: `nms` to keep the best box of duplicates, or `wbf` to fuse
+        them.
+      threshold: Min overlap for two boxes of the same category to be
+        duplicates.
+      metric: The overlap metric, see `overlap_matrix()`.
+    """
+    if num_workers < 1:
+      raise ValueError('num_workers must be a positive integer.')
+    if merge not in MERGE_METHODS:
+      raise ValueError('merge must be one of {}.'.format(MERGE_METHODS))
+    self._rows = rows
+    self._columns = columns
+    self._overlap = overlap
+    self._merge = merge
+    self._threshold = threshold
+    self._metric = metric
+    self._tasks = [create_task() for _ in range(num_workers)]
+    self._idle_tasks = queue.Queue()
+    for task in self._tasks:
+      self._idle_tasks.put(task)
+    self._executor = concurrent.futures.ThreadPoolExecutor(num_workers)
+    self._lock = threading.Lock()
+    self._frame_size = None
+    self.tiles = []
+    self.tile_latency = []
+    self.merge_latency = LatencyHistogram()
+    self.frame_latency = LatencyHistogram()
+
+  def _update_grid(self, frame_width: int, frame_height: int) -> None:
+    if self._frame_size == (frame_width, frame_height):
+      return
+    self._frame_size = (frame_width, frame_height)
+    self.tiles = tile_grid(frame_width, frame_height, self._rows,
+                           self._columns, self._overlap)
+    with self._lock:
+      self.tile_latency = [LatencyHistogram() for _ in self.tiles]
+
+  def _detect_tile(self, image: np.ndarray,
+                   index: int) -> vision.ObjectDetectorResult:
+    start_time = time.perf_counter()
+    x0, y0, x1, y1 = self.tiles[index]
+    tile = mp.Image(image_format=mp.ImageFormat.SRGB,
+                    data=np.ascontiguousarray(image[y0:y1, x0:x1]))
+    task = self._idle_tasks.get()
+    try:
+      result = task.detect(tile)
+    finally:
+      self._idle_tasks.put(task)
+    for detection in result.detections:
+      detection.bounding_box.origin_x += x0
+      detection.bounding_box.origin_y += y0
+    with self._lock:
+      self.tile_latency[index].record(
+          (time.perf_counter() - start_time) * 1000)
+    return result
+
+  def detect(self, image: mp.Image) -> vision.ObjectDetectorResult:
+    """Detects objects in a frame, tile by tile.
+
+    Args:
+      image: The RGB frame.
+
+    Returns:
+      The merged detections of all tiles, in frame coordinates.
+    """
+    start_time = time.perf_counter()
+    pixels = image.numpy_view()
+    self._update_grid(image.width, image.height)
+    detections, tile_indices = [], []
+    for index, result in enumerate(self._executor.map(
+        lambda index: self._detect_tile(pixels, index),
+        range(len(self.tiles)))):
+      detections.extend(result.detections)
+      tile_indices.extend([index] * len(result.detections))
+
+    merge_start_time = time.perf_counter()
+    result = vision.ObjectDetectorResult(detections=detections)
+    if detections:
+      boxes, scores, names = detections_to_arrays(result)
+      if self._merge == 'wbf':
+        # The sides of a box on a tile edge that isn't a frame edge.
+        tiles = np.array(self.tiles, np.float32)[tile_indices]
+        inner_edges = tiles != np.array([0, 0, image.width, image.height])
+        truncated = inner_edges & (np.abs(boxes - tiles) <= _EDGE_MARGIN)
+        kept, fused = weighted_box_fusion(boxes, scores, names,
+                                          self._threshold, self._metric,
+                                          truncated)
+        for index, (x0, y0, x1, y1) in zip(kept, np.rint(fused).astype(int)):
+          bounding_box = detections[index].bounding_box
+          bounding_box.origin_x, bounding_box.origin_y = int(x0), int(y0)
+          bounding_box.width, bounding_box.height = int(x1 - x0), int(y1 - y0)
+      else:
+        kept = non_max_suppression(boxes, scores, names, self._threshold,
+                                   self._metric)
+      result.detections = [detections[index] for index in kept]
+
+    end_time = time.perf_counter()
+    with self._lock:
+      self.merge_latency.record((end_time - merge_start_time) * 1000)
+      self.frame_latency.record((end_time - start_time) * 1000)
+    return result
+
+  def summary(self) -> str:
+    """Returns a human readable table of the time spent per tile."""
+    with self._lock:
+      rows = [('tile {}'.format(i), '{}x{} at {},{}'.format(
+          x1 - x0, y1 - y0, x0, y0), histogram)
+              for i, ((x0, y0, x1, y1), histogram) in enumerate(
+                  zip(self.tiles, self.tile_latency))]
+      rows.append(('merge', '', self.merge_latency))
+      rows.append(('frame', '', self.frame_latency))
+      lines = ['{:<10}{:<22}{:>8}{:>10}{:>10}{:>10}'.format(
+          'stage', 'region', 'count', 'p50 ms', 'p95 ms', 'p99 ms')]
+      for name, region, histogram in rows:
+        lines.append('{:<10}{:<22}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            name, region, histogram.count, histogram.percentile(50),
+            histogram.percentile(95), histogram.percentile(99)))
+    return '\n'.join(lines)
+
+  def close(self) -> None:
+    """Waits for the running tiles and closes the detectors."""
+    self._executor.shutdown()
+    for task in self._tasks:
+      task.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
@@ -0,0 +1,260 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tracks detected boxes between detections with a constant velocity model."""
+
+import dataclasses
+import threading
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from mediapipe.tasks.python import vision
+
+
+@dataclasses.dataclass
+class Track:
+  """A tracked object.
+
+  Attributes:
+    track_id: Identifier of the object, stable while it is tracked.
+    box: The estimated `(x0, y0, x1, y1)` box in pixels.
+    category_name: Category of the object from its latest detection.
+    score: Score of the object in its latest detection.
+  """
+  track_id: int
+  box: Tuple[int, int, int, int]
+  category_name: str
+  score: float
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+  """Returns the intersection over union of every pair of boxes.
+
+  Args:
+    boxes_a: An (N, 4) array of `(x0, y0, x1, y1)` boxes.
+    boxes_b: An (M, 4) array of `(x0, y0, x1, y1)` boxes.
+
+  Returns:
+    An (N, M) array.
+  """
+  top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+  bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+  intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+  area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+  area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+  union = area_a[:, None] + area_b[None, :] - intersection
+  return intersection / np.maximum(union, 1e-9)
+
+
+def detections_to_arrays(
+    result: vision.ObjectDetectorResult
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+  """Returns the boxes, scores and category names of a detection result."""
+  boxes = np.array([[
+      d.bounding_box.origin_x, d.bounding_box.origin_y,
+      d.bounding_box.origin_x + d.bounding_box.width,
+      d.bounding_box.origin_y + d.bounding_box.height
+  ] for d in result.detections], np.float32).reshape(-1, 4)
+  scores = np.array([d.categories[0].score for d in result.detections],
+                    np.float32)
+  names = [d.categories[0].category_name for d in result.detections]
+  return boxes, scores, names
+
+
+class BoxTracker(object):
+  """Associates detections over time and predicts boxes in between.
+
+  Detections are matched to the tracks predicted at their timestamp by
+  greedy IoU association within each category. Every track follows a
+  constant velocity model corrected by an alpha-beta filter, so its box can
+  be predicted at any later timestamp without running the detector. A track
+  is dropped once it misses `max_misses` detections in a row.
+
+  All the track state is kept in NumPy arrays, so the cost of a prediction
+  doesn't depend on Python loops over the tracks. The methods are thread
+  safe, so detections can be added from a result callback while another
+  thread predicts.
+  """
+
+  def __init__(self,
+               iou_threshold: float = 0.3,
+               max_misses: int = 2,
+               alpha: float = 0.7,
+               beta: float = 0.3,
+               max_extrapolation_ms: int = 500) -> None:
+    """Initializes the tracker.
+
+    Args:
+      iou_threshold: Min IoU between a predicted track and a detection for
+        them to be matched.
+      max_misses: Number of detections in a row a track can be missing from
+        before it is dropped.
+      alpha: Weight of a detection against the prediction in the corrected
+        box.
+      beta: Weight of a detection in the corrected velocity.
+      max_extrapolation_ms: Max time a box is moved along its velocity after
+        its latest detection, so a stale track doesn't fly off.
+    """
+    self._iou_threshold = iou_threshold
+    self._max_misses = max_misses
+    self._alpha = alpha
+    self._beta = beta
+    self._max_extrapolation_ms = max_extrapolation_ms
+    self._lock = threading.Lock()
+    self._next_id = 0
+    self._ids = np.zeros(0, np.int64)
+    self._boxes = np.zeros((0, 4), np.float32)
+    # Pixels per millisecond for each box coordinate.
+    self._velocities = np.zeros((0, 4), np.float32)
+    self._timestamps = np.zeros(0, np.int64)
+    self._scores = np.zeros(0, np.float32)
+    self._misses = np.zeros(0, np.int64)
+    self._names = np.zeros(0, object)
+
+  def _boxes_at(self, timestamp_ms: int) -> np.ndarray:
+    elapsed_ms = np.clip(timestamp_ms - self._timestamps, 0,
+                         self._max_extrapolation_ms)
+    return self._boxes + self._velocities * elapsed_ms[:, None]
+
+  def update(self, timestamp_ms: int, boxes: np.ndarray, scores: np.ndarray,
+             names: Sequence[str]) -> float:
+    """Adds the detections of a frame.
+
+    Args:
+      timestamp_ms: Timestamp of the frame the detections come from.
+      boxes: An (N, 4) array of `(x0, y0, x1, y1)` boxes.
+      scores: The score of each detection.
+      names: The category name of each detection.
+
+    Returns:
+      How well the tracks predicted the detections, from 0 to 1: the mean
+      IoU of the matched pairs, counting unmatched tracks and detections as
+      0.
+    """
+    names = np.array(names, object)
+    with self._lock:
+      predicted = self._boxes_at(timestamp_ms)
+      ious = iou_matrix(predicted, boxes)
+      ious[self._names[:, None] != names[None, :]] = 0
+
+      # Greedy association, best overlapping pairs first.
+      track_indices, detection_indices = np.nonzero(
+          ious >= self._iou_threshold)
+      order = np.argsort(-ious[track_indices, detection_indices],
+                         kind='stable')
+      matched_tracks, matched_detections = [], []
+      used_tracks, used_detections = set(), set()
+      for t, d in zip(track_indices[order], detection_indices[order]):
+        if t not in used_tracks and d not in used_detections:
+          used_tracks.add(t)
+          used_detections.add(d)
+          matched_tracks.append(t)
+          matched_detections.append(d)
+      matched_tracks = np.array(matched_tracks, np.int64)
+      matched_detections = np.array(matched_detections, np.int64)
+
+      # Correct the matched tracks with their detection.
+      elapsed_ms = np.maximum(
+          timestamp_ms - self._timestamps[matched_tracks], 1)
+      residuals = boxes[matched_detections] - predicted[matched_tracks]
+      self._boxes[matched_tracks] = (predicted[matched_tracks] +
+                                     self._alpha * residuals)
+      self._velocities[matched_tracks] += (
+          self._beta * residuals / elapsed_ms[:, None])
+      self._timestamps[matched_tracks] = timestamp_ms
+      self._scores[matched_tracks] = scores[matched_detections]
+      self._misses += 1
+      self._misses[matched_tracks] = 0
+
+      keep = self._misses <= self._max_misses
+      new = np.ones(len(boxes), bool)
+      new[matched_detections] = False
+      num_new = int(np.count_nonzero(new))
+
+      self._ids = np.concatenate(
+          (self._ids[keep],
+           np.arange(self._next_id, self._next_id + num_new)))
+      self._next_id += num_new
+      self._boxes = np.concatenate((self._boxes[keep], boxes[new]))
+      self._velocities = np.concatenate(
+          (self._velocities[keep], np.zeros((num_new, 4), np.float32)))
+      self._timestamps = np.concatenate(
+          (self._timestamps[keep], np.full(num_new, timestamp_ms, np.int64)))
+      self._scores = np.concatenate((self._scores[keep], scores[new]))
+      self._misses = np.concatenate(
+          (self._misses[keep], np.zeros(num_new, np.int64)))
+      self._names = np.concatenate((self._names[keep], names[new]))
+
+      num_pairs = len(predicted) + num_new
+      if not num_pairs:
+        return 1.0
+      return float(ious[matched_tracks, matched_detections].sum() / num_pairs)
+
+  def predict(self, timestamp_ms: int) -> List[Track]:
+    """Returns the tracks with their boxes moved to the given timestamp."""
+    with self._lock:
+      boxes = np.rint(self._boxes_at(timestamp_ms)).astype(int)
+      return [
+          Track(int(track_id), tuple(box), name, float(score))
+          for track_id, box, name, score in zip(
+              self._ids, boxes.tolist(), self._names, self._scores)
+      ]
+
+
+class DetectionSchedule(object):
+  """Decides which frames to run the detector on.
+
+  The detector runs every `interval` frames. The interval doubles, up to
+  `max_interval`, each time the tracks predicted a detection well, and
+  falls back to every frame as soon as they didn't, e.g. when objects
+  appear, disappear or change direction.
+
+  Attributes:
+    interval: Current number of frames between two detections.
+    frames: Number of frames seen.
+    detections: Number of frames submitted to the detector.
+  """
+
+  def __init__(self, max_interval: int, min_quality: float = 0.5) -> None:
+    """Initializes the schedule.
+
+    Args:
+      max_interval: Max number of frames between two detections.
+      min_quality: Min prediction quality, as returned by
+        `BoxTracker.update()`, for the interval to grow.
+    """
+    self._max_interval = max_interval
+    self._min_quality = min_quality
+    self.interval = 1
+    self.frames = 0
+    self.detections = 0
+    self._frames_since_detection = 0
+
+  def is_due(self) -> bool:
+    """Returns whether the detector should run on the current frame."""
+    self.frames += 1
+    self._frames_since_detection += 1
+    return self._frames_since_detection >= self.interval
+
+  def detected(self) -> None:
+    """Marks the current frame as submitted to the detector."""
+    self.detections += 1
+    self._frames_since_detection = 0
+
+  def record_quality(self, quality: float) -> None:
+    """Adapts the interval to how well the tracks predicted a detection."""
+    if quality >= self._min_quality:
+      self.interval = min(self.interval * 2, self._max_interval)
+    else:
+      self.interval = 1
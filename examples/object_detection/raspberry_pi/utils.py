@@ -53,3 +53,52 @@ def visualize(
                 FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
 
   return image
+
+
+def visualize_tracks(image, tracks) -> np.ndarray:
+  """Draws the box, category, id and score of each track on the image.
+
+  Args:
+    image: The input RGB image.
+    tracks: The `tracker.Track` objects to be visualized.
+  Returns:
+    Image with bounding boxes.
+  """
+  for track in tracks:
+    x0, y0, x1, y1 = track.box
+    cv2.rectangle(image, (x0, y0), (x1, y1), (0, 165, 255), 3)
+    result_text = '{} #{} ({})'.format(track.category_name, track.track_id,
+                                       round(track.score, 2))
+    text_location = (MARGIN + x0, MARGIN + ROW_SIZE + y0)
+    cv2.putText(image, result_text, text_location, cv2.FONT_HERSHEY_DUPLEX,
+                FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+
+  return image
+
+
+def remap_detections(detection_result, transform):
+  """Maps the boxes and keypoints of a result back to the camera frame.
+
+  Args:
+    detection_result: A result of a model input letterboxed by
+      `pipeline.InputScaler`. It is modified in place.
+    transform: The `pipeline.LetterboxTransform` of the model input.
+  Returns:
+    The result, in camera frame coordinates.
+  """
+  for detection in detection_result.detections:
+    bbox = detection.bounding_box
+    x0, y0 = transform.to_frame(bbox.origin_x, bbox.origin_y)
+    x1, y1 = transform.to_frame(bbox.origin_x + bbox.width,
+                                bbox.origin_y + bbox.height)
+    bbox.origin_x, bbox.origin_y = round(x0), round(y0)
+    bbox.width, bbox.height = round(x1 - x0), round(y1 - y0)
+
+    # Keypoints are normalized to the size of the image.
+    for keypoint in detection.keypoints or []:
+      x, y = transform.to_frame(keypoint.x * transform.width,
+                                keypoint.y * transform.height)
+      keypoint.x = x / transform.frame_width
+      keypoint.y = y / transform.frame_height
+
+  return detection_result
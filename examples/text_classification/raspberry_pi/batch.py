@@ -0,0 +1,215 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Classifies streams of text with long-lived classifiers."""
+
+import contextlib
+import itertools
+import json
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from typing import (Any, Callable, Dict, IO, Iterable, Iterator, List,
+                    Optional, Tuple)
+
+from mediapipe.tasks.python import text
+
+from cache import ResultCache
+
+# Number of records handed to each worker at once. Larger chunks amortize the
+# cost of sending them to the worker processes.
+CHUNK_SIZE = 64
+
+# The classifier and result cache of the current process, created once by
+# `_init_worker()`.
+_classifier = None
+_cache = None
+
+
+def categories_to_list(
+    result: text.TextClassifierResult) -> List[Dict[str, Any]]:
+  """Returns the categories of a result as JSON serializable dicts."""
+  return [{
+      'index': category.index,
+      'category_name': category.category_name,
+      'score': category.score,
+  } for category in result.classifications[0].categories]
+
+
+def parse_record(line: str) -> Dict[str, Any]:
+  """Parses an input line into a record holding the text to classify.
+
+  Lines starting with `{` are read as JSON objects with a `text` field, whose
+  other fields are passed through to the output. Any other line is the text
+  itself.
+  """
+  line = line.rstrip('\r\n')
+  if not line.lstrip().startswith('{'):
+    return {'text': line}
+  try:
+    record = json.loads(line)
+  except ValueError as e:
+    return {'text': None, 'error': 'Invalid JSON: {}'.format(e)}
+  if not isinstance(record, dict) or not isinstance(record.get('text'), str):
+    return {'text': None, 'error': 'Missing "text" field.'}
+  return record
+
+
+def _init_worker(
+    create_classifier: Callable[[], text.TextClassifier],
+    create_cache: Optional[Callable[[], ResultCache]] = None) -> None:
+  global _classifier, _cache
+  _classifier = create_classifier()
+  _cache = create_cache() if create_cache else None
+
+
+def _classify(input_text: str) -> List[Dict[str, Any]]:
+  return categories_to_list(_classifier.classify(input_text))
+
+
+def _classify_records(
+    records: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+  """Classifies records in place and returns them with the cache hit count."""
+  cache_hits = _cache.hits if _cache else 0
+  for record in records:
+    if 'error' in record:
+      continue
+    record['categories'] = (_cache.get_or_compute(record['text'], _classify)
+                            if _cache else _classify(record['text']))
+  return records, (_cache.hits - cache_hits if _cache else 0)
+
+
+def _read_lines(input_paths: Iterable[str]) -> Iterator[str]:
+  for input_path in input_paths:
+    if input_path == '-':
+      yield from sys.stdin
+      continue
+    with open(input_path) as input_file:
+      yield from input_file
+
+
+def _chunks(lines: Iterator[str],
+            size: int) -> Iterator[List[Dict[str, Any]]]:
+  while True:
+    chunk_lines = list(itertools.islice(lines, size))
+    if not chunk_lines:
+      return
+    chunk = [parse_record(line) for line in chunk_lines if line.strip()]
+    if chunk:
+      yield chunk
+
+
+@contextlib.contextmanager
+def _open_output(output_path: str) -> Iterator[IO[str]]:
+  if output_path == '-':
+    yield sys.stdout
+  else:
+    with open(output_path, 'w') as output:
+      yield output
+
+
+def run_batch(input_paths: List[str], output_path: str,
+              create_classifier: Callable[[], text.TextClassifier],
+              num_workers: int = 1,
+              max_pending_chunks: Optional[int] = None,
+              create_cache: Optional[Callable[[], ResultCache]] = None) -> None:
+  """Classifies every line of the inputs and writes one JSON line per result.
+
+  The input is read as a stream, so it can be piped in and be arbitrarily
+  long. Results are written in input order, each chunk as soon as it is
+  classified, while the next chunks are read.
+
+  Args:
+    input_paths: Paths of the files to read, `-` for stdin.
+    output_path: Path of the JSON Lines file to write, `-` for stdout.
+    create_classifier: Creates a classifier. It must be picklable, e.g. a
+      module level function, when `num_workers` is above 1.
+    num_workers: Number of processes classifying in parallel, each with its
+      own classifier.
+    max_pending_chunks: Max number of chunks read ahead of the output, which
+      bounds memory use. Defaults to 4 per worker.
+    create_cache: Creates the cache of results, or None to classify every
+      text. Each worker creates its own, so it must be picklable when
+      `num_workers` is above 1.
+  """
+  max_pending_chunks = max_pending_chunks or 4 * num_workers
+  start_time = time.time()
+  record_count = 0
+  cache_hits = 0
+  chunks = _chunks(_read_lines(input_paths), CHUNK_SIZE)
+
+  with contextlib.ExitStack() as stack:
+    output = stack.enter_context(_open_output(output_path))
+    if num_workers > 1:
+      pool = stack.enter_context(
+          multiprocessing.Pool(num_workers, _init_worker,
+                               (create_classifier, create_cache)))
+      submit = lambda chunk: pool.apply_async(_classify_records, (chunk,))
+      resolve = lambda pending_result: pending_result.get()
+    else:
+      _init_worker(create_classifier, create_cache)
+      stack.callback(_classifier.close)
+      if _cache:
+        stack.callback(_cache.close)
+      submit = lambda chunk: chunk
+      resolve = _classify_records
+
+    # Results are written from their own thread, in input order, so a chunk
+    # is written as soon as it is classified even while reading the next
+    # ones blocks, e.g. on a slow pipe. The bounded queue stops reading once
+    # `max_pending_chunks` chunks wait for their results.
+    pending = queue.Queue(max_pending_chunks)
+    errors = []
+
+    def write_results() -> None:
+      nonlocal record_count, cache_hits
+      while True:
+        item = pending.get()
+        if item is None:
+          return
+        if errors:
+          # Keep draining, so the reader never blocks on a full queue.
+          continue
+        try:
+          records, chunk_cache_hits = resolve(item)
+          for record in records:
+            output.write(json.dumps(record) + '\n')
+          output.flush()
+        except Exception as e:  # pylint: disable=broad-except
+          errors.append(e)
+          continue
+        record_count += len(records)
+        cache_hits += chunk_cache_hits
+
+    writer = threading.Thread(target=write_results)
+    writer.start()
+    try:
+      for chunk in chunks:
+        if errors:
+          break
+        pending.put(submit(chunk))
+    finally:
+      pending.put(None)
+      writer.join()
+    if errors:
+      raise errors[0]
+
+  elapsed_time = time.time() - start_time
+  print('Classified {} texts in {:.1f} s ({:.1f} per second)'.format(
+      record_count, elapsed_time,
+      record_count / elapsed_time if elapsed_time else 0), file=sys.stderr)
+  if create_cache:
+    print('{} of them were found in the cache.'.format(cache_hits),
+          file=sys.stderr)
@@ -0,0 +1,221 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A cache of classification results keyed by the hash of the input text."""
+
+import collections
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Size of the blocks a model file is hashed in, in bytes.
+_HASH_BLOCK_SIZE = 1 << 20
+# Number of results written to the file between two prunings of its oldest
+# and expired rows. Counting the rows is a full scan, so it isn't done on
+# every write.
+_PRUNE_INTERVAL = 1000
+
+
+def hash_file(path: str) -> str:
+  """Returns the SHA-256 hex digest of a file's content."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def hash_text(input_text: str) -> str:
+  """Returns the SHA-256 hex digest of a text encoded as UTF-8."""
+  return hashlib.sha256(input_text.encode('utf-8')).hexdigest()
+
+
+class ResultCache(object):
+  """Caches JSON serializable results, e.g. lists of categories, per text.
+
+  Results are kept in memory in least recently used order, and optionally
+  in an SQLite file that survives restarts and can be shared by several
+  processes. Rows in the file are scoped to the hash of the model file, so
+  swapping the model invalidates them, and the rows of other models are
+  deleted when the file is opened. All methods are thread safe.
+
+  Attributes:
+    hits: Number of lookups answered by the cache, from memory or from file.
+    file_hits: Number of lookups answered from the file.
+    misses: Number of lookups the cache had no result for.
+  """
+
+  def __init__(self,
+               max_size: int = 10000,
+               ttl_s: Optional[float] = None,
+               model_path: Optional[str] = None,
+               db_path: Optional[str] = None,
+               max_file_size: Optional[int] = None) -> None:
+    """Initializes the cache.
+
+    Args:
+      max_size: Max number of results kept in memory, which can be 0 when
+        `db_path` is set. The least recently used result is evicted first.
+      ttl_s: Time in seconds after which a result expires, or None to keep
+        results until they are evicted.
+      model_path: Path of the model the results come from. Required with
+        `db_path`.
+      db_path: Path of the SQLite file to persist the results to, or None to
+        only keep them in memory.
+      max_file_size: Max number of results kept in the file, or None for no
+        limit. The oldest results are deleted first, once every thousand
+        writes, so the file can briefly hold up to a thousand more.
+    """
+    if max_size < 0:
+      raise ValueError('max_size must not be negative.')
+    if max_file_size is not None and max_file_size < 1:
+      raise ValueError('max_file_size must be a positive integer.')
+    self._max_size = max_size
+    self._ttl = ttl_s
+    self._max_file_size = max_file_size
+    self._writes_since_prune = 0
+    self._lock = threading.Lock()
+    # Maps the hash of each text to its expiry time and result.
+    self._entries = collections.OrderedDict()
+    self.hits = 0
+    self.file_hits = 0
+    self.misses = 0
+
+    self._db = None
+    if db_path:
+      if not model_path:
+        raise ValueError('model_path is required to persist the cache.')
+      self._model_hash = hash_file(model_path)
+      self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+      # The write ahead log lets several processes read while one writes,
+      # and with it a commit doesn't need to wait for the disk.
+      self._db.execute('PRAGMA journal_mode=WAL')
+      self._db.execute('PRAGMA synchronous=NORMAL')
+      self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                       'model_hash TEXT NOT NULL, text_hash TEXT NOT NULL, '
+                       'result TEXT NOT NULL, created REAL NOT NULL, '
+                       'PRIMARY KEY (model_hash, text_hash))')
+      self._db.execute('CREATE INDEX IF NOT EXISTS results_created '
+                       'ON results (created)')
+      # Results of other models can never be hit again.
+      self._db.execute('DELETE FROM results WHERE model_hash != ?',
+                       (self._model_hash,))
+      self._prune()
+
+  def get(self, input_text: str) -> Optional[Any]:
+    """Returns the cached result of a text, or None if there is none."""
+    key = hash_text(input_text)
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        expiry_time, result = entry
+        if expiry_time is None or expiry_time > now:
+          self._entries.move_to_end(key)
+          self.hits += 1
+          return result
+        del self._entries[key]
+
+      row = self._get_from_file(key)
+      if row is None:
+        self.misses += 1
+        return None
+      result, age_s = row
+      self.hits += 1
+      self.file_hits += 1
+      # Keep the result in memory for the rest of its lifetime only.
+      self._put_in_memory(key, result, now - age_s)
+      return result
+
+  def put(self, input_text: str, result: Any) -> None:
+    """Caches the result of a text."""
+    key = hash_text(input_text)
+    with self._lock:
+      self._put_in_memory(key, result, time.monotonic())
+      if self._db is not None:
+        self._db.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+            (self._model_hash, key, json.dumps(result), time.time()))
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= _PRUNE_INTERVAL:
+          self._prune()
+        else:
+          self._db.commit()
+
+  def get_or_compute(self, input_text: str,
+                     compute_fn: Callable[[str], Any]) -> Any:
+    """Returns the cached result of a text, computing and caching it if needed.
+    """
+    result = self.get(input_text)
+    if result is None:
+      result = compute_fn(input_text)
+      self.put(input_text, result)
+    return result
+
+  def stats(self) -> Dict[str, Any]:
+    """Returns the hit and miss counts and the hit rate."""
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+          'hits': self.hits,
+          'file_hits': self.file_hits,
+          'misses': self.misses,
+          'hit_rate': self.hits / lookups if lookups else 0.0,
+          'size': len(self._entries),
+      }
+
+  def close(self) -> None:
+    """Closes the cache file, if any."""
+    with self._lock:
+      if self._db is not None:
+        self._db.close()
+        self._db = None
+
+  def _put_in_memory(self, key: str, result: Any,
+                     created_time: float) -> None:
+    self._entries[key] = (created_time + self._ttl if self._ttl else None,
+                          result)
+    self._entries.move_to_end(key)
+    while len(self._entries) > self._max_size:
+      self._entries.popitem(last=False)
+
+  def _prune(self) -> None:
+    """Deletes the expired results and the oldest ones over the limit."""
+    if self._ttl:
+      self._db.execute('DELETE FROM results WHERE created < ?',
+                       (time.time() - self._ttl,))
+    if self._max_file_size:
+      self._db.execute(
+          'DELETE FROM results WHERE rowid IN (SELECT rowid FROM results '
+          'ORDER BY created DESC LIMIT -1 OFFSET ?)', (self._max_file_size,))
+    self._db.commit()
+    self._writes_since_prune = 0
+
+  def _get_from_file(self, key: str) -> Optional[Tuple[Any, float]]:
+    """Returns the result of a text from the file and its age in seconds."""
+    if self._db is None:
+      return None
+    row = self._db.execute(
+        'SELECT result, created FROM results '
+        'WHERE model_hash = ? AND text_hash = ?',
+        (self._model_hash, key)).fetchone()
+    if row is None:
+      return None
+    result, created = row
+    age_s = max(time.time() - created, 0)
+    if self._ttl and age_s >= self._ttl:
+      return None
+    return json.loads(result), age_s
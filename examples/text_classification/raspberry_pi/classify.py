@@ -14,29 +14,93 @@
 """Main scripts to run text classification."""
 
 import argparse
+import functools
+from typing import Callable, List, Optional
 
 from mediapipe.tasks import python
 from mediapipe.tasks.python import text
 
+from batch import categories_to_list
+from batch import run_batch
+from cache import ResultCache
 
-def run(model: str, input_text: str) -> None:
-  """Classify input text using a Text Classifier TFLite model.
+
+def create_classifier(model: str) -> text.TextClassifier:
+  """Creates a text classifier.
 
   Args:
     model: Name of the TFLite text classifier model.
-    input_text: The input text to be classified.
   """
-  # Initialize the text classifier model.
   base_options = python.BaseOptions(model_asset_path=model)
   options = text.TextClassifierOptions(base_options=base_options)
-  classifier = text.TextClassifier.create_from_options(options)
+  return text.TextClassifier.create_from_options(options)
+
+
+def cache_factory(model: str, cache_size: int, cache_ttl: float,
+                  cache_file: Optional[str], cache_file_size: int
+                 ) -> Optional[Callable[[], ResultCache]]:
+  """Returns a function creating the cache of results, or None to not cache.
+
+  Args:
+    model: Name of the TFLite text classifier model the results come from.
+    cache_size: Max number of results kept in memory.
+    cache_ttl: Time in seconds after which a result expires, or 0 to keep
+      results until they are evicted.
+    cache_file: Path of the SQLite file to persist the results to, or None.
+    cache_file_size: Max number of results kept in `cache_file`, or 0 for no
+      limit.
+  """
+  if not cache_size and not cache_file:
+    return None
+  return functools.partial(ResultCache, cache_size, cache_ttl or None, model,
+                           cache_file, cache_file_size or None)
+
+
+def run(model: str, input_text: str, input_paths: List[str], output_path: str,
+        num_workers: int, cache_size: int, cache_ttl: float,
+        cache_file: Optional[str], cache_file_size: int) -> None:
+  """Classify input text using a Text Classifier TFLite model.
+
+  Args:
+    model: Name of the TFLite text classifier model.
+    input_text: The input text to be classified.
+    input_paths: Paths of files to classify line by line instead of
+      `input_text`, `-` for stdin.
+    output_path: Path of the JSON Lines file the results of `input_paths` are
+      written to, `-` for stdout.
+    num_workers: Number of processes classifying `input_paths` in parallel.
+    cache_size: Max number of results cached in memory, 0 to not cache them
+      in memory.
+    cache_ttl: Time in seconds after which a cached result expires, or 0 to
+      never expire them.
+    cache_file: Path of the SQLite file cached results persist in, or None.
+    cache_file_size: Max number of results kept in `cache_file`, or 0 for no
+      limit.
+  """
+  create_cache = cache_factory(model, cache_size, cache_ttl, cache_file,
+                               cache_file_size)
+  if input_paths:
+    run_batch(input_paths, output_path,
+              functools.partial(create_classifier, model), num_workers,
+              create_cache=create_cache)
+    return
+
+  def classify(input_text):
+    # Initialize the text classifier model and classify the input text.
+    with create_classifier(model) as classifier:
+      return categories_to_list(classifier.classify(input_text))
 
-  # Classify the input text.
-  classification_result = classifier.classify(input_text)
+  # The model is only loaded if the result isn't cached yet.
+  if create_cache:
+    cache = create_cache()
+    categories = cache.get_or_compute(input_text, classify)
+    cache.close()
+  else:
+    categories = classify(input_text)
 
   # Process the classification result. In this case, print out the most likely category.
-  top_category = classification_result.classifications[0].categories[0]
-  print(f'{top_category.category_name} ({top_category.score:.2f})')
+  top_category = categories[0]
+  print(f"{top_category['category_name']} ({top_category['score']:.2f})")
                                          
 
 def main():
@@ -47,13 +111,61 @@ def main():
       help='Name of text classifier model.',
       required=False,
       default='classifier.tflite')
-  parser.add_argument(
+  input_group = parser.add_mutually_exclusive_group(required=True)
+  input_group.add_argument(
       '--inputText',
-      help='Enter the text to classify.',
-      required=True)
+      help='Enter the text to classify.')
+  input_group.add_argument(
+      '--inputFile',
+      help='Path of a file to classify line by line, or - to read from stdin. '
+           'Lines can be plain text or JSON objects with a "text" field. Can '
+           'be repeated.',
+      action='append')
+  parser.add_argument(
+      '--output',
+      help='Path of the JSON Lines file to write the results of --inputFile '
+           'to, or - to write to stdout.',
+      required=False,
+      default='-')
+  parser.add_argument(
+      '--numWorkers',
+      help='Number of processes classifying --inputFile in parallel, each with '
+           'its own model instance.',
+      required=False,
+      type=int,
+      default=1)
+  parser.add_argument(
+      '--cacheSize',
+      help='Max number of classification results cached in memory. Set to 0 '
+           'to not cache results in memory.',
+      required=False,
+      type=int,
+      default=0)
+  parser.add_argument(
+      '--cacheTtl',
+      help='Time in seconds after which a cached result expires. Set to 0 to '
+           'never expire results.',
+      required=False,
+      type=float,
+      default=0)
+  parser.add_argument(
+      '--cacheFile',
+      help='Path of an SQLite file to persist cached results to across runs. '
+           'Results are only reused with the same model file.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--cacheFileSize',
+      help='Max number of results kept in --cacheFile, deleting the oldest '
+           'first. Set to 0 to never delete results.',
+      required=False,
+      type=int,
+      default=100000)
   args = parser.parse_args()
 
-  run(args.model, args.inputText)
+  run(args.model, args.inputText, args.inputFile, args.output,
+      args.numWorkers, args.cacheSize, args.cacheTtl, args.cacheFile,
+      args.cacheFileSize)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,384 @@
+# Copyright 2023 The MediaPipe Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A local HTTP server classifying text with a pool of warm models."""
+
+import argparse
+import concurrent.futures
+import functools
+import http.server
+import json
+import math
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from mediapipe.tasks.python import text
+
+from batch import categories_to_list
+from cache import ResultCache
+from classify import cache_factory
+from classify import create_classifier
+
+# Max size of a request body, in bytes.
+_MAX_BODY_SIZE = 1 << 20
+
+
+class MicroBatcher(object):
+  """Shares concurrent classification requests between pooled classifiers.
+
+  Each classifier is driven by its own worker thread. A free worker takes
+  the oldest waiting text, along with the texts already queued behind it, up
+  to its share of the queue among all classifiers and at most
+  `max_batch_size`. A classifier processes texts one at a time, so a batch
+  saves thread handoffs under load, but never waits for texts to arrive,
+  and never holds texts an idle classifier could take. Texts found in the
+  optional cache skip the queue.
+
+  Results are lists of categories, as returned by `categories_to_list()`.
+
+  Attributes:
+    requests: Number of texts classified by the models.
+    batches: Number of batches classified.
+  """
+
+  def __init__(self,
+               create_classifier: Callable[[], text.TextClassifier],
+               num_classifiers: int = 1,
+               max_batch_size: int = 32,
+               cache: Optional[ResultCache] = None) -> None:
+    """Initializes the batcher and loads its classifiers.
+
+    Args:
+      create_classifier: Creates a classifier.
+      num_classifiers: Number of classifiers running in parallel.
+      max_batch_size: Max number of texts a worker takes at once.
+      cache: Caches the results, or None to classify every text.
+    """
+    if num_classifiers < 1 or max_batch_size < 1:
+      raise ValueError(
+          'num_classifiers and max_batch_size must be positive integers.')
+    self._max_batch_size = max_batch_size
+    self._num_classifiers = num_classifiers
+    self.cache = cache
+    self._queue = queue.Queue()
+    self._lock = threading.Lock()
+    self._closed = False
+    self.requests = 0
+    self.batches = 0
+    # Create the classifiers up front, so the first requests don't pay for
+    # loading the model.
+    classifiers = [create_classifier() for _ in range(num_classifiers)]
+    self._threads = [
+        threading.Thread(target=self._work, args=(classifier,), daemon=True)
+        for classifier in classifiers
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def submit(self, input_text: str) -> concurrent.futures.Future:
+    """Queues a text and returns a future of its classification result."""
+    future = concurrent.futures.Future()
+    if self.cache is not None:
+      categories = self.cache.get(input_text)
+      if categories is not None:
+        future.set_result(categories)
+        return future
+    with self._lock:
+      if self._closed:
+        raise RuntimeError('The batcher is closed.')
+      self._queue.put((input_text, future))
+    return future
+
+  def classify(self, texts: List[str],
+               timeout: Optional[float] = None) -> List[List[Dict[str, Any]]]:
+    """Classifies texts, possibly along with other callers' texts.
+
+    Args:
+      texts: The texts to classify.
+      timeout: Max time to wait for the results in seconds.
+
+    Returns:
+      The categories of each text.
+    """
+    futures = [self.submit(input_text) for input_text in texts]
+    return [future.result(timeout) for future in futures]
+
+  def close(self) -> None:
+    """Classifies the queued texts, then stops the workers and the cache."""
+    with self._lock:
+      if self._closed:
+        return
+      self._closed = True
+      for _ in self._threads:
+        self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+    if self.cache is not None:
+      self.cache.close()
+
+  def _next_batch(self) -> Optional[list]:
+    item = self._queue.get()
+    if item is None:
+      return None
+    batch = [item]
+    # Only take this worker's share of the texts already queued, so the
+    # other classifiers get the rest.
+    batch_size = min(
+        self._max_batch_size,
+        math.ceil((self._queue.qsize() + 1) / self._num_classifiers))
+    while len(batch) < batch_size:
+      try:
+        item = self._queue.get_nowait()
+      except queue.Empty:
+        break
+      if item is None:
+        # Leave the stop signal for the next call, once this batch is done.
+        self._queue.put(None)
+        break
+      batch.append(item)
+    return batch
+
+  def _work(self, classifier: text.TextClassifier) -> None:
+    with classifier:
+      while True:
+        batch = self._next_batch()
+        if batch is None:
+          return
+        for input_text, future in batch:
+          if not future.set_running_or_notify_cancel():
+            continue
+          try:
+            categories = categories_to_list(classifier.classify(input_text))
+          except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+            continue
+          if self.cache is not None:
+            self.cache.put(input_text, categories)
+          future.set_result(categories)
+        with self._lock:
+          self.requests += len(batch)
+          self.batches += 1
+
+
+class ClassificationHandler(http.server.BaseHTTPRequestHandler):
+  """Serves `POST /classify` and `GET /stats`.
+
+  A classification request is a JSON object with either a `text` string or a
+  `texts` list, and an optional `top_k` limiting the categories returned per
+  text.
+  """
+
+  # Set by `run()`.
+  batcher = None
+  default_top_k = None
+  # Max time to wait for the results of a request, in seconds.
+  request_timeout = 30
+
+  def do_GET(self) -> None:  # pylint: disable=invalid-name
+    if self.path != '/stats':
+      self._send_json(404, {'error': 'Not found.'})
+      return
+    batcher = self.batcher
+    stats = {
+        'requests': batcher.requests,
+        'batches': batcher.batches,
+        'mean_batch_size':
+            batcher.requests / batcher.batches if batcher.batches else 0,
+    }
+    if batcher.cache is not None:
+      stats['cache'] = batcher.cache.stats()
+    self._send_json(200, stats)
+
+  def do_POST(self) -> None:  # pylint: disable=invalid-name
+    if self.path != '/classify':
+      self._send_json(404, {'error': 'Not found.'})
+      return
+    try:
+      texts, top_k, single = self._parse_request()
+    except ValueError as e:
+      self._send_json(400, {'error': str(e)})
+      return
+    try:
+      results = self.batcher.classify(texts, self.request_timeout)
+    except concurrent.futures.TimeoutError:
+      self._send_json(503, {'error': 'Timed out waiting for a classifier.'})
+      return
+    except Exception as e:  # pylint: disable=broad-except
+      self._send_json(500, {'error': str(e)})
+      return
+    outputs = [{'categories': categories[:top_k]} for categories in results]
+    self._send_json(200, outputs[0] if single else {'results': outputs})
+
+  def _parse_request(self) -> tuple:
+    try:
+      length = int(self.headers['Content-Length'])
+    except (TypeError, ValueError):
+      raise ValueError('A valid Content-Length header is required.') from None
+    if length < 0:
+      raise ValueError('A valid Content-Length header is required.')
+    if length > _MAX_BODY_SIZE:
+      raise ValueError('Request body too large.')
+    try:
+      request = json.loads(self.rfile.read(length))
+    except ValueError:
+      raise ValueError('The request body must be a JSON object.') from None
+    if not isinstance(request, dict):
+      raise ValueError('The request body must be a JSON object.')
+
+    single = 'text' in request
+    texts = [request['text']] if single else request.get('texts')
+    if (not isinstance(texts, list) or not texts or
+        not all(isinstance(input_text, str) for input_text in texts)):
+      raise ValueError('Expected a "text" string or a "texts" list of strings.')
+    top_k = request.get('top_k', self.default_top_k)
+    if top_k is not None and (not isinstance(top_k, int) or
+                              isinstance(top_k, bool) or top_k < 1):
+      raise ValueError('"top_k" must be a positive integer.')
+    return texts, top_k, single
+
+  def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+    content = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+    # Logging every request to stderr would slow the server down under load.
+    pass
+
+
+class ClassificationServer(http.server.ThreadingHTTPServer):
+  """A threaded HTTP server sized for many concurrent clients."""
+
+  daemon_threads = True
+  # The default backlog of 5 resets connections under concurrent load.
+  request_queue_size = 128
+
+
+def run(model: str, host: str, port: int, num_classifiers: int,
+        max_batch_size: int, top_k: Optional[int],
+        cache_size: int, cache_ttl: float, cache_file: Optional[str],
+        cache_file_size: int) -> None:
+  """Serves text classification over HTTP until interrupted.
+
+  Args:
+    model: Name of the TFLite text classifier model.
+    host: Address to listen on.
+    port: Port to listen on.
+    num_classifiers: Number of model instances classifying in parallel.
+    max_batch_size: Max number of texts a classifier takes at once.
+    top_k: Default number of categories returned per text, or None for all.
+    cache_size: Max number of results cached in memory, 0 to not cache them
+      in memory.
+    cache_ttl: Time in seconds after which a cached result expires, or 0 to
+      never expire them.
+    cache_file: Path of the SQLite file cached results persist in, or None.
+    cache_file_size: Max number of results kept in `cache_file`, or 0 for no
+      limit.
+  """
+  create_cache = cache_factory(model, cache_size, cache_ttl, cache_file,
+                               cache_file_size)
+  batcher = MicroBatcher(
+      functools.partial(create_classifier, model), num_classifiers,
+      max_batch_size, create_cache() if create_cache else None)
+  ClassificationHandler.batcher = batcher
+  ClassificationHandler.default_top_k = top_k
+  server = ClassificationServer((host, port), ClassificationHandler)
+  print('Serving on http://{}:{}/classify'.format(*server.server_address[:2]))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    batcher.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument(
+      '--model',
+      help='Name of text classifier model.',
+      required=False,
+      default='classifier.tflite')
+  parser.add_argument(
+      '--host',
+      help='Address to listen on. Keep the default to only accept local '
+           'connections.',
+      required=False,
+      default='127.0.0.1')
+  parser.add_argument(
+      '--port',
+      help='Port to listen on.',
+      required=False,
+      type=int,
+      default=8080)
+  parser.add_argument(
+      '--numClassifiers',
+      help='Number of model instances classifying in parallel.',
+      required=False,
+      type=int,
+      default=2)
+  parser.add_argument(
+      '--maxBatchSize',
+      help='Max number of queued texts a classifier takes at once.',
+      required=False,
+      type=int,
+      default=32)
+  parser.add_argument(
+      '--topK',
+      help='Default number of categories returned per text. Returns all if '
+           'not set.',
+      required=False,
+      type=int,
+      default=None)
+  parser.add_argument(
+      '--cacheSize',
+      help='Max number of classification results cached in memory. Set to 0 '
+           'to not cache results in memory.',
+      required=False,
+      type=int,
+      default=0)
+  parser.add_argument(
+      '--cacheTtl',
+      help='Time in seconds after which a cached result expires. Set to 0 to '
+           'never expire results.',
+      required=False,
+      type=float,
+      default=0)
+  parser.add_argument(
+      '--cacheFile',
+      help='Path of an SQLite file to persist cached results to across runs. '
+           'Results are only reused with the same model file.',
+      required=False,
+      default=None)
+  parser.add_argument(
+      '--cacheFileSize',
+      help='Max number of results kept in --cacheFile, deleting the oldest '
+           'first. Set to 0 to never delete results.',
+      required=False,
+      type=int,
+      default=100000)
+  args = parser.parse_args()
+
+  run(args.model, args.host, args.port, args.numClassifiers,
+      args.maxBatchSize, args.topK, args.cacheSize,
+      args.cacheTtl, args.cacheFile, args.cacheFileSize)
+
+
+if __name__ == '__main__':
+  main()
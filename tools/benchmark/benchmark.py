@@ -0,0 +1,454 @@
+"""Benchmarks the MediaPipe tasks used by the examples on a fixed input set.
+
+Each run replays the same inputs through a task without a camera, microphone
+or display, and reports throughput, latency percentiles, peak memory use and
+model initialization time as JSON. Two reports can then be compared to catch
+regressions after swapping a model or upgrading MediaPipe.
+"""
+
+import dataclasses
+import gc
+import hashlib
+import json
+import os
+import platform
+import resource
+import sys
+import time
+import wave
+from typing import Any, Dict, List, Optional
+
+from absl import app
+from absl import flags
+import cv2
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import audio
+from mediapipe.tasks.python import text
+from mediapipe.tasks.python import vision
+from mediapipe.tasks.python.components import containers
+import numpy as np
+
+
+@dataclasses.dataclass(frozen=True)
+class TaskSpec:
+  """How to create and call one of the benchmarked tasks."""
+  modality: str
+  task_class: Any
+  options_class: Any
+  method_name: str
+
+
+TASKS = {
+    "object_detector": TaskSpec("vision", vision.ObjectDetector,
+                                vision.ObjectDetectorOptions, "detect"),
+    "face_detector": TaskSpec("vision", vision.FaceDetector,
+                              vision.FaceDetectorOptions, "detect"),
+    "face_landmarker": TaskSpec("vision", vision.FaceLandmarker,
+                                vision.FaceLandmarkerOptions, "detect"),
+    "hand_landmarker": TaskSpec("vision", vision.HandLandmarker,
+                                vision.HandLandmarkerOptions, "detect"),
+    "pose_landmarker": TaskSpec("vision", vision.PoseLandmarker,
+                                vision.PoseLandmarkerOptions, "detect"),
+    "gesture_recognizer": TaskSpec("vision", vision.GestureRecognizer,
+                                   vision.GestureRecognizerOptions,
+                                   "recognize"),
+    "image_classifier": TaskSpec("vision", vision.ImageClassifier,
+                                 vision.ImageClassifierOptions, "classify"),
+    "audio_classifier": TaskSpec("audio", audio.AudioClassifier,
+                                 audio.AudioClassifierOptions, "classify"),
+    "text_classifier": TaskSpec("text", text.TextClassifier,
+                                text.TextClassifierOptions, "classify"),
+}
+
+IMAGE_EXTENSIONS = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+# Length of the clips fed to the audio classifier, matching the input of the
+# YAMNet model used by the audio example.
+AUDIO_CLIP_SAMPLES = 15600
+AUDIO_SAMPLE_RATE = 16000
+
+SYNTHETIC_TEXTS = (
+    "The food was great and the staff were very friendly.",
+    "I waited an hour and nobody ever came to take our order.",
+    "An average movie with a couple of memorable scenes.",
+    "This is the best purchase I have made all year!",
+    "The battery died after two days and support never answered.",
+    "It does what it says, nothing more and nothing less.",
+)
+
+# Metrics compared between two reports, and whether higher values are better.
+COMPARED_METRICS = (
+    ("throughput_per_s", True),
+    ("init_ms", False),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("task_rss_mb", False),
+)
+
+_TASK = flags.DEFINE_enum(
+    "task", default=None, enum_values=list(TASKS),
+    help="Task to benchmark.")
+_MODEL = flags.DEFINE_string(
+    "model", default=None, help="Path of the .tflite or .task model.")
+_INPUT = flags.DEFINE_string(
+    "input", default=None,
+    help="Recorded input to replay: a video file or image folder for vision "
+    "tasks, a 16-bit PCM WAV file for the audio classifier, or a text file "
+    "with one input per line for the text classifier. Synthetic input is "
+    "generated if not set.")
+_NUM_INPUTS = flags.DEFINE_integer(
+    "num_inputs", default=100, help="Max number of inputs to replay.")
+_WARMUP = flags.DEFINE_integer(
+    "warmup", default=5,
+    help="Number of inputs run before timing starts, not counted in the "
+    "results.")
+_IMAGE_WIDTH = flags.DEFINE_integer(
+    "image_width", default=640, help="Width of the synthetic images.")
+_IMAGE_HEIGHT = flags.DEFINE_integer(
+    "image_height", default=480, help="Height of the synthetic images.")
+_SEED = flags.DEFINE_integer(
+    "seed", default=0, help="Seed of the synthetic input generator.")
+_OUTPUT = flags.DEFINE_string(
+    "output", default=None,
+    help="Path of the JSON report to write. Printed to stdout if not set.")
+_COMPARE = flags.DEFINE_list(
+    "compare", default=None,
+    help="Paths of a baseline and a candidate report to compare instead of "
+    "running a benchmark.")
+_MAX_REGRESSION_PCT = flags.DEFINE_float(
+    "max_regression_pct", default=None,
+    help="With --compare, exit with an error if any metric of the candidate "
+    "is worse than the baseline by more than this percentage.")
+
+
+def _peak_rss_mb() -> float:
+  """Returns the peak resident set size of this process in MB."""
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS reports bytes.
+  if sys.platform == "darwin":
+    return peak_rss / (1024 * 1024)
+  return peak_rss / 1024
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+  """Returns a memory field of /proc/self/status in MB, None if missing."""
+  try:
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith(field + ":"):
+          return int(line.split()[1]) / 1024
+  except OSError:
+    pass
+  return None
+
+
+def _reset_peak_rss() -> Optional[float]:
+  """Resets the peak resident set size to the current one where possible.
+
+  Returns:
+    The current resident set size in MB, from which the peak is measured
+    again, or None if the peak can't be reset, e.g. on macOS.
+  """
+  try:
+    # Writing 5 resets VmHWM, the peak RSS of the process, on Linux 4.0+.
+    with open("/proc/self/clear_refs", "w") as f:
+      f.write("5")
+  except OSError:
+    return None
+  return _proc_status_mb("VmRSS")
+
+
+def _file_sha256(path: str) -> str:
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _synthetic_images(num_inputs, width, height, seed):
+  """Returns reproducible RGB images with smooth gradients and some noise."""
+  rng = np.random.default_rng(seed)
+  y, x = np.mgrid[0:height, 0:width]
+  images = []
+  for i in range(num_inputs):
+    phase = 2 * np.pi * i / max(num_inputs, 1)
+    base = np.stack([
+        127 + 100 * np.sin(x / 37 + phase),
+        127 + 100 * np.sin(y / 23 - phase),
+        127 + 100 * np.sin((x + y) / 51 + phase),
+    ], axis=-1)
+    noise = rng.normal(0, 12, size=base.shape)
+    images.append(np.clip(base + noise, 0, 255).astype(np.uint8))
+  return images
+
+
+def _folder_images(input_path, num_inputs):
+  """Returns the RGB images of a folder in file name order."""
+  names = [
+      name for name in sorted(os.listdir(input_path))
+      if name.lower().endswith(IMAGE_EXTENSIONS)
+  ]
+  images = []
+  for name in names[:num_inputs]:
+    image = cv2.imread(os.path.join(input_path, name))
+    if image is not None:
+      images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+  return images
+
+
+def _video_frames(input_path, num_inputs):
+  """Returns the RGB frames of a video file and its frame rate."""
+  images = []
+  cap = cv2.VideoCapture(input_path)
+  if not cap.isOpened():
+    raise ValueError(f"Unable to open video file {input_path}.")
+  try:
+    while len(images) < num_inputs:
+      success, image = cap.read()
+      if not success:
+        break
+      images.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+  finally:
+    cap.release()
+  return images, fps
+
+
+def _audio_clips(input_path, num_inputs, seed):
+  """Returns audio clips as (samples, sample rate) pairs."""
+  if input_path is None:
+    rng = np.random.default_rng(seed)
+    t = np.arange(AUDIO_CLIP_SAMPLES) / AUDIO_SAMPLE_RATE
+    clips = []
+    for i in range(num_inputs):
+      frequency = 220 * 2 ** (i % 24 / 12)
+      samples = 0.5 * np.sin(2 * np.pi * frequency * t)
+      samples += rng.normal(0, 0.05, size=t.shape)
+      clips.append((samples.astype(np.float32), AUDIO_SAMPLE_RATE))
+    return clips
+
+  with wave.open(input_path, "rb") as wav_file:
+    if wav_file.getsampwidth() != 2:
+      raise ValueError("Only 16-bit PCM WAV files are supported.")
+    sample_rate = wav_file.getframerate()
+    num_channels = wav_file.getnchannels()
+    clip_frames = AUDIO_CLIP_SAMPLES * sample_rate // AUDIO_SAMPLE_RATE
+    clips = []
+    while len(clips) < num_inputs:
+      data = wav_file.readframes(clip_frames)
+      if len(data) < clip_frames * num_channels * 2:
+        break
+      samples = np.frombuffer(data, dtype="<i2").reshape(-1, num_channels)
+      samples = samples.mean(axis=1, dtype=np.float32) / 32768
+      clips.append((samples, sample_rate))
+  return clips
+
+
+def _texts(input_path, num_inputs):
+  """Returns the texts to classify."""
+  if input_path is None:
+    return [SYNTHETIC_TEXTS[i % len(SYNTHETIC_TEXTS)]
+            for i in range(num_inputs)]
+  with open(input_path) as f:
+    lines = [line.strip() for line in f]
+  return [line for line in lines if line][:num_inputs]
+
+
+def load_inputs(spec, input_path, num_inputs, image_width, image_height,
+                seed):
+  """Loads all inputs in memory, so that reading them isn't timed.
+
+  Returns:
+    The task method arguments of each input, and whether the method to call
+    is the `_for_video` variant.
+  """
+  if spec.modality == "text":
+    return [(t,) for t in _texts(input_path, num_inputs)], False
+  if spec.modality == "audio":
+    return [(containers.AudioData.create_from_array(samples, sample_rate),)
+            for samples, sample_rate in _audio_clips(input_path, num_inputs,
+                                                     seed)], False
+
+  if input_path is None:
+    images = _synthetic_images(num_inputs, image_width, image_height, seed)
+  elif os.path.isdir(input_path):
+    images = _folder_images(input_path, num_inputs)
+  else:
+    # Videos are replayed in VIDEO mode, as the examples do, so that the
+    # landmarkers track between frames.
+    images, fps = _video_frames(input_path, num_inputs)
+    return [(mp.Image(image_format=mp.ImageFormat.SRGB, data=image),
+             round(index * 1000 / fps))
+            for index, image in enumerate(images)], True
+  return [(mp.Image(image_format=mp.ImageFormat.SRGB, data=image),)
+          for image in images], False
+
+
+def _create_task(spec, model, is_video):
+  base_options = python.BaseOptions(model_asset_path=model)
+  if spec.modality == "vision":
+    running_mode = (vision.RunningMode.VIDEO if is_video
+                    else vision.RunningMode.IMAGE)
+    options = spec.options_class(base_options=base_options,
+                                 running_mode=running_mode)
+  else:
+    options = spec.options_class(base_options=base_options)
+  return spec.task_class.create_from_options(options)
+
+
+def run_benchmark(task_name, model, input_path, num_inputs, warmup,
+                  image_width, image_height, seed) -> Dict[str, Any]:
+  """Benchmarks a task and returns the report.
+
+  Args:
+    task_name: Name of the task, one of `TASKS`.
+    model: Path of the model.
+    input_path: Path of the recorded input, or None for synthetic input.
+    num_inputs: Max number of inputs to replay.
+    warmup: Number of inputs run before timing starts.
+    image_width: Width of the synthetic images.
+    image_height: Height of the synthetic images.
+    seed: Seed of the synthetic input generator.
+  """
+  spec = TASKS[task_name]
+  inputs, is_video = load_inputs(spec, input_path, num_inputs, image_width,
+                                 image_height, seed)
+  if not inputs:
+    raise ValueError("No input to replay.")
+  # The decoded inputs stay in memory, so the memory of the task is measured
+  # from here, where they are all loaded.
+  gc.collect()
+  rss_before_init_mb = _reset_peak_rss()
+  if rss_before_init_mb is None:
+    # The peak includes loading the inputs, so it's only an upper bound.
+    rss_before_init_mb = _peak_rss_mb()
+
+  init_start_time = time.perf_counter()
+  task = _create_task(spec, model, is_video)
+  init_ms = (time.perf_counter() - init_start_time) * 1000
+
+  latencies_ms = []
+  with task:
+    process = getattr(task, spec.method_name + ("_for_video" if is_video
+                                                else ""))
+    for args in inputs[:warmup]:
+      process(*args)
+    # Timestamps of VIDEO mode must keep increasing, so the timed run
+    # replays the video again after those of the warmup.
+    timestamp_offset_ms = inputs[min(warmup, len(inputs)) - 1][-1] + 1 if (
+        is_video and warmup) else 0
+
+    run_start_time = time.perf_counter()
+    for args in inputs:
+      if is_video:
+        args = (args[0], args[1] + timestamp_offset_ms)
+      start_time = time.perf_counter()
+      process(*args)
+      latencies_ms.append((time.perf_counter() - start_time) * 1000)
+    run_time = time.perf_counter() - run_start_time
+
+  latencies_ms = np.array(latencies_ms)
+  peak_rss_mb = _proc_status_mb("VmHWM") or _peak_rss_mb()
+  return {
+      "task": task_name,
+      "model": os.path.basename(model),
+      "model_sha256": _file_sha256(model),
+      "input": input_path or "synthetic",
+      "num_inputs": len(inputs),
+      "warmup": warmup,
+      "seed": seed,
+      "mediapipe_version": getattr(mp, "__version__", "unknown"),
+      "python_version": platform.python_version(),
+      "platform": platform.platform(),
+      "machine": platform.machine(),
+      "init_ms": init_ms,
+      "throughput_per_s": len(inputs) / run_time,
+      "latency_ms": {
+          "mean": float(latencies_ms.mean()),
+          "p50": float(np.percentile(latencies_ms, 50)),
+          "p95": float(np.percentile(latencies_ms, 95)),
+          "p99": float(np.percentile(latencies_ms, 99)),
+          "max": float(latencies_ms.max()),
+      },
+      "rss_before_init_mb": rss_before_init_mb,
+      "peak_rss_mb": peak_rss_mb,
+      "task_rss_mb": max(peak_rss_mb - rss_before_init_mb, 0.0),
+  }
+
+
+def _get_metric(report, name):
+  value = report
+  for key in name.split("."):
+    value = value[key]
+  return value
+
+
+def compare_reports(baseline: Dict[str, Any], candidate: Dict[str, Any],
+                    max_regression_pct: Optional[float]) -> List[str]:
+  """Prints how the candidate report differs from the baseline.
+
+  Args:
+    baseline: The report to compare against.
+    candidate: The report to compare.
+    max_regression_pct: Percentage by which a metric may get worse before it
+      counts as a regression, or None to not look for regressions.
+
+  Returns:
+    The names of the metrics that regressed.
+  """
+  for key in ("task", "input", "num_inputs"):
+    if baseline.get(key) != candidate.get(key):
+      print(f"WARNING: The reports differ in {key}: {baseline.get(key)} vs "
+            f"{candidate.get(key)}.")
+
+  regressions = []
+  print(f"{'metric':<20}{'baseline':>12}{'candidate':>12}{'change':>10}")
+  for name, higher_is_better in COMPARED_METRICS:
+    try:
+      old_value = _get_metric(baseline, name)
+      new_value = _get_metric(candidate, name)
+    except KeyError:
+      print(f"{name:<20}{'missing in one of the reports':>34}")
+      continue
+    change_pct = (new_value - old_value) / old_value * 100 if old_value else 0
+    print(f"{name:<20}{old_value:>12.2f}{new_value:>12.2f}"
+          f"{change_pct:>+9.1f}%")
+    worse_pct = -change_pct if higher_is_better else change_pct
+    if max_regression_pct is not None and worse_pct > max_regression_pct:
+      regressions.append(name)
+  return regressions
+
+
+def main(_) -> None:
+  if _COMPARE.value:
+    if len(_COMPARE.value) != 2:
+      raise app.UsageError("--compare takes a baseline and a candidate path.")
+    reports = []
+    for path in _COMPARE.value:
+      with open(path) as f:
+        reports.append(json.load(f))
+    regressions = compare_reports(reports[0], reports[1],
+                                  _MAX_REGRESSION_PCT.value)
+    if regressions:
+      sys.exit(f"Regressed by more than {_MAX_REGRESSION_PCT.value}%: "
+               f"{', '.join(regressions)}")
+    return
+
+  if not _TASK.value or not _MODEL.value:
+    raise app.UsageError("--task and --model are required.")
+  report = run_benchmark(_TASK.value, _MODEL.value, _INPUT.value,
+                         _NUM_INPUTS.value, _WARMUP.value, _IMAGE_WIDTH.value,
+                         _IMAGE_HEIGHT.value, _SEED.value)
+  report_json = json.dumps(report, indent=2)
+  if _OUTPUT.value:
+    with open(_OUTPUT.value, "w") as f:
+      f.write(report_json + "\n")
+  else:
+    print(report_json)
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,162 @@
+"""Reads and writes packed weight archives of the image generator.
+
+An archive holds every weight in one file, which is much faster to write,
+copy and open than one file per weight. It starts with an 8 byte magic
+string, the size of the index as a little endian uint64, and the index as
+JSON. The index lists the name, byte offset, byte size, shape and dtype of
+each weight. The weights follow as raw little endian values, each starting
+at a multiple of the alignment, so they can be memory-mapped in place.
+
+Use unpack.py to list the weights of an archive, or to unpack them back into
+one `.bin` file per weight.
+"""
+
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+ARCHIVE_NAME = "weights.pack"
+MAGIC = b"MPWPACK1"
+# 16 KB covers the page size of the common 4 KB and 16 KB page systems.
+ALIGNMENT = 16384
+_HEADER = struct.Struct("<8sQ")
+
+
+def _align(offset, alignment):
+  return -(-offset // alignment) * alignment
+
+
+class ArchiveWriter(object):
+  """Writes an archive whose layout is planned from the weight shapes.
+
+  The index is written first and the file is sized up front, so weights can
+  then be written in any order, from several threads at once. The archive is
+  written under a temporary name and only renamed to its final name once
+  closed without error.
+  """
+
+  def __init__(self, path, shapes, dtype="float16", alignment=ALIGNMENT):
+    """Plans the layout and writes the index.
+
+    Args:
+      path: Path of the archive to write.
+      shapes: The name and shape of each weight, in the order to store them.
+      dtype: NumPy dtype name of all weights.
+      alignment: Byte alignment of the start of each weight.
+    """
+    self._path = path
+    self._temp_path = path + ".tmp"
+    item_size = np.dtype(dtype).itemsize
+    entries = []
+    offset = 0
+    for name, shape in shapes:
+      size = int(np.prod(shape, dtype=np.int64)) * item_size
+      entries.append({
+          "name": name,
+          "offset": offset,
+          "size": size,
+          "shape": [int(d) for d in shape],
+          "dtype": dtype,
+      })
+      offset = _align(offset + size, alignment)
+
+    # Offsets depend on the size of the index, which depends on the offsets,
+    # so make room for the largest the index can get by shifting all of them.
+    index = {"version": 1, "alignment": alignment, "tensors": entries}
+    data_start = _align(
+        _HEADER.size + len(json.dumps(index)) + 32 * len(entries) + 64,
+        alignment)
+    for entry in entries:
+      entry["offset"] += data_start
+    index_bytes = json.dumps(index).encode("utf-8")
+    if _HEADER.size + len(index_bytes) > data_start:
+      raise ValueError("The index doesn't fit before the weights")
+    self._entries = {entry["name"]: entry for entry in entries}
+
+    with open(self._temp_path, "wb") as f:
+      f.write(_HEADER.pack(MAGIC, len(index_bytes)))
+      f.write(index_bytes)
+      f.truncate(max((entry["offset"] + entry["size"] for entry in entries),
+                     default=data_start))
+
+  def write_tensor(self, name, chunks):
+    """Writes the values of a weight. Safe to call from several threads.
+
+    Args:
+      name: Name of the weight.
+      chunks: Consecutive pieces of the raw values, as bytes-like objects.
+    """
+    entry = self._entries[name]
+    written = 0
+    with open(self._temp_path, "r+b") as f:
+      f.seek(entry["offset"])
+      for chunk in chunks:
+        written += memoryview(chunk).nbytes
+        if written > entry["size"]:
+          break
+        f.write(chunk)
+    if written != entry["size"]:
+      raise ValueError(f"{name} has {written} bytes, expected {entry['size']}")
+
+  def close(self):
+    os.replace(self._temp_path, self._path)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    elif os.path.exists(self._temp_path):
+      os.remove(self._temp_path)
+
+
+class Archive(object):
+  """Memory-maps an archive and returns its weights without copying them."""
+
+  def __init__(self, path):
+    """Opens an archive.
+
+    Args:
+      path: Path of the archive.
+    """
+    with open(path, "rb") as f:
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, index_size = _HEADER.unpack_from(self._mmap)
+    if magic != MAGIC:
+      self._mmap.close()
+      raise ValueError(f"{path} is not a weight archive")
+    index = json.loads(self._mmap[_HEADER.size:_HEADER.size + index_size])
+    self.entries = {entry["name"]: entry for entry in index["tensors"]}
+
+  def names(self):
+    """Returns the names of the weights, in storage order."""
+    return list(self.entries)
+
+  def __getitem__(self, name):
+    """Returns a read-only array viewing the weight in the mapped file."""
+    entry = self.entries[name]
+    dtype = np.dtype(entry["dtype"]).newbyteorder("<")
+    return np.frombuffer(
+        self._mmap, dtype, count=entry["size"] // dtype.itemsize,
+        offset=entry["offset"]).reshape(entry["shape"])
+
+  def unpack(self, output_path):
+    """Writes each weight to `<name>.bin` in a folder, as convert.py does."""
+    os.makedirs(output_path, exist_ok=True)
+    for name, entry in self.entries.items():
+      with open(os.path.join(output_path, f"{name}.bin"), "wb") as f:
+        f.write(self._mmap[entry["offset"]:entry["offset"] + entry["size"]])
+
+  def close(self):
+    self._mmap.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
@@ -0,0 +1,163 @@
+"""Content-addressed local cache for the side assets of the converter.
+
+Assets such as the tokenizer vocab are stored in the cache directory under
+the SHA-256 of their content, and `urls.json` maps each source URL to the
+hash of what it served. Once an asset is cached, either downloaded or
+provisioned from a local file, it is placed into output folders without any
+network access, hard-linked when possible and copied otherwise.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "image_generator_converter")
+
+_URL_INDEX_NAME = "urls.json"
+
+
+def hash_file(path, block_size=1 << 24):
+  """Returns the SHA-256 of a file's content."""
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(block_size), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def _check_sha256(name, actual, expected):
+  if expected and actual != expected.lower():
+    raise ValueError(
+        f"Checksum mismatch for {name}: got {actual}, expected {expected}")
+
+
+class AssetCache(object):
+  """Stores assets under the hash of their content."""
+
+  def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+    """Opens a cache directory, creating it if needed.
+
+    Args:
+      cache_dir: Directory holding the cached assets.
+    """
+    self._cache_dir = cache_dir
+    self._blob_dir = os.path.join(cache_dir, "sha256")
+    os.makedirs(self._blob_dir, exist_ok=True)
+
+  def _blob_path(self, sha256):
+    return os.path.join(self._blob_dir, sha256)
+
+  def _read_url_index(self):
+    try:
+      with open(os.path.join(self._cache_dir, _URL_INDEX_NAME)) as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return {}
+
+  def _record_url(self, url, sha256):
+    index = self._read_url_index()
+    index[url] = sha256
+    index_path = os.path.join(self._cache_dir, _URL_INDEX_NAME)
+    with open(index_path + ".tmp", "w") as f:
+      json.dump(index, f, indent=2)
+    os.replace(index_path + ".tmp", index_path)
+
+  def _cached(self, sha256):
+    """Returns the path of a cached asset, or None if missing or corrupt."""
+    blob_path = self._blob_path(sha256)
+    if not os.path.exists(blob_path):
+      return None
+    if hash_file(blob_path) != sha256:
+      os.remove(blob_path)
+      return None
+    return blob_path
+
+  def _store(self, temp_path, sha256):
+    blob_path = self._blob_path(sha256)
+    # mkstemp creates files readable by their owner only, and hard links
+    # installed into output folders share the mode of the blob.
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, blob_path)
+    return blob_path
+
+  def add(self, path, url=None, sha256=None):
+    """Copies a local file into the cache.
+
+    Args:
+      path: The file to add.
+      url: URL the file stands in for, so later lookups of that URL find it.
+      sha256: Expected SHA-256 of the file, checked if given.
+
+    Returns:
+      The path of the cached asset.
+    """
+    actual = hash_file(path)
+    _check_sha256(path, actual, sha256)
+    blob_path = self._cached(actual)
+    if blob_path is None:
+      fd, temp_path = tempfile.mkstemp(dir=self._blob_dir)
+      os.close(fd)
+      shutil.copyfile(path, temp_path)
+      blob_path = self._store(temp_path, actual)
+    if url:
+      self._record_url(url, actual)
+    return blob_path
+
+  def fetch(self, url, sha256=None):
+    """Returns the path of a cached asset, downloading it only if missing.
+
+    Args:
+      url: URL of the asset.
+      sha256: Expected SHA-256 of the asset. If not given, the hash recorded
+        when the URL was first downloaded is used.
+
+    Returns:
+      The path of the cached asset.
+    """
+    known = sha256.lower() if sha256 else self._read_url_index().get(url)
+    blob_path = self._cached(known) if known else None
+    if blob_path is not None:
+      return blob_path
+
+    # requests is only needed when something has to be downloaded.
+    import requests  # pylint: disable=g-import-not-at-top
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=self._blob_dir)
+    try:
+      with os.fdopen(fd, "wb") as f, requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        for c in response.iter_content(chunk_size=1 << 16):
+          digest.update(c)
+          f.write(c)
+      _check_sha256(url, digest.hexdigest(), sha256)
+    except BaseException:
+      os.remove(temp_path)
+      raise
+    blob_path = self._store(temp_path, digest.hexdigest())
+    self._record_url(url, digest.hexdigest())
+    return blob_path
+
+
+def install(blob_path, dest):
+  """Places a cached asset at `dest`, hard-linked if possible.
+
+  Nothing is written if `dest` already has the same content. Hard links fail
+  across file systems, in which case the asset is copied.
+  """
+  if os.path.exists(dest):
+    if os.path.samefile(blob_path, dest) or (
+        os.path.getsize(dest) == os.path.getsize(blob_path) and
+        hash_file(dest) == os.path.basename(blob_path)):
+      return
+  temp_path = dest + ".tmp"
+  if os.path.exists(temp_path):
+    os.remove(temp_path)
+  try:
+    os.link(blob_path, temp_path)
+  except OSError:
+    shutil.copyfile(blob_path, temp_path)
+  os.replace(temp_path, dest)
@@ -1,51 +1,354 @@
 """Helper script to convert diffusion checkpoints to format used by image generator."""
 
+import concurrent.futures
+import hashlib
+import json
 import os
+import sys
+import threading
 
 from absl import app
 from absl import flags
-import requests
 import torch as th
 
+import archive
+import assets
+
 
 _CKPT_PATH = flags.DEFINE_string(
-    "ckpt_path", default=None, help="Path to checkpoint file", required=True)
+    "ckpt_path", default=None,
+    help="Path to checkpoint file. Required unless --verify is set",
+    required=False)
 _OUTPUT_PATH = flags.DEFINE_string(
     "output_path", default="bins", help="Output folder path", required=False)
+_NUM_WORKERS = flags.DEFINE_integer(
+    "num_workers", default=os.cpu_count() or 1,
+    help="Number of tensors converted in parallel", required=False)
+_CHUNK_SIZE_MB = flags.DEFINE_integer(
+    "chunk_size_mb", default=64,
+    help="Size of the pieces each tensor is converted and written in, in MB",
+    required=False)
+_VERIFY = flags.DEFINE_bool(
+    "verify", default=False,
+    help="Only check the files in the output folder against its manifest",
+    required=False)
+_OUTPUT_FORMAT = flags.DEFINE_enum(
+    "output_format", default="bins", enum_values=["bins", "archive"],
+    help="Write one .bin file per tensor, or all tensors to a single "
+    f"page-aligned {archive.ARCHIVE_NAME} archive", required=False)
+
+_VOCAB_PATH = flags.DEFINE_string(
+    "vocab_path", default=None,
+    help="Local copy of the tokenizer vocab, used instead of downloading it. "
+    "It is added to the cache, so later runs don't need it", required=False)
+_VOCAB_SHA256 = flags.DEFINE_string(
+    "vocab_sha256", default=None,
+    help="Expected SHA-256 of the tokenizer vocab. Checked if set",
+    required=False)
+_CACHE_DIR = flags.DEFINE_string(
+    "cache_dir", default=assets.DEFAULT_CACHE_DIR,
+    help="Directory caching downloaded assets such as the tokenizer vocab",
+    required=False)
 
 VOCAB_URL = "https://openaipublic.blob.core.windows.net/clip/bpe_simple_vocab_16e6.txt"
 
+# Name of the file in the output folder recording what was converted. It has
+# one JSON entry per line, and later entries replace earlier ones with the
+# same name.
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def load_tensors(ckpt_path):
+  """Opens a checkpoint without reading its tensors into memory.
+
+  `.safetensors` files are read with safetensors, which loads one tensor at a
+  time. Other checkpoints are memory-mapped by `torch.load`, falling back to
+  a regular load for legacy checkpoints and older PyTorch versions.
+
+  Args:
+    ckpt_path: Source checkpoint path
+
+  Returns:
+    The names of the tensors in the checkpoint, a function returning the
+    tensor with a given name, and one returning its shape without loading it.
+  """
+  if ckpt_path.endswith(".safetensors"):
+    # safetensors is only needed for this format.
+    from safetensors import safe_open  # pylint: disable=g-import-not-at-top
+    ckpt = safe_open(ckpt_path, framework="pt", device="cpu")
+    return (list(ckpt.keys()), ckpt.get_tensor,
+            lambda k: tuple(ckpt.get_slice(k).get_shape()))
+
+  try:
+    ckpt = th.load(ckpt_path, map_location="cpu", mmap=True)
+  except (TypeError, RuntimeError):
+    ckpt = th.load(ckpt_path, map_location="cpu")
+  state_dict = ckpt.get("state_dict", ckpt)
+  names = [k for k, v in state_dict.items() if hasattr(v, "numpy")]
+  return names, state_dict.__getitem__, lambda k: tuple(state_dict[k].shape)
+
+
+def hash_tensor(tensor, chunk_size):
+  """Returns the SHA-256 of a tensor's dtype, shape and values."""
+  digest = hashlib.sha256(f"{tensor.dtype}{tuple(tensor.shape)}".encode())
+  values = tensor.reshape(-1)
+  for start in range(0, values.numel(), chunk_size):
+    chunk = values[start:start + chunk_size].contiguous().view(th.uint8)
+    digest.update(memoryview(chunk.numpy()))
+  return digest.hexdigest()
+
+
+def float16_chunks(tensor, chunk_size):
+  """Yields the values of a tensor as float16 arrays of `chunk_size` values.
+
+  Only one chunk is converted at once, so memory use doesn't grow with the
+  size of the tensor.
+  """
+  values = tensor.reshape(-1)
+  for start in range(0, values.numel(), chunk_size):
+    yield values[start:start + chunk_size].to(th.float16).numpy()
+
+
+def convert_tensor(tensor, output_bin_file, chunk_size):
+  """Writes a tensor as raw float16 values, a chunk at a time.
+
+  The file is written under a temporary name first, so an interrupted run
+  never leaves a truncated file behind.
+
+  Args:
+    tensor: The tensor to convert.
+    output_bin_file: Path of the file to write.
+    chunk_size: Number of values converted at once.
+
+  Returns:
+    The SHA-256 and the size in bytes of the written file.
+  """
+  digest = hashlib.sha256()
+  size = 0
+  temp_file = output_bin_file + ".tmp"
+  with open(temp_file, "wb") as f:
+    for chunk in float16_chunks(tensor, chunk_size):
+      chunk = memoryview(chunk)
+      digest.update(chunk)
+      f.write(chunk)
+      size += chunk.nbytes
+  os.replace(temp_file, output_bin_file)
+  return digest.hexdigest(), size
+
+
+def read_manifest(output_path):
+  """Returns the manifest entries of an output folder, keyed by tensor name.
+
+  A line cut short by an interrupted run is ignored.
+  """
+  entries = {}
+  manifest_path = os.path.join(output_path, MANIFEST_NAME)
+  if not os.path.exists(manifest_path):
+    return entries
+  with open(manifest_path) as f:
+    for line in f:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        continue
+      entries[entry["name"]] = entry
+  return entries
+
+
+def write_manifest(output_path, entries):
+  """Replaces the manifest of an output folder with the given entries."""
+  manifest_path = os.path.join(output_path, MANIFEST_NAME)
+  with open(manifest_path + ".tmp", "w") as f:
+    for entry in entries:
+      f.write(json.dumps(entry) + "\n")
+  os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def is_up_to_date(entry, output_path, source_sha256):
+  """Returns whether the output of a manifest entry matches its source."""
+  if entry is None or entry["source_sha256"] != source_sha256:
+    return False
+  output_bin_file = os.path.join(output_path, entry["file"])
+  return (os.path.exists(output_bin_file) and
+          os.path.getsize(output_bin_file) == entry["size"])
+
 
-def run(ckpt_path, output_path):
+def verify(output_path, num_workers=1):
+  """Checks the files of an output folder against its manifest.
+
+  Args:
+    output_path: Result folder directory
+    num_workers: Number of files hashed in parallel
+
+  Returns:
+    A description of each missing or modified file.
+  """
+  entries = read_manifest(output_path)
+  if not entries:
+    return [f"No manifest found in {output_path}"]
+
+  def check(entry):
+    output_bin_file = os.path.join(output_path, entry["file"])
+    if not os.path.exists(output_bin_file):
+      return f"{entry['file']}: missing"
+    if os.path.getsize(output_bin_file) != entry["size"]:
+      return f"{entry['file']}: size differs from the manifest"
+    if assets.hash_file(output_bin_file) != entry["output_sha256"]:
+      return f"{entry['file']}: content differs from the manifest"
+    return None
+
+  with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+    return [problem for problem in executor.map(check, entries.values())
+            if problem]
+
+
+def write_archive(names, get_tensor, get_shape, output_path, num_workers,
+                  chunk_size):
+  """Converts the tensors into a single packed archive.
+
+  The archive is always written in full, the manifest only tracks the
+  per-tensor files.
+
+  Args:
+    names: Names of the tensors to convert, in the order to store them
+    get_tensor: Returns the tensor with a given name
+    get_shape: Returns the shape of the tensor with a given name
+    output_path: Result folder directory
+    num_workers: Number of tensors converted in parallel
+    chunk_size: Number of values converted at once
+  """
+  archive_path = os.path.join(output_path, archive.ARCHIVE_NAME)
+  shapes = [(k, get_shape(k)) for k in names]
+  with archive.ArchiveWriter(archive_path, shapes) as writer:
+
+    def convert(k):
+      writer.write_tensor(k, float16_chunks(get_tensor(k), chunk_size))
+
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+      list(executor.map(convert, names))
+  print(f"Converted {len(names)} tensors to {archive_path}")
+
+
+def provision_vocab(output_path, vocab_path=None, vocab_sha256=None,
+                    cache_dir=assets.DEFAULT_CACHE_DIR):
+  """Places the tokenizer vocab in the output folder.
+
+  The vocab comes from the asset cache, which is filled from `vocab_path` if
+  given and otherwise downloaded once from `VOCAB_URL`. A vocab already in
+  the output folder is kept, and added to the cache, without any network
+  access if it matches `vocab_sha256`, or if no checksum is given.
+
+  Args:
+    output_path: Result folder directory
+    vocab_path: Local copy of the vocab, or None
+    vocab_sha256: Expected SHA-256 of the vocab, or None
+    cache_dir: Asset cache directory
+  """
+  cache = assets.AssetCache(cache_dir)
+  dest = os.path.join(output_path, os.path.basename(VOCAB_URL))
+  if not vocab_path and os.path.exists(dest) and (
+      not vocab_sha256 or assets.hash_file(dest) == vocab_sha256.lower()):
+    cache.add(dest, url=VOCAB_URL)
+    return
+  if vocab_path:
+    blob_path = cache.add(vocab_path, url=VOCAB_URL, sha256=vocab_sha256)
+  else:
+    blob_path = cache.fetch(VOCAB_URL, sha256=vocab_sha256)
+  assets.install(blob_path, dest)
+
+
+def run(ckpt_path, output_path, num_workers=1, chunk_size_mb=64,
+        output_format="bins", vocab_path=None, vocab_sha256=None,
+        cache_dir=assets.DEFAULT_CACHE_DIR):
   """Converts the checkpoint and saves the result.
 
+  Tensors whose output is already up to date according to the manifest of
+  the output folder are skipped. The manifest is appended to as soon as each
+  tensor is written, so an interrupted run resumes where it stopped.
+
   Args:
     ckpt_path: Source checkpoint path
     output_path: Result folder directory
+    num_workers: Number of tensors converted in parallel
+    chunk_size_mb: Size of the pieces each tensor is converted in, in MB
+    output_format: "bins" for one file per tensor, "archive" for a single
+      packed archive
+    vocab_path: Local copy of the tokenizer vocab, or None to download it
+    vocab_sha256: Expected SHA-256 of the tokenizer vocab, or None
+    cache_dir: Directory caching the tokenizer vocab
   """
   os.makedirs(output_path, exist_ok=True)
-  ckpt = th.load(ckpt_path, map_location="cpu")
-
-  vocab_dest = os.path.join(output_path, os.path.basename(VOCAB_URL))
-  if not os.path.exists(vocab_dest):
-    with requests.get(VOCAB_URL, stream=True) as response:
-      with open(vocab_dest, "wb") as vocab_file:
-        for c in response.iter_content(chunk_size=8192):
-          vocab_file.write(c)
-
-  for k, v in ckpt["state_dict"].items():
-    if "first_stage_model.encoder" in k:
-      continue
-    if not hasattr(v, "numpy"):
-      continue
+  names, get_tensor, get_shape = load_tensors(ckpt_path)
+  names = [k for k in names if "first_stage_model.encoder" not in k]
+
+  provision_vocab(output_path, vocab_path, vocab_sha256, cache_dir)
+
+  # Chunks are measured in float16 values, the size they are written at.
+  chunk_size = max(chunk_size_mb * (1 << 20) // 2, 1)
+  if output_format == "archive":
+    write_archive(names, get_tensor, get_shape, output_path, num_workers,
+                  chunk_size)
+    return
+
+  manifest = read_manifest(output_path)
+  # Rewrite the manifest before appending to it, in case an interrupted run
+  # left a partial last line.
+  write_manifest(output_path, manifest.values())
+  manifest_lock = threading.Lock()
+  manifest_file = open(os.path.join(output_path, MANIFEST_NAME), "a")
+
+  def convert(k):
+    tensor = get_tensor(k)
+    source_sha256 = hash_tensor(tensor, chunk_size)
+    entry = manifest.get(k)
+    if is_up_to_date(entry, output_path, source_sha256):
+      return entry, False
     output_bin_file = os.path.join(output_path, f"{k}.bin")
-    v.numpy().astype("float16").tofile(output_bin_file)
+    output_sha256, size = convert_tensor(tensor, output_bin_file, chunk_size)
+    entry = {
+        "name": k,
+        "file": os.path.basename(output_bin_file),
+        "shape": list(tensor.shape),
+        "dtype": str(tensor.dtype),
+        "output_dtype": "float16",
+        "source_sha256": source_sha256,
+        "output_sha256": output_sha256,
+        "size": size,
+    }
+    with manifest_lock:
+      manifest_file.write(json.dumps(entry) + "\n")
+      manifest_file.flush()
+    return entry, True
+
+  # PyTorch, hashing and file writes release the GIL, so threads convert
+  # tensors in parallel. Each thread holds one tensor at most.
+  with manifest_file, concurrent.futures.ThreadPoolExecutor(
+      num_workers) as executor:
+    results = list(executor.map(convert, names))
+
+  # Compact the manifest down to one entry per tensor of this checkpoint.
+  write_manifest(output_path, [entry for entry, _ in results])
+  num_converted = sum(converted for _, converted in results)
+  print(f"Converted {num_converted} tensors to {output_path}, "
+        f"{len(results) - num_converted} were up to date")
 
 
 def main(_) -> None:
   ckpt_path = _CKPT_PATH.value
   output_path = _OUTPUT_PATH.value
-  run(ckpt_path, output_path)
+  if _VERIFY.value:
+    problems = verify(output_path, _NUM_WORKERS.value)
+    for problem in problems:
+      print(problem)
+    print(f"{len(problems)} problems found in {output_path}")
+    if problems:
+      sys.exit(1)
+    return
+  if not ckpt_path:
+    raise app.UsageError("--ckpt_path is required")
+  run(ckpt_path, output_path, _NUM_WORKERS.value, _CHUNK_SIZE_MB.value,
+      _OUTPUT_FORMAT.value, _VOCAB_PATH.value, _VOCAB_SHA256.value,
+      _CACHE_DIR.value)
 
 if __name__ == "__main__":
   app.run(main)
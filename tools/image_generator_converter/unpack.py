@@ -0,0 +1,28 @@
+"""Lists the weights of a packed archive, or unpacks them into .bin files."""
+
+from absl import app
+from absl import flags
+
+from archive import Archive
+
+
+_ARCHIVE_PATH = flags.DEFINE_string(
+    "archive_path", default=None, help="Path to the archive file",
+    required=True)
+_OUTPUT_PATH = flags.DEFINE_string(
+    "output_path", default=None,
+    help="Folder to unpack the weights to, one .bin file per weight. The "
+    "weights are only listed if not set", required=False)
+
+
+def main(_) -> None:
+  with Archive(_ARCHIVE_PATH.value) as archive:
+    if not _OUTPUT_PATH.value:
+      for name, entry in archive.entries.items():
+        print(f"{name} {entry['dtype']}{entry['shape']} {entry['size']} bytes")
+      return
+    archive.unpack(_OUTPUT_PATH.value)
+    print(f"Unpacked {len(archive.entries)} weights to {_OUTPUT_PATH.value}")
+
+if __name__ == "__main__":
+  app.run(main)